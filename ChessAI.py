@@ -1,4 +1,25 @@
+import os
 import random
+import threading
+import time
+
+import ChessBitbase
+import ChessBook
+from ChessBitboard import MOVE_PROMOTION
+from ChessEval import computeEval, tapered
+from ChessOrdering import MoveOrderer, capture_score
+from ChessSEE import see
+from ChessTT import TranspositionTable, EXACT, LOWER, UPPER
+
+CHECKMATE = 100000
+STALEMATE = 0
+MAX_DEPTH = 64
+# Mate scores are CHECKMATE minus the ply the mate happens at; anything above this is a mate
+MATE_THRESHOLD = CHECKMATE - 1000
+# Bitbase wins score above any evaluation and below every mate, plus the evaluation so the
+# search still prefers positions that make progress towards mate
+KNOWN_WIN = 20000
+
 
 def find_random_move(valid_moves):
     """
@@ -13,10 +34,357 @@ def find_random_move(valid_moves):
         # and "--" means an empty square.
         if hasattr(move, 'pieceCaptured') and move.pieceCaptured != "--":
             capture_moves.append(move)
-    
+
     if capture_moves:
         return random.choice(capture_moves)
-    
+
     # If no capture moves, pick any random valid move
     return random.choice(valid_moves)
 
+
+def evaluate(gs):
+    """Static evaluation in centipawns from the side to move's point of view"""
+    score = tapered(gs.midgameScore, gs.endgameScore, gs.phase)
+    return score if gs.whiteToMove else -score
+
+
+def evaluate_full(gs):
+    """evaluate() recomputed from the board instead of GameState's running sums"""
+    score = tapered(*computeEval(gs.bitboards.mailbox))
+    return score if gs.whiteToMove else -score
+
+
+class Searcher():
+    """
+    Negamax alpha-beta search with iterative deepening over GameState's packed moves.
+    The search stops when either budget runs out and keeps the best move of the deepest
+    iteration searched. nodes, cutoffs, depth, elapsed and nps describe the last search.
+    Pass a TranspositionTable as tt to reuse results across positions and searches.
+    Moves are ordered by a ChessOrdering.MoveOrderer whose history carries over between searches.
+    Pass ChessBitbase.Bitbases as bitbases to score covered endings exactly: at the root only
+    moves that keep the bitbase result are searched, and when the root is not covered, nodes
+    that reach a covered ending stop there.
+    Pass a ChessBook.OpeningBook as book to play a book move, when there is one, without searching.
+    """
+    CHECK_EVERY = 1024 # nodes between clock checks; the node limit is checked when it is reached
+    evaluate = staticmethod(evaluate) # leaf evaluation, overridable for comparisons
+    order_moves = True # False searches the hash move first and the rest in generation order
+    quiescence = True # False scores the horizon with evaluate() instead of resolving captures
+
+    def __init__(self, time_limit=None, node_limit=None, max_depth=MAX_DEPTH, info=None, tt=None, bitbases=None,
+                 book=None):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.info = info # called as info(searcher) after every completed iteration
+        self.tt = tt
+        self.bitbases = bitbases
+        self.book = book
+        self.ordering = MoveOrderer()
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0
+        self.cutoffs = 0 # beta cutoffs, in the main search and quiescence
+        self.depth = 0
+        self.score = 0
+        self.best_move = None
+        self.elapsed = 0.0
+        self.stopped = False
+        self.from_book = False # the last search played a book move
+        self._probe_bitbases = bool(self.bitbases)
+        self._next_check = self.CHECK_EVERY if self.node_limit is None else min(self.CHECK_EVERY, self.node_limit)
+        self._start = time.perf_counter()
+        self._deadline = None if self.time_limit is None else self._start + self.time_limit
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def stop(self):
+        """Asks a running search to return as soon as possible"""
+        self.stopped = True
+
+    def set_time_limit(self, time_limit):
+        """Gives a running search time_limit seconds from now (None: no limit), e.g. on a ponder hit"""
+        self.time_limit = time_limit
+        self._deadline = None if time_limit is None else time.perf_counter() + time_limit
+
+    def _check_budget(self):
+        self._next_check = self.nodes + self.CHECK_EVERY
+        if self.node_limit is not None:
+            if self.nodes >= self.node_limit:
+                self.stopped = True
+                return
+            self._next_check = min(self._next_check, self.node_limit)
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            self.stopped = True
+
+    def search(self, gs):
+        """Searches gs (restored on return) and returns the best move as a packed int, or None"""
+        self.reset()
+        root_moves = gs.getValidMoveCodes()
+        if not root_moves:
+            return None
+        if self.book is not None:
+            move = self.book.choose(gs)
+            if move is not None:
+                self.best_move = move
+                self.from_book = True
+                self.elapsed = time.perf_counter() - self._start
+                return move
+        if self._probe_bitbases:
+            result = self.bitbases.probe(gs)
+            if result is not None:
+                root_moves = self._bitbase_root_moves(gs, root_moves, result)
+                self._probe_bitbases = False # the root filter keeps the result; let the search find the mate
+        if self.order_moves:
+            self.ordering.new_search()
+            root_moves.sort(key=capture_score, reverse=True)
+        self.best_move = root_moves[0]
+        for depth in range(1, self.max_depth + 1):
+            best_move, score = self._search_root(gs, root_moves, depth)
+            if best_move is not None:
+                self.best_move, self.score = best_move, score
+            self.elapsed = time.perf_counter() - self._start
+            if self.stopped:
+                break
+            self.depth = depth
+            if self.info:
+                self.info(self)
+            if abs(score) >= MATE_THRESHOLD:
+                break
+            # Search the best move first next time so a cut-short iteration still refines it
+            root_moves.remove(self.best_move)
+            root_moves.insert(0, self.best_move)
+        self.elapsed = time.perf_counter() - self._start
+        return self.best_move
+
+    def _bitbase_root_moves(self, gs, moves, result):
+        """The moves whose resulting position keeps result, or all of them when none is known to"""
+        keep = []
+        for move in moves:
+            gs.makeMove(move)
+            child = self.bitbases.probe(gs)
+            gs.undoMove()
+            if child is None:
+                child = ChessBitbase.DRAW if move >> 20 & 15 else None # the lone king took the piece
+            if child == -result:
+                keep.append(move)
+        return keep or moves
+
+    def _bitbase_score(self, gs, result):
+        if result == ChessBitbase.DRAW:
+            return STALEMATE
+        return self.evaluate(gs) + (KNOWN_WIN if result == ChessBitbase.WIN else -KNOWN_WIN)
+
+    def _search_root(self, gs, moves, depth):
+        alpha = -CHECKMATE - 1
+        best_move = None
+        for move in moves:
+            gs.makeMove(move)
+            score = -self._negamax(gs, depth - 1, -CHECKMATE - 1, -alpha, 1)
+            gs.undoMove()
+            if self.stopped:
+                break
+            if score > alpha:
+                alpha, best_move = score, move
+        return best_move, alpha
+
+    def _negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self._next_check:
+            self._check_budget()
+        if self.stopped:
+            return 0
+        if self._probe_bitbases:
+            result = self.bitbases.probe(gs)
+            if result is not None:
+                return self._bitbase_score(gs, result)
+        if depth == 0:
+            return self._quiesce(gs, alpha, beta, ply) if self.quiescence else self.evaluate(gs)
+
+        tt = self.tt
+        hash_move = None
+        if tt is not None:
+            entry = tt.probe(gs.zobristKey)
+            if entry is not None:
+                hash_move, tt_depth, tt_score, tt_bound = entry
+                if tt_depth >= depth:
+                    tt_score = _score_from_tt(tt_score, ply)
+                    if tt_bound == EXACT or (tt_bound == LOWER and tt_score >= beta) \
+                            or (tt_bound == UPPER and tt_score <= alpha):
+                        return tt_score
+
+        moves = gs.getValidMoveCodes()
+        if not moves:
+            return -CHECKMATE + ply if gs.inCheck else STALEMATE
+        if self.order_moves:
+            moves = self.ordering.ordered(moves, hash_move, ply)
+        elif hash_move and hash_move in moves:
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+
+        original_alpha = alpha
+        best_score = -CHECKMATE - 1
+        best_move = None
+        for move in moves:
+            gs.makeMove(move)
+            score = -self._negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if self.order_moves:
+                            self.ordering.record_cutoff(move, depth, ply)
+                        break
+
+        if tt is not None:
+            if best_score <= original_alpha:
+                bound = UPPER
+            elif best_score >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            tt.store(gs.zobristKey, depth, _score_to_tt(best_score, ply), bound, best_move)
+        return best_score
+
+
+    def quiesce(self, gs):
+        """Score of gs with pending captures played out, from the side to move's point of view"""
+        if not self.quiescence:
+            return self.evaluate(gs)
+        return self._quiesce(gs, -CHECKMATE - 1, CHECKMATE + 1, 0)
+
+    def _quiesce(self, gs, alpha, beta, ply):
+        """
+        Searches captures and queen promotions only, until the position is quiet. The side
+        to move may stand pat on the static evaluation, except in check, where every
+        evasion is searched. Captures that lose material by SEE are skipped.
+        """
+        self.nodes += 1
+        if self.nodes >= self._next_check:
+            self._check_budget()
+        if self.stopped:
+            return 0
+        # Moves are generated once: every evasion in check, otherwise captures only, and only
+        # after standing pat has failed to cut off
+        in_check = gs.isInCheck()
+        if in_check:
+            moves = gs.getValidMoveCodes()
+            if not moves:
+                return -CHECKMATE + ply
+            best_score = -CHECKMATE - 1
+        else:
+            best_score = self.evaluate(gs)
+            if best_score >= beta:
+                return best_score
+            if best_score > alpha:
+                alpha = best_score
+            moves = gs.getValidMoveCodes(quiet=False)
+        moves.sort(key=capture_score, reverse=True)
+        for move in moves:
+            if not in_check:
+                if MOVE_PROMOTION <= move >> 12 & 15 < MOVE_PROMOTION + 3:
+                    continue # underpromotions
+                if see(gs.bitboards, move) < 0:
+                    continue
+            gs.makeMove(move)
+            score = -self._quiesce(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        break
+        return best_score
+
+
+def _score_to_tt(score, ply):
+    """Mate scores are stored relative to the node, not the root, so they stay valid elsewhere"""
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+_shared_tt = None
+_shared_bitbases = None
+_shared_book = None
+
+
+def _shared_tables():
+    """
+    The transposition table, bitbases and opening book shared by the UI's searches,
+    created on first use. The book is None when there is no ChessBook.DEFAULT_PATH.
+    """
+    global _shared_tt, _shared_bitbases, _shared_book
+    if _shared_tt is None:
+        _shared_tt = TranspositionTable()
+        _shared_bitbases = ChessBitbase.Bitbases()
+        _shared_book = ChessBook.load()
+    return _shared_tt, _shared_bitbases, _shared_book
+
+
+class BackgroundSearch():
+    """
+    Searches a copy of a position on a daemon thread. The caller polls done() and reads
+    result() (a packed move, or None) when it is set; cancel() stops the search early and
+    discards its result. on_done, if given, is called on the search thread when the search
+    ends, so an event-driven caller can be woken instead of polling.
+    """
+
+    def __init__(self, gs, time_limit=1.0, node_limit=None, max_depth=MAX_DEPTH, on_done=None):
+        tt, bitbases, book = _shared_tables()
+        # The UI keeps drawing and mutating gs, so the search gets its own GameState
+        self.position = gs.__class__(fen=gs.getFen())
+        self.searcher = Searcher(time_limit=time_limit, node_limit=node_limit, max_depth=max_depth,
+                                 tt=tt, bitbases=bitbases, book=book)
+        self.cancelled = False
+        self.on_done = on_done
+        self._result = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._result = self.searcher.search(self.position)
+        finally:
+            self._done.set()
+            if self.on_done:
+                self.on_done()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self):
+        return None if self.cancelled else self._result
+
+    def cancel(self):
+        self.cancelled = True
+        self.searcher.stop()
+
+
+# CHESS_PROFILE=<file> profiles the whole process; see ChessProfile
+if os.environ.get("CHESS_PROFILE"):
+    import ChessProfile
+    ChessProfile.enable_from_environment()
@@ -0,0 +1,238 @@
+"""
+Vectorized evaluation of many positions at once with NumPy.
+
+evaluate_batch() takes packed position records (ChessDataset.Dataset.array(), or any
+array of ChessDataset.record_dtype()) and evaluate_boards() takes piece codes as an
+(N, 64) array, one row per position in square order. Both return an int64 score per
+position from the side to move's point of view. The terms are ChessAI.evaluate's
+(tapered material and piece-square values, see ChessEval) plus mobility and pawn structure. evaluate_position()
+is the scalar reference for one GameState and gives the same number.
+
+Mobility and pawn terms run on one uint64 bitboard per position, so this module needs
+NumPy 2 (numpy.bitwise_count). Nothing else in the engine imports it.
+
+    python ChessBatchEval.py positions.dat          # score a dataset, report positions/s
+    python ChessBatchEval.py positions.dat --check  # compare every score with the reference
+"""
+import argparse
+import sys
+import time
+
+import numpy
+
+import ChessDataset
+from ChessBitboard import (EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, WHITE, BLACK,
+                           ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KNIGHT_OFFSETS, KNIGHT_ATTACKS, FILE_MASKS,
+                           RANK_MASKS, NOT_FILE_A, NOT_FILE_H,
+                           rookAttacks, bishopAttacks, queenAttacks, popcount, squares)
+from ChessEval import MIDGAME_VALUES, ENDGAME_VALUES, PIECE_PHASE, MAX_PHASE, computeEval, tapered
+
+# Centipawns per square a piece attacks that is not occupied by its own side
+MOBILITY_WEIGHTS = {KNIGHT: 4, BISHOP: 5, ROOK: 2, QUEEN: 1}
+DOUBLED_PAWN = -10 # per pawn beyond the first on a file
+ISOLATED_PAWN = -15 # per pawn with no friendly pawn on either neighbouring file
+# Bonus for a passed pawn by rank counted from its own side (1 = not yet moved)
+PASSED_PAWN_BONUS = (0, 5, 10, 20, 35, 60, 100, 0)
+
+SLIDER_DIRECTIONS = {BISHOP: BISHOP_DIRECTIONS, ROOK: ROOK_DIRECTIONS,
+                     QUEEN: ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+_SLIDER_ATTACKS = {BISHOP: bishopAttacks, ROOK: rookAttacks, QUEEN: queenAttacks}
+
+MIDGAME_ARRAY = numpy.array(MIDGAME_VALUES, dtype=numpy.int64)
+ENDGAME_ARRAY = numpy.array(ENDGAME_VALUES, dtype=numpy.int64)
+PHASE_ARRAY = numpy.array(PIECE_PHASE, dtype=numpy.int64)
+_SQUARES = numpy.arange(64)
+_SQUARE_SHIFTS = numpy.arange(64, dtype=numpy.uint64)
+_FILES = numpy.array(FILE_MASKS, dtype=numpy.uint64)
+_RANKS = numpy.array(RANK_MASKS, dtype=numpy.uint64)
+_NOT_FILE_A = numpy.uint64(NOT_FILE_A)
+_NOT_FILE_H = numpy.uint64(NOT_FILE_H)
+# _DESTINATIONS[dc]: squares a piece can land on after moving dc columns without wrapping round
+_DESTINATIONS = {dc: numpy.uint64(sum(FILE_MASKS[c] for c in range(8) if 0 <= c - dc < 8)) for dc in range(-2, 3)}
+_PASSED_WHITE = numpy.array(PASSED_PAWN_BONUS[::-1], dtype=numpy.int64) # by row
+_PASSED_BLACK = numpy.array(PASSED_PAWN_BONUS, dtype=numpy.int64)
+
+
+def evaluate_position(gs):
+    """Scalar reference: the batch score of one GameState, from the side to move's point of view"""
+    bitboards = gs.bitboards
+    occupied = bitboards.occupied
+    score = tapered(*computeEval(bitboards.mailbox))
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        notOwn = ~bitboards.colors[color]
+        for sq in squares(bitboards.pieces[color << 3 | KNIGHT]):
+            score += sign * MOBILITY_WEIGHTS[KNIGHT] * popcount(KNIGHT_ATTACKS[sq] & notOwn)
+        for pieceType, attacks in _SLIDER_ATTACKS.items():
+            for sq in squares(bitboards.pieces[color << 3 | pieceType]):
+                score += sign * MOBILITY_WEIGHTS[pieceType] * popcount(attacks(sq, occupied) & notOwn)
+
+    pawns = [[sq for sq in squares(bitboards.pieces[color << 3 | PAWN])] for color in (WHITE, BLACK)]
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        files = [0] * 8
+        for sq in pawns[color]:
+            files[sq & 7] += 1
+        for f, count in enumerate(files):
+            if count > 1:
+                score += sign * DOUBLED_PAWN * (count - 1)
+            if count and (f == 0 or not files[f - 1]) and (f == 7 or not files[f + 1]):
+                score += sign * ISOLATED_PAWN * count
+        for sq in pawns[color]:
+            row, col = sq >> 3, sq & 7
+            # An enemy pawn ahead on the same or a neighbouring file stops the pawn being passed
+            if not any(abs((other & 7) - col) <= 1 and ((other >> 3) < row if color == WHITE else (other >> 3) > row)
+                       for other in pawns[color ^ 1]):
+                score += sign * PASSED_PAWN_BONUS[7 - row if color == WHITE else row]
+    return score if gs.whiteToMove else -score
+
+
+def pack_positions(states):
+    """Packed records for an iterable of GameStates, as a structured array evaluate_batch() accepts"""
+    data = b"".join(gs.getPacked() for gs in states)
+    return numpy.frombuffer(data, dtype=ChessDataset.record_dtype())
+
+
+def unpack_boards(records):
+    """(N, 64) uint8 piece codes from packed records"""
+    occupied = records["occupied"].astype(numpy.uint64)
+    present = ((occupied[:, None] >> _SQUARE_SHIFTS) & numpy.uint64(1)).astype(bool)
+    packed = records["pieces"]
+    nibbles = numpy.empty((len(records), 32), dtype=numpy.uint8)
+    nibbles[:, 0::2] = packed & 15
+    nibbles[:, 1::2] = packed >> 4
+    # The k-th occupied square (in square order) holds the k-th nibble
+    index = numpy.clip(numpy.cumsum(present, axis=1) - 1, 0, 31)
+    return numpy.where(present, numpy.take_along_axis(nibbles, index, axis=1), 0).astype(numpy.uint8)
+
+
+def _shifted(bbs, shift):
+    return bbs << numpy.uint64(shift) if shift > 0 else bbs >> numpy.uint64(-shift)
+
+
+def _piece_sets(boards, code):
+    """Bitboard of the squares holding code, one uint64 per position"""
+    return numpy.packbits(boards == code, axis=1, bitorder="little").view("<u8").ravel()
+
+
+def _slide(pieces, empty, shift, mask):
+    """Squares the pieces attack in one direction, stopping at the first piece (Kogge-Stone fill)"""
+    empty = empty & mask
+    pieces = pieces | (empty & _shifted(pieces, shift))
+    empty = empty & _shifted(empty, shift)
+    pieces = pieces | (empty & _shifted(pieces, 2 * shift))
+    empty = empty & _shifted(empty, 2 * shift)
+    pieces = pieces | (empty & _shifted(pieces, 4 * shift))
+    return _shifted(pieces, shift) & mask
+
+
+def _neighbour_files(files):
+    """Every file's count added to its left and right neighbours' counts"""
+    total = files.copy()
+    total[:, 1:] += files[:, :-1]
+    total[:, :-1] += files[:, 1:]
+    return total
+
+
+def _mobility(boards, occupied, color):
+    own = (boards != EMPTY) & ((boards >> 3) == color)
+    notOwn = ~numpy.packbits(own, axis=1, bitorder="little").view("<u8").ravel()
+    empty = ~occupied
+    total = numpy.zeros(len(boards), dtype=numpy.int64)
+    # Shifting a whole piece set one direction at a time moves every piece to a different
+    # square, so the popcounts add up to the per-piece attack counts
+    knights = _piece_sets(boards, color << 3 | KNIGHT)
+    for dr, dc in KNIGHT_OFFSETS:
+        attacks = _shifted(knights, dr * 8 + dc) & _DESTINATIONS[dc] & notOwn
+        total += MOBILITY_WEIGHTS[KNIGHT] * numpy.bitwise_count(attacks)
+    for pieceType, directions in SLIDER_DIRECTIONS.items():
+        pieces = _piece_sets(boards, color << 3 | pieceType)
+        for dr, dc in directions:
+            attacks = _slide(pieces, empty, dr * 8 + dc, _DESTINATIONS[dc]) & notOwn
+            total += MOBILITY_WEIGHTS[pieceType] * numpy.bitwise_count(attacks)
+    return total
+
+
+def _pawn_structure(boards):
+    white = _piece_sets(boards, WHITE << 3 | PAWN)
+    black = _piece_sets(boards, BLACK << 3 | PAWN)
+    score = numpy.zeros(len(boards), dtype=numpy.int64)
+    for pawns, sign in ((white, 1), (black, -1)):
+        files = numpy.bitwise_count(pawns[:, None] & _FILES).astype(numpy.int64)
+        score += sign * DOUBLED_PAWN * numpy.maximum(files - 1, 0).sum(axis=1)
+        score += sign * ISOLATED_PAWN * (files * (_neighbour_files(files) == files)).sum(axis=1)
+    # A white pawn is passed unless a black pawn stands on a lower row of its own or a
+    # neighbouring file: fill every black pawn's file downwards and widen it by a file
+    behind = black << numpy.uint64(8)
+    behind |= behind << numpy.uint64(8)
+    behind |= behind << numpy.uint64(16)
+    behind |= behind << numpy.uint64(32)
+    passed = white & ~(behind | (behind << numpy.uint64(1)) & _NOT_FILE_A | (behind >> numpy.uint64(1)) & _NOT_FILE_H)
+    score += numpy.bitwise_count(passed[:, None] & _RANKS).astype(numpy.int64) @ _PASSED_WHITE
+    behind = white >> numpy.uint64(8)
+    behind |= behind >> numpy.uint64(8)
+    behind |= behind >> numpy.uint64(16)
+    behind |= behind >> numpy.uint64(32)
+    passed = black & ~(behind | (behind << numpy.uint64(1)) & _NOT_FILE_A | (behind >> numpy.uint64(1)) & _NOT_FILE_H)
+    score -= numpy.bitwise_count(passed[:, None] & _RANKS).astype(numpy.int64) @ _PASSED_BLACK
+    return score
+
+
+def evaluate_boards(boards, white_to_move):
+    """
+    Scores for an (N, 64) array of piece codes and a length-N boolean array of sides
+    to move, from the side to move's point of view
+    """
+    boards = numpy.asarray(boards, dtype=numpy.uint8).reshape(-1, 64)
+    midgame = MIDGAME_ARRAY[boards, _SQUARES].sum(axis=1)
+    endgame = ENDGAME_ARRAY[boards, _SQUARES].sum(axis=1)
+    phase = numpy.minimum(PHASE_ARRAY[boards].sum(axis=1), MAX_PHASE)
+    score = (midgame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    occupied = numpy.packbits(boards != EMPTY, axis=1, bitorder="little").view("<u8").ravel()
+    score += _mobility(boards, occupied, WHITE) - _mobility(boards, occupied, BLACK)
+    score += _pawn_structure(boards)
+    return numpy.where(white_to_move, score, -score)
+
+
+def evaluate_batch(records):
+    """Scores for packed position records, from each side to move's point of view"""
+    return evaluate_boards(unpack_boards(records), (records["flags"] & 1) == 0)
+
+
+def check(dataset, batch_size=10000):
+    """Compares evaluate_batch() with evaluate_position() on every position; returns the mismatches"""
+    records = dataset.array()
+    mismatches = []
+    gs = None
+    for start in range(0, len(records), batch_size):
+        scores = evaluate_batch(records[start:start + batch_size])
+        for i, score in enumerate(scores, start):
+            gs = dataset.position(i, gs)
+            expected = evaluate_position(gs)
+            if score != expected:
+                mismatches.append((i, gs.getFen(), int(score), expected))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a packed position dataset in batches")
+    parser.add_argument("dataset")
+    parser.add_argument("--batch", type=int, default=10000, help="positions per batch")
+    parser.add_argument("--check", action="store_true", help="compare with the scalar reference")
+    args = parser.parse_args(argv)
+    with ChessDataset.Dataset(args.dataset) as dataset:
+        if args.check:
+            mismatches = check(dataset, args.batch)
+            for i, fen, score, expected in mismatches[:10]:
+                print(f"position {i}: batch {score}, reference {expected}  {fen}")
+            print(f"{len(dataset) - len(mismatches)}/{len(dataset)} positions match")
+            return 1 if mismatches else 0
+        records = dataset.array()
+        start = time.perf_counter()
+        for first in range(0, len(records), args.batch):
+            evaluate_batch(records[first:first + args.batch])
+        elapsed = time.perf_counter() - start
+    print(f"{len(records)} positions in {elapsed:.2f}s, {len(records) / elapsed if elapsed else 0:,.0f} positions/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
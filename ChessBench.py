@@ -0,0 +1,670 @@
+"""
+Benchmarks for the engine. Run `python ChessBench.py <name>`; `--help` lists them.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import ChessAI
+import ChessBitbase
+import ChessBook
+import ChessDataset
+import ChessEngine
+import ChessMatch
+import ChessParallel
+import ChessPGN
+import ChessPerft
+import ChessProfile
+import ChessTT
+
+
+# Opening positions of the "Win at Chess" tactical test suite with their best moves
+TACTICAL_POSITIONS = [
+    ("WAC.001", "2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1", "Qg6"),
+    ("WAC.002", "8/7p/5k2/5p2/p1p2P2/Pr1pPK2/1P1R3P/8 b - - 0 1", "Rxb2"),
+    ("WAC.003", "5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1", "Rg3"),
+    ("WAC.004", "r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - 0 1", "Qxh7+"),
+    ("WAC.005", "5k2/6pp/p1qN4/1p1p4/3P4/2PKP2Q/PP3r2/3R4 b - - 0 1", "Qc4+"),
+    ("WAC.006", "7k/p7/1R5K/6r1/6p1/6P1/8/8 w - - 0 1", "Rb7"),
+    ("WAC.007", "rnbqkb1r/pppp1ppp/8/4P3/6n1/7P/PPPNPPP1/R1BQKBNR b KQkq - 0 1", "Ne3"),
+    ("WAC.008", "r4q1k/p2bR1rp/2p2Q1N/5p2/5p2/2P5/PP3PPP/R5K1 w - - 0 1", "Rf7"),
+    ("WAC.009", "3q1rk1/p4pp1/2pb3p/3p4/6Pr/1PNQ4/P1PB1PP1/4RRK1 b - - 0 1", "Bh2+"),
+    ("WAC.010", "2br2k1/2q3rn/p2NppQ1/2p1P3/Pp5R/4P3/1P3PPP/3R2K1 w - - 0 1", "Rxh7"),
+]
+
+
+def sample_positions(count=50, max_plies=40, seed=2024):
+    """Plays seeded random games and returns GameStates at a spread of game phases"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        gs = ChessEngine.GameState()
+        for _ in range(rng.randrange(max_plies)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+        if gs.getValidMoves():
+            positions.append(gs)
+    return positions
+
+
+def _rate(fn, positions, min_time):
+    """Calls fn on every position until min_time has passed, returns (moves, seconds)"""
+    generated = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for gs in positions:
+            generated += len(fn(gs))
+        elapsed = time.perf_counter() - start
+    return generated, elapsed
+
+
+def _baseline_engine(rev):
+    """
+    (ChessEngine module of commit rev, rev), by default of the repository's first commit, whose
+    generator scans the board lists; (None, reason) when git or the commit is not available
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        if rev is None:
+            rev = subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=root, capture_output=True,
+                                 text=True, check=True).stdout.split()[0]
+        source = subprocess.run(["git", "show", f"{rev}:ChessEngine.py"], cwd=root, capture_output=True,
+                                text=True, check=True).stdout
+    except (OSError, IndexError, subprocess.CalledProcessError):
+        return None, f"no git history to load {rev or 'the first commit'} from"
+    module = types.ModuleType("ChessEngineBaseline")
+    exec(compile(source, f"{rev}:ChessEngine.py", "exec"), module.__dict__)
+    return module, rev[:7]
+
+
+def _baseline_position(engine, gs):
+    """The baseline engine's GameState for the position of gs (it has no FEN support)"""
+    old = engine.GameState()
+    old.board = [row[:] for row in gs.board]
+    old.whiteToMove = gs.whiteToMove
+    old.whiteKingLocation = gs.whiteKingLocation
+    old.blackKingLocation = gs.blackKingLocation
+    return old
+
+
+def bench_movegen(args):
+    """
+    Legal moves/second over sample positions, against the board-list generator of the baseline
+    commit, and perft nodes/second over the reference suite
+    """
+    positions = sample_positions(args.positions)
+    legal, legal_time = _rate(lambda gs: gs.getValidMoveCodes(), positions, args.seconds)
+    current = legal / legal_time
+    engine, rev = _baseline_engine(args.baseline)
+    print(f"{'generator':<32} {'legal moves/s':>14} {'speedup':>8}")
+    if engine is None:
+        print(f"{'baseline':<32} {'-':>14} {'-':>8}  ({rev})")
+        print(f"{'current (bitboards, packed ints)':<32} {current:>14,.0f} {'-':>8}")
+    else:
+        old_positions = [_baseline_position(engine, gs) for gs in positions]
+        old, old_time = _rate(lambda gs: gs.getValidMoves(), old_positions, args.seconds)
+        baseline = old / old_time
+        # The baseline has no castling or en passant, so it generates slightly fewer moves
+        print(f"{f'baseline {rev} (board lists)':<32} {baseline:>14,.0f} {1:>8.2f}")
+        print(f"{'current (bitboards, packed ints)':<32} {current:>14,.0f} {current / baseline:>8.2f}")
+    nodes = 0
+    elapsed = 0.0
+    for _, fen, _ in ChessPerft.REFERENCE_POSITIONS:
+        count, seconds = ChessPerft.timed_perft(fen, args.depth)
+        nodes += count
+        elapsed += seconds
+    print(f"perft({args.depth}) reference suite: {nodes:,} nodes, {nodes / elapsed:,.0f} nodes/s")
+
+
+def _board_moves(gs):
+    """Move objects built from the board for every legal move, the way generation used to"""
+    return [ChessEngine.Move((code >> 3 & 7, code & 7), (code >> 9 & 7, code >> 6 & 7), gs.board)
+            for code in gs.getValidMoveCodes()]
+
+
+def bench_moves(args):
+    """Memory and throughput of legal move lists: packed ints vs Move objects"""
+    positions = sample_positions(args.positions)
+    variants = (("Move from board", _board_moves),
+                ("Move.fromCode", lambda gs: gs.getValidMoves()),
+                ("packed int", lambda gs: gs.getValidMoveCodes()))
+    print(f"{'representation':<16} {'bytes/move':>12} {'moves/s':>12}")
+    for name, fn in variants:
+        tracemalloc.start()
+        lists = [fn(gs) for gs in positions]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        count = sum(len(moves) for moves in lists)
+        del lists
+        generated, elapsed = _rate(fn, positions, args.seconds)
+        print(f"{name:<16} {size / count:>12.1f} {generated / elapsed:>12,.0f}")
+
+
+def bench_search(args):
+    """Fixed-depth search over sample positions: nodes, time and nodes/second"""
+    positions = [ChessEngine.GameState()] + sample_positions(args.positions - 1)
+    nodes = 0
+    elapsed = 0.0
+    for gs in positions:
+        searcher = ChessAI.Searcher(max_depth=args.depth)
+        searcher.search(gs)
+        nodes += searcher.nodes
+        elapsed += searcher.elapsed
+    print(f"depth {args.depth}, {len(positions)} positions: {nodes:,} nodes in {elapsed:.2f}s, "
+          f"{nodes / elapsed:,.0f} nodes/s")
+
+
+def bench_index(args):
+    """Checking a clicked move: list scan over Move objects, cached MoveIndex, and one-square generation"""
+    positions = sample_positions(args.positions)
+    clicks = []
+    for gs in positions:
+        moves = gs.getValidMoveCodes()
+        move = moves[len(moves) // 2]
+        clicks.append((gs, move & 63, move >> 6 & 63))
+
+    def scan(gs, start, end): # what ChessMain did: build a Move and compare it with every valid Move
+        move = ChessEngine.Move((start >> 3, start & 7), (end >> 3, end & 7), gs.board)
+        return move in gs.getValidMoves()
+
+    def cached(gs, start, end):
+        return gs.legalMoveIndex().find(start, end) is not None
+
+    def lazy(gs, start, end):
+        gs.moveIndexes.clear() # the server's scratch state rarely sees a position twice
+        return any(move >> 6 & 63 == end for move in gs.getValidMoveCodesFrom(start))
+
+    def full(gs, start, end):
+        return any(move & 0xFFF == start | end << 6 for move in gs.getValidMoveCodes())
+
+    print(f"{'validation':<28} {'us/click':>9}")
+    for name, fn in (("Move in getValidMoves()", scan), ("MoveIndex.find (cached)", cached),
+                     ("getValidMoveCodesFrom", lazy), ("getValidMoveCodes scan", full)):
+        count = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < args.seconds:
+            for gs, sq, to in clicks:
+                assert fn(gs, sq, to)
+            count += len(clicks)
+            elapsed = time.perf_counter() - start
+        print(f"{name:<28} {elapsed / count * 1e6:>9.2f}")
+
+
+def bench_tt(args):
+    """Node count at fixed depth from the starting position with and without a transposition table"""
+    print(f"{'table':<10} {'nodes':>10} {'seconds':>8} {'hits':>8} {'misses':>8} {'collisions':>10}")
+    for name, tt in (("none", None), (f"{args.tt_mb} MB", ChessTT.TranspositionTable(args.tt_mb))):
+        searcher = ChessAI.Searcher(max_depth=args.depth, tt=tt)
+        searcher.search(ChessEngine.GameState())
+        hits, misses, collisions = (tt.hits, tt.misses, tt.collisions) if tt else (0, 0, 0)
+        print(f"{name:<10} {searcher.nodes:>10,} {searcher.elapsed:>8.2f} {hits:>8,} {misses:>8,} {collisions:>10,}")
+
+
+def _worker_counts(args):
+    counts = [1]
+    while counts[-1] * 2 <= args.workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.workers:
+        counts.append(args.workers)
+    return counts
+
+
+def bench_parallel(args):
+    """Root-split perft and search scaling with the number of worker processes"""
+    gs = ChessEngine.GameState()
+    print(f"perft({args.depth + 1}) and depth-{args.depth} search from the start position")
+    print(f"{'workers':>7} {'perft s':>9} {'speedup':>8} {'search s':>9} {'speedup':>8}")
+    base = None
+    for workers in _worker_counts(args):
+        start = time.perf_counter()
+        ChessParallel.parallel_perft(gs, args.depth + 1, workers)
+        perft_time = time.perf_counter() - start
+        start = time.perf_counter()
+        ChessParallel.parallel_search(gs, args.depth, workers=workers)
+        search_time = time.perf_counter() - start
+        base = base or (perft_time, search_time)
+        print(f"{workers:>7} {perft_time:>9.2f} {base[0] / perft_time:>8.2f} "
+              f"{search_time:>9.2f} {base[1] / search_time:>8.2f}")
+
+
+def _write_random_games(path, count, seed=7, max_plies=120):
+    rng = random.Random(seed)
+    with open(path, "w") as out:
+        for i in range(count):
+            gs = ChessEngine.GameState()
+            moves = []
+            for _ in range(max_plies):
+                codes = gs.getValidMoveCodes()
+                if not codes:
+                    break
+                moves.append(rng.choice(codes))
+                gs.makeMove(moves[-1])
+            ChessPGN.write_game(out, moves, {"Event": "bench", "Round": str(i + 1)})
+
+
+def bench_pgn(args):
+    """Streaming PGN replay: games/second and peak memory as the file grows"""
+    print(f"{'games':>7} {'file KB':>9} {'games/s':>9} {'positions/s':>12} {'peak KB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in (args.games, args.games * 4):
+            path = os.path.join(tmp, f"{count}.pgn")
+            _write_random_games(path, count)
+            start = time.perf_counter()
+            games = positions = 0
+            for game in ChessPGN.read_games(path):
+                positions += sum(1 for _ in game.fens())
+                games += 1
+            elapsed = time.perf_counter() - start
+            tracemalloc.start() # a second, untimed pass: tracing slows Python down a lot
+            for game in ChessPGN.read_games(path):
+                for _ in game.fens():
+                    pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{games:>7} {os.path.getsize(path) / 1024:>9,.0f} {games / elapsed:>9,.1f} "
+                  f"{positions / elapsed:>12,.0f} {peak / 1024:>9,.0f}")
+
+
+def bench_dataset(args):
+    """Packed positions: bytes per position, encode/decode rate and random access from a mapped file"""
+    positions = sample_positions(args.positions)
+    tracemalloc.start()
+    states = [ChessEngine.GameState(fen=gs.getFen()) for gs in positions]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del states
+    print(f"GameState: {size / len(positions):,.0f} bytes/position, packed: {ChessEngine.PACKED_POSITION_BYTES}")
+    packed, elapsed = _rate(lambda gs: [gs.getPacked()], positions, args.seconds)
+    print(f"encode: {packed / elapsed:,.0f} positions/s")
+    records = [gs.getPacked() for gs in positions]
+    gs = ChessEngine.GameState()
+    decoded, elapsed = _rate(lambda data: [gs.loadPacked(data)], records, args.seconds)
+    print(f"decode: {decoded / elapsed:,.0f} positions/s")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "positions.dat")
+        count = args.games * 1000
+        with ChessDataset.DatasetWriter(path) as writer:
+            for i in range(count):
+                writer.add_packed(records[i % len(records)])
+        rng = random.Random(1)
+        tracemalloc.start()
+        with ChessDataset.Dataset(path) as dataset:
+            start = time.perf_counter()
+            for _ in range(count):
+                dataset[rng.randrange(count)]
+            elapsed = time.perf_counter() - start
+            scanned = sum(1 for _ in dataset)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{count:,} positions ({os.path.getsize(path) / 1024:,.0f} KB): random access "
+              f"{count / elapsed:,.0f} reads/s, {scanned:,} scanned, peak {peak / 1024:,.0f} KB")
+
+
+def bench_batch(args):
+    """Vectorized batch evaluation: positions/second by batch size, against the scalar reference"""
+    import numpy
+    import ChessBatchEval
+    positions = sample_positions(args.positions)
+    records = ChessBatchEval.pack_positions(positions)
+    evaluated, elapsed = _rate(lambda gs: [ChessBatchEval.evaluate_position(gs)], positions, args.seconds)
+    print(f"scalar reference: {evaluated / elapsed:,.0f} positions/s")
+    print(f"{'batch':>7} {'positions/s':>12}")
+    for size in (1, 10, 100, 1000, 10000, 100000):
+        batch = numpy.resize(records, size) # repeats the sample positions to fill the batch
+        count = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < args.seconds:
+            ChessBatchEval.evaluate_batch(batch)
+            count += size
+            elapsed = time.perf_counter() - start
+        print(f"{size:>7,} {count / elapsed:>12,.0f}")
+
+
+class _FullEvalSearcher(ChessAI.Searcher):
+    evaluate = staticmethod(ChessAI.evaluate_full)
+
+
+def bench_eval(args):
+    """Leaf evaluation cost and search speed: running sums (incremental) vs a full board scan"""
+    positions = sample_positions(args.positions)
+    print(f"{'evaluation':<12} {'ns/leaf':>9} {'nodes':>10} {'nodes/s':>10}")
+    for name, evaluate, searcher_class in (("incremental", ChessAI.evaluate, ChessAI.Searcher),
+                                           ("full scan", ChessAI.evaluate_full, _FullEvalSearcher)):
+        count, elapsed = _rate(lambda gs: [evaluate(gs)], positions, args.seconds)
+        nodes = 0
+        search_time = 0.0
+        for gs in positions[:10]:
+            searcher = searcher_class(max_depth=args.depth)
+            searcher.search(gs)
+            nodes += searcher.nodes
+            search_time += searcher.elapsed
+        print(f"{name:<12} {elapsed / count * 1e9:>9,.0f} {nodes:>10,} {nodes / search_time:>10,.0f}")
+
+
+class _UnorderedSearcher(ChessAI.Searcher):
+    order_moves = False
+
+
+def bench_ordering(args):
+    """Nodes and time to reach a fixed depth on the perft reference positions, with and without move ordering"""
+    print(f"depth {args.depth}, fresh {args.tt_mb} MB table per position")
+    print(f"{'position':<10} {'unordered':>10} {'s':>7} {'ordered':>10} {'s':>7} {'nodes':>7}")
+    totals = [0, 0.0, 0, 0.0]
+    for name, fen, _ in ChessPerft.REFERENCE_POSITIONS:
+        row = []
+        for searcher_class in (_UnorderedSearcher, ChessAI.Searcher):
+            searcher = searcher_class(max_depth=args.depth, tt=ChessTT.TranspositionTable(args.tt_mb))
+            searcher.search(ChessEngine.GameState(fen=fen))
+            row += [searcher.nodes, searcher.elapsed]
+        totals = [total + value for total, value in zip(totals, row)]
+        print(f"{name:<10} {row[0]:>10,} {row[1]:>7.2f} {row[2]:>10,} {row[3]:>7.2f} {row[2] / row[0]:>7.0%}")
+    print(f"{'total':<10} {totals[0]:>10,} {totals[1]:>7.2f} {totals[2]:>10,} {totals[3]:>7.2f} "
+          f"{totals[2] / totals[0]:>7.0%}")
+
+
+class _HorizonSearcher(ChessAI.Searcher):
+    quiescence = False
+
+
+def _solve(searcher_class, fen, best_san, depth, seconds):
+    """Searches fen to depth; returns (nodes, seconds until the best move was found and kept, or None)"""
+    gs = ChessEngine.GameState(fen=fen)
+    best = ChessPGN.san_to_move(gs, best_san)
+    iterations = []
+    searcher = searcher_class(max_depth=depth, time_limit=seconds, tt=ChessTT.TranspositionTable(4),
+                              info=lambda s: iterations.append((s.best_move, s.elapsed)))
+    searcher.search(gs)
+    solved = None
+    for move, elapsed in iterations:
+        if move != best:
+            solved = None
+        elif solved is None:
+            solved = elapsed
+    return searcher.nodes, solved
+
+
+def bench_quiescence(args):
+    """Tactical suite at fixed depth with and without quiescence search: nodes, solved, time to solve"""
+    print(f"depth {args.depth}, at most {args.seconds:g}s per position")
+    print(f"{'search':<12} {'nodes':>10} {'solved':>7} {'solve s':>8}")
+    for name, searcher_class in (("horizon", _HorizonSearcher), ("quiescence", ChessAI.Searcher)):
+        nodes = solved = 0
+        solve_time = 0.0
+        for _, fen, best in TACTICAL_POSITIONS:
+            count, elapsed = _solve(searcher_class, fen, best, args.depth, args.seconds)
+            nodes += count
+            if elapsed is not None:
+                solved += 1
+                solve_time += elapsed
+        print(f"{name:<12} {nodes:>10,} {solved:>3}/{len(TACTICAL_POSITIONS):<3} {solve_time:>8.2f}")
+
+
+def bench_book(args):
+    """Opening book: open time and lookup latency for books of growing size"""
+    rng = random.Random(1)
+    print(f"{'entries':>10} {'KB':>9} {'open ms':>8} {'hit us':>7} {'miss us':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in (10_000, 100_000, 1_000_000):
+            path = os.path.join(tmp, "book.bin")
+            keys = sorted(rng.getrandbits(64) for _ in range(count))
+            with open(path, "wb") as f:
+                for key in keys:
+                    f.write(ChessBook.ENTRY.pack(key, rng.getrandbits(15), 1, 0))
+            start = time.perf_counter()
+            book = ChessBook.OpeningBook(path)
+            opened = time.perf_counter() - start
+            probes = [keys[rng.randrange(count)] for _ in range(1000)]
+            hits, hit_time = _rate(book.entries, probes, args.seconds / 2)
+            misses = [rng.getrandbits(64) for _ in range(1000)]
+            looked, miss_time = _rate(lambda key: [book.entries(key)], misses, args.seconds / 2)
+            book.close()
+            print(f"{count:>10,} {count * ChessBook.ENTRY_BYTES / 1024:>9,.0f} {opened * 1e3:>8.2f} "
+                  f"{hit_time / hits * 1e6:>7.1f} {miss_time / looked * 1e6:>8.1f}")
+
+
+MAX_FPS = 15 # frame rate of the polling game loop that the event-driven one replaced
+
+
+def bench_render(args):
+    """UI drawing: frame time of full and incremental redraws, and CPU used per idle minute"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # no window needed
+    import pygame
+    import ChessMain
+    pygame.init()
+    screen = pygame.display.set_mode((ChessMain.WIDTH, ChessMain.HEIGHT))
+    ChessMain.load_images()
+    positions = sample_positions(args.positions)
+    frames = []
+    for gs in positions:
+        valid_moves = gs.legalMoveIndex()
+        move = valid_moves.moves[0]
+        frames.append((gs, valid_moves, (move >> 3 & 7, move & 7)))
+
+    def draw_game_state(gs, valid_moves, sq_selected):
+        """The old full redraw: board, highlights and pieces from scratch on every frame"""
+        size = ChessMain.SQ_SIZE
+        ChessMain.draw_board(screen)
+        if sq_selected:
+            r, c = sq_selected
+            piece = gs.board[r][c]
+            if piece != "--" and piece[0] == ('w' if gs.whiteToMove else 'b'):
+                s = pygame.Surface((size, size))
+                s.set_alpha(100)
+                s.fill(pygame.Color('blue'))
+                screen.blit(s, (c * size, r * size))
+                for move in valid_moves.fromSquare(r * 8 + c):
+                    end_row, end_col = move >> 9 & 7, move >> 6 & 7
+                    s.fill(pygame.Color('red' if gs.board[end_row][end_col] != "--" else 'green'))
+                    screen.blit(s, (end_col * size, end_row * size))
+        for r in range(ChessMain.DIMENSION):
+            for c in range(ChessMain.DIMENSION):
+                piece = gs.board[r][c]
+                if piece != "--":
+                    screen.blit(ChessMain.IMAGES[piece], pygame.Rect(c * size, r * size, size, size))
+
+    def full(frame):
+        gs, valid_moves, selected = frame
+        draw_game_state(gs, valid_moves, selected)
+        pygame.display.flip()
+        return [frame]
+
+    renderer = ChessMain.BoardRenderer(screen)
+
+    def incremental(frame):
+        gs, valid_moves, selected = frame
+        renderer.draw(gs, valid_moves, selected) # a new position: pieces and highlights change
+        renderer.draw(gs, valid_moves, ()) # selection cleared
+        return [frame, frame]
+
+    def idle(frame):
+        gs, valid_moves, _ = frame
+        renderer.draw(gs, valid_moves, ()) # nothing changed since the last call
+        return [frame]
+
+    print(f"{'frame':<12} {'us':>9}")
+    for name, fn, sample in (("full", full, frames), ("incremental", incremental, frames),
+                             ("unchanged", idle, frames[:1])):
+        drawn, elapsed = _rate(fn, sample, args.seconds / 3)
+        print(f"{name:<12} {elapsed / drawn * 1e6:>9,.0f}")
+
+    # CPU time while nobody touches the board, scaled to a minute. SDL's dummy video driver
+    # waits for events by polling every millisecond, so a real display idles lower still.
+    gs, valid_moves, _ = frames[0]
+    clock = pygame.time.Clock()
+    cpu = time.process_time()
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end: # the old loop: redraw and flip at MAX_FPS
+        pygame.event.get()
+        draw_game_state(gs, valid_moves, ())
+        clock.tick(MAX_FPS)
+        pygame.display.flip()
+    polling = (time.process_time() - cpu) * 60 / args.seconds
+    cpu = time.process_time()
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end: # the event-driven loop sleeps in event.wait()
+        pygame.event.wait(max(1, int((end - time.perf_counter()) * 1000)))
+        pygame.event.get()
+    waiting = (time.process_time() - cpu) * 60 / args.seconds
+    print(f"idle CPU per minute: polling at {MAX_FPS} fps {polling:.2f}s, event-driven {waiting:.3f}s")
+    pygame.quit()
+
+
+def bench_uci(args):
+    """UCI front end: time from process start to uciok, and isready/stop latency during a search"""
+    def until(engine, prefix):
+        while not engine.stdout.readline().startswith(prefix):
+            pass
+
+    def send(engine, line):
+        engine.stdin.write(line + "\n")
+        engine.stdin.flush()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ChessUCI.py")
+    startup = []
+    for _ in range(5):
+        start = time.perf_counter()
+        engine = subprocess.Popen([sys.executable, script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  text=True, bufsize=1)
+        send(engine, "uci")
+        until(engine, "uciok")
+        startup.append(time.perf_counter() - start)
+        send(engine, "quit")
+        engine.wait()
+    print(f"start to uciok: {min(startup) * 1000:.0f} ms best, {sum(startup) / len(startup) * 1000:.0f} ms mean")
+
+    engine = subprocess.Popen([sys.executable, script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              text=True, bufsize=1)
+    send(engine, "isready")
+    until(engine, "readyok")
+    send(engine, "position startpos")
+    send(engine, "go infinite")
+    latencies = []
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        send(engine, "isready")
+        until(engine, "readyok")
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    start = time.perf_counter()
+    send(engine, "stop")
+    until(engine, "bestmove")
+    stopped = time.perf_counter() - start
+    send(engine, "quit")
+    engine.wait()
+    latencies.sort()
+    print(f"isready while searching: median {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms over {len(latencies)}; stop to bestmove {stopped * 1000:.1f} ms")
+
+
+def bench_match(args):
+    """Self-play throughput: games/hour of a short node-limited match by worker count"""
+    engine = {"name": "bench", "nodes": 500}
+    openings = ChessMatch.load_openings()
+    print(f"{args.games} games at 500 nodes/move, adjudicated after 120 plies")
+    print(f"{'workers':>7} {'games/h':>9} {'speedup':>8}")
+    base = None
+    for workers in _worker_counts(args):
+        stats, elapsed = ChessMatch.run_match(engine, dict(engine), openings, args.games, workers,
+                                              max_plies=120, out=None)
+        rate = stats.games * 3600 / elapsed
+        base = base or rate
+        print(f"{workers:>7} {rate:>9,.0f} {rate / base:>8.2f}")
+
+
+def bench_profile(args):
+    """Instrumentation overhead: legal generation and search speed with profiling off, on, and off again"""
+    positions = sample_positions(args.positions)
+    print(f"{'profiling':<10} {'moves/s':>12} {'nodes/s':>10}")
+    for name in ("off", "on", "off again"):
+        profile = ChessProfile.enable() if name == "on" else None
+        legal, legal_time = _rate(lambda gs: gs.getValidMoveCodes(), positions, args.seconds)
+        nodes = elapsed = 0
+        for gs in positions[:10]:
+            searcher = ChessAI.Searcher(max_depth=args.depth)
+            searcher.search(gs)
+            nodes += searcher.nodes
+            elapsed += searcher.elapsed
+        if profile is not None:
+            ChessProfile.disable()
+        print(f"{name:<10} {legal / legal_time:>12,.0f} {nodes / elapsed:>10,.0f}")
+
+
+ENDGAME_POSITIONS = [
+    ("KQK", "8/8/8/4k3/8/8/8/4K2Q w - - 0 1"),
+    ("KRK", "8/8/8/4k3/8/8/8/R3K3 w - - 0 1"),
+    ("KPK", "8/8/8/8/4k3/8/4P3/4K3 w - - 0 1"),
+    ("KRKN", "8/8/8/3k4/8/3n4/3R4/3K4 w - - 0 1"), # Rxd3+ reaches a won KRK
+]
+
+
+def bench_bitbase(args):
+    """Bitbase probe latency, and endgame search with and without bitbases"""
+    bitbases = ChessBitbase.Bitbases()
+    if not bitbases:
+        print(f"no bitbases in {ChessBitbase.DEFAULT_DIR}; build them with `python ChessBitbase.py`")
+        return
+    positions = [ChessEngine.GameState(fen=fen) for _, fen in ENDGAME_POSITIONS[:3]]
+    probes, elapsed = _rate(lambda gs: [bitbases.probe(gs)], positions, args.seconds)
+    print(f"probe: {elapsed / probes * 1e9:,.0f} ns")
+    print(f"depth {args.depth}")
+    print(f"{'position':<9} {'without':>9} {'s':>6} {'score':>7} {'with':>9} {'s':>6} {'score':>7}")
+    for name, fen in ENDGAME_POSITIONS:
+        row = []
+        for tables in (None, bitbases):
+            searcher = ChessAI.Searcher(max_depth=args.depth, tt=ChessTT.TranspositionTable(4), bitbases=tables)
+            searcher.search(ChessEngine.GameState(fen=fen))
+            row += [searcher.nodes, searcher.elapsed, searcher.score]
+        print(f"{name:<9} {row[0]:>9,} {row[1]:>6.2f} {row[2]:>7} {row[3]:>9,} {row[4]:>6.2f} {row[5]:>7}")
+
+
+BENCHMARKS = {
+    "movegen": bench_movegen,
+    "moves": bench_moves,
+    "search": bench_search,
+    "index": bench_index,
+    "tt": bench_tt,
+    "parallel": bench_parallel,
+    "pgn": bench_pgn,
+    "dataset": bench_dataset,
+    "batch": bench_batch,
+    "eval": bench_eval,
+    "ordering": bench_ordering,
+    "quiescence": bench_quiescence,
+    "bitbase": bench_bitbase,
+    "book": bench_book,
+    "render": bench_render,
+    "uci": bench_uci,
+    "match": bench_match,
+    "profile": bench_profile,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--positions", type=int, default=50, help="number of sample positions")
+    parser.add_argument("--seconds", type=float, default=2.0, help="minimum time per measurement")
+    parser.add_argument("--depth", type=int, default=3, help="search depth")
+    parser.add_argument("--games", type=int, default=50, help="number of games")
+    parser.add_argument("--workers", type=int, default=ChessParallel.default_workers(),
+                        help="largest worker count to try")
+    parser.add_argument("--baseline", help="commit whose ChessEngine movegen compares against (default: the first)")
+    parser.add_argument("--tt-mb", type=int, default=ChessTT.DEFAULT_SIZE_MB, help="transposition table size")
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
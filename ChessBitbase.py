@@ -0,0 +1,299 @@
+"""
+Endgame bitbases for king and one piece against a lone king: KQK, KRK and KPK.
+
+A table has one bit per position: set when the side with the piece wins, clear when
+the position is a draw (or illegal). Positions are indexed with the strong side as
+white; positions where black has the piece are probed mirrored top to bottom.
+
+    index = side << 18 | strongKing << 12 | weakKing << 6 | pieceSquare
+
+side is 0 when the strong side is to move. That makes 2 * 64^3 bits, 64 KB per table.
+
+Tables are built offline by retrograde analysis. Every legal position is set up in a
+ChessEngine.GameState and its legal moves give the edges of the game graph; this part
+runs across a process pool, split by the strong king's square. The wins then spread
+backwards from the checkmates, and every position left unresolved is a draw. KPK
+promotions are looked up in KQK and KRK, so those are built first.
+
+    python ChessBitbase.py                  # build every table into bitbases/
+    python ChessBitbase.py KPK --workers 4  # one table
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+from ChessBitboard import (PAWN, KNIGHT, ROOK, QUEEN, KING, WHITE, BLACK, PIECE_NAMES,
+                           KING_ATTACKS, attackersTo, popcount)
+
+MATERIALS = {"KQK": QUEEN, "KRK": ROOK, "KPK": PAWN}
+BUILD_ORDER = ("KQK", "KRK", "KPK") # KPK looks up the positions its promotions reach
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+POSITIONS = 2 * 64 * 64 * 64
+TABLE_BYTES = POSITIONS // 8
+
+MAGIC = b"CHESSBB1"
+HEADER = struct.Struct("<8s4s4x") # magic, material name, spare
+HEADER_BYTES = HEADER.size
+
+WIN, DRAW, LOSS = 1, 0, -1 # probe results, from the side to move's point of view
+
+# Build states of a position
+_UNKNOWN, _WON, _DRAWN, _ILLEGAL = 0, 1, 2, 3
+
+
+class BitbaseError(ValueError):
+    pass
+
+
+def index(strongToMove, strongKing, weakKing, pieceSquare):
+    return (0 if strongToMove else 1) << 18 | strongKing << 12 | weakKing << 6 | pieceSquare
+
+
+def _bit(table, i):
+    return table[i >> 3] >> (i & 7) & 1
+
+
+def _edges(material, strongKing, promotionTables):
+    """
+    Sets up every position with the strong king on strongKing and returns (states,
+    offsets, successors) for its 2 * 64 * 64 positions in local order (side << 12 |
+    weakKing << 6 | pieceSquare). successors[offsets[i]:offsets[i + 1]] are the global
+    indices of position i's successors whose result is not known yet.
+    """
+    pieceType = MATERIALS[material]
+    strongPiece = PIECE_NAMES[WHITE << 3 | pieceType]
+    gs = ChessEngine.GameState()
+    states = bytearray(2 * 64 * 64)
+    offsets = array("I")
+    successors = array("I")
+    for local in range(2 * 64 * 64):
+        side, weakKing, pieceSquare = local >> 12, local >> 6 & 63, local & 63
+        offsets.append(len(successors))
+        if (weakKing == strongKing or pieceSquare in (strongKing, weakKing)
+                or KING_ATTACKS[strongKing] >> weakKing & 1
+                or (pieceType == PAWN and pieceSquare >> 3 in (0, 7))):
+            states[local] = _ILLEGAL
+            continue
+        board = [["--"] * 8 for _ in range(8)]
+        board[strongKing >> 3][strongKing & 7] = "wK"
+        board[weakKing >> 3][weakKing & 7] = "bK"
+        board[pieceSquare >> 3][pieceSquare & 7] = strongPiece
+        gs.setPosition(board, side == 0, 0, None)
+        if side == 0 and attackersTo(gs.bitboards, weakKing, WHITE, gs.bitboards.occupied):
+            states[local] = _ILLEGAL # the side not to move is in check
+            continue
+        moves = gs.getValidMoveCodes()
+        if not moves:
+            states[local] = _WON if gs.checkmate else _DRAWN
+            continue
+        state = _UNKNOWN
+        for move in moves:
+            start, end, flag = move & 63, move >> 6 & 63, move >> 12 & 15
+            if move >> 20 & 15:
+                state = _DRAWN # the lone king took the piece
+                break
+            if flag >= ChessEngine.MOVE_PROMOTION:
+                table = promotionTables.get(KNIGHT + flag - ChessEngine.MOVE_PROMOTION)
+                if table is not None and _bit(table, index(False, strongKing, weakKing, end)):
+                    state = _WON
+                    break
+                continue
+            if start == strongKing:
+                successors.append(index(side == 1, end, weakKing, pieceSquare))
+            elif start == weakKing:
+                successors.append(index(side == 1, strongKing, end, pieceSquare))
+            else:
+                successors.append(index(side == 1, strongKing, weakKing, end))
+        if state != _UNKNOWN:
+            del successors[offsets[-1]:]
+        states[local] = state
+    offsets.append(len(successors))
+    return states, offsets, successors
+
+
+def build(material, workers=1, directory=DEFAULT_DIR):
+    """Solves one table and returns its bits; promotions read the tables already in directory"""
+    promotionTables = {}
+    if MATERIALS[material] == PAWN:
+        for name in ("KQK", "KRK"):
+            with open(_path(directory, name), "rb") as f:
+                promotionTables[MATERIALS[name]] = _read(f, name)
+    tasks = [(material, k, promotionTables) for k in range(64)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_edges, *zip(*tasks)))
+    else:
+        results = [_edges(*task) for task in tasks]
+
+    # Gather the chunks into global arrays: start/count of each position's successors
+    states = bytearray(POSITIONS)
+    start = array("I", [0]) * POSITIONS
+    count = array("I", [0]) * POSITIONS
+    successors = array("I")
+    for strongKing, (chunkStates, offsets, chunkSuccessors) in enumerate(results):
+        base = len(successors)
+        successors.extend(chunkSuccessors)
+        for local, state in enumerate(chunkStates):
+            g = (local >> 12) << 18 | strongKing << 12 | (local & 4095)
+            states[g] = state
+            start[g] = base + offsets[local]
+            count[g] = offsets[local + 1] - offsets[local]
+    del results
+
+    # Predecessors of every position, grouped by position (a counting sort of the edges)
+    predStart = array("I", [0]) * (POSITIONS + 1)
+    for target in successors:
+        predStart[target + 1] += 1
+    for i in range(POSITIONS):
+        predStart[i + 1] += predStart[i]
+    fill = array("I", predStart)
+    predecessors = array("I", [0]) * len(successors)
+    for source in range(POSITIONS):
+        if states[source] == _UNKNOWN:
+            for target in successors[start[source]:start[source] + count[source]]:
+                predecessors[fill[target]] = source
+                fill[target] += 1
+    del fill, successors
+
+    # A strong-to-move position wins if one move reaches a win; a weak-to-move one only
+    # if every move does. count[] doubles as the number of moves not yet known to lose.
+    queue = deque(i for i in range(POSITIONS) if states[i] == _WON)
+    while queue:
+        won = queue.popleft()
+        for source in predecessors[predStart[won]:predStart[won + 1]]:
+            if states[source] != _UNKNOWN:
+                continue
+            if source >> 18 == 0:
+                states[source] = _WON
+                queue.append(source)
+            else:
+                count[source] -= 1
+                if count[source] == 0:
+                    states[source] = _WON
+                    queue.append(source)
+
+    table = bytearray(TABLE_BYTES)
+    for i in range(POSITIONS):
+        if states[i] == _WON:
+            table[i >> 3] |= 1 << (i & 7)
+    return bytes(table)
+
+
+def _path(directory, material):
+    return os.path.join(directory, material + ".bb")
+
+
+def _check_header(data, path, material):
+    magic, name = HEADER.unpack(data)
+    if magic != MAGIC or name.rstrip(b"\0") != material.encode("ascii"):
+        raise BitbaseError(f"{path}: not a {material} bitbase")
+
+
+def _read(f, material):
+    _check_header(f.read(HEADER_BYTES), f.name, material)
+    data = f.read(TABLE_BYTES)
+    if len(data) != TABLE_BYTES:
+        raise BitbaseError(f"{f.name}: truncated")
+    return data
+
+
+def write(directory, material, table):
+    os.makedirs(directory, exist_ok=True)
+    with open(_path(directory, material), "wb") as f:
+        f.write(HEADER.pack(MAGIC, material.encode("ascii")))
+        f.write(table)
+
+
+class Bitbases():
+    """
+    The tables found in a directory, each memory-mapped read-only, so loading costs
+    nothing until a position is probed. Missing tables are simply not probed.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.tables = {} # piece type -> mapped table
+        self._files = []
+        for material, pieceType in MATERIALS.items():
+            path = _path(directory, material)
+            if not os.path.exists(path):
+                continue
+            f = open(path, "rb")
+            try:
+                _check_header(f.read(HEADER_BYTES), path, material)
+                if os.fstat(f.fileno()).st_size != HEADER_BYTES + TABLE_BYTES:
+                    raise BitbaseError(f"{path}: truncated")
+            except BitbaseError:
+                f.close()
+                raise
+            self._files.append(f)
+            self.tables[pieceType] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.probes = 0
+        self.hits = 0
+
+    def __bool__(self):
+        return bool(self.tables)
+
+    def probe(self, gs):
+        """WIN, DRAW or LOSS for the side to move, or None if gs is not covered by a loaded table"""
+        bitboards = gs.bitboards
+        occupied = bitboards.occupied
+        if popcount(occupied) != 3 or gs.castlingRights:
+            return None
+        self.probes += 1
+        pieces = bitboards.pieces
+        for strong in (WHITE, BLACK):
+            for pieceType, table in self.tables.items():
+                piece = pieces[strong << 3 | pieceType]
+                if not piece:
+                    continue
+                flip = 0 if strong == WHITE else 56 # mirror so the strong side plays up the board
+                strongKing = (pieces[strong << 3 | KING].bit_length() - 1) ^ flip
+                weakKing = (pieces[(strong ^ 1) << 3 | KING].bit_length() - 1) ^ flip
+                strongToMove = gs.whiteToMove == (strong == WHITE)
+                i = index(strongToMove, strongKing, weakKing, (piece.bit_length() - 1) ^ flip)
+                self.hits += 1
+                if table[HEADER_BYTES + (i >> 3)] >> (i & 7) & 1:
+                    return WIN if strongToMove else LOSS
+                return DRAW
+        return None
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        for f in self._files:
+            f.close()
+        self.tables = {}
+        self._files = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build endgame bitbases by retrograde analysis")
+    parser.add_argument("materials", nargs="*", help=f"tables to build: {', '.join(BUILD_ORDER)} (default: all)")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    for material in args.materials:
+        if material not in MATERIALS:
+            parser.error(f"unknown table {material!r}")
+    for material in BUILD_ORDER:
+        if args.materials and material not in args.materials:
+            continue
+        start = time.perf_counter()
+        table = build(material, args.workers, args.dir)
+        write(args.dir, material, table)
+        elapsed = time.perf_counter() - start
+        wins = sum(popcount(byte) for byte in table)
+        print(f"{material}: {wins:,} won positions, {(HEADER_BYTES + len(table)) / 1024:,.0f} KB, "
+              f"built in {elapsed:.1f}s with {args.workers} workers")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
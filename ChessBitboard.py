@@ -0,0 +1,213 @@
+"""
+Bitboard tables and attack generation for ChessEngine.GameState.
+
+Squares are numbered row * 8 + col, the same way GameState.board is laid out,
+so bit 0 is a8 and bit 63 is h1. Every set of squares is a plain Python int.
+"""
+
+# Piece codes: colour in bit 3 (0 = white, 1 = black), piece type in the low bits.
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 0, 1
+
+PIECE_CODES = {"--": EMPTY,
+               "wp": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+               "bp": 9, "bN": 10, "bB": 11, "bR": 12, "bQ": 13, "bK": 14}
+PIECE_NAMES = ["--"] * 16
+for _name, _code in PIECE_CODES.items():
+    PIECE_NAMES[_code] = _name
+
+# Flags of packed moves, in bits 12-15 (ChessEngine describes the whole layout). They are
+# defined here, with the piece codes, for the modules that read moves but not the engine.
+MOVE_NORMAL, MOVE_DOUBLE_PUSH, MOVE_CASTLE, MOVE_EN_PASSANT = 0, 1, 2, 3
+MOVE_PROMOTION = 4  # 4-7: promotion to knight, bishop, rook, queen
+
+FULL = (1 << 64) - 1
+SQUARE_BITS = [1 << sq for sq in range(64)]
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _leaperTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                mask |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(mask)
+    return table
+
+
+def _rayTable(dr, dc):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        r, c = r + dr, c + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            mask |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _leaperTable(KNIGHT_OFFSETS)
+KING_ATTACKS = _leaperTable(KING_OFFSETS)
+# PAWN_ATTACKS[color][sq]: squares a pawn of that colour standing on sq attacks.
+PAWN_ATTACKS = (_leaperTable(((-1, -1), (-1, 1))), _leaperTable(((1, -1), (1, 1))))
+
+# RAYS[(dr, dc)][sq]: every square from sq (exclusive) to the edge of the board.
+RAYS = {d: _rayTable(*d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+# A ray runs towards higher square numbers when its index delta is positive;
+# the nearest blocker on it is then the lowest set bit, otherwise the highest.
+_ROOK_RAYS = tuple((RAYS[d], d[0] * 8 + d[1] > 0) for d in ROOK_DIRECTIONS)
+_BISHOP_RAYS = tuple((RAYS[d], d[0] * 8 + d[1] > 0) for d in BISHOP_DIRECTIONS)
+
+RAY_POSITIVE = {d: d[0] * 8 + d[1] > 0 for d in RAYS}
+
+RANK_MASKS = [0xFF << (8 * r) for r in range(8)]
+FILE_MASKS = [0x0101010101010101 << c for c in range(8)]
+NOT_FILE_A = FULL ^ FILE_MASKS[0]
+NOT_FILE_H = FULL ^ FILE_MASKS[7]
+
+
+def lsb(bb):
+    """Index of the lowest set bit of a non-empty bitboard"""
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb):
+    """Index of the highest set bit of a non-empty bitboard"""
+    return bb.bit_length() - 1
+
+
+def popcount(bb):
+    return bin(bb).count("1")
+
+
+def squares(bb):
+    """Yields the indices of the set bits in bb, lowest first"""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _slide(sq, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            blocker = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return _slide(sq, occupied, _ROOK_RAYS)
+
+
+def bishopAttacks(sq, occupied):
+    return _slide(sq, occupied, _BISHOP_RAYS)
+
+
+def queenAttacks(sq, occupied):
+    return _slide(sq, occupied, _ROOK_RAYS) | _slide(sq, occupied, _BISHOP_RAYS)
+
+
+class Bitboards():
+    """
+    Occupancy sets for one position: one bitboard per piece code plus one per
+    colour. `mailbox` holds the piece code on every square for O(1) lookup.
+    """
+    __slots__ = ("pieces", "colors", "mailbox")
+
+    def __init__(self, board):
+        self.pieces = [0] * 16
+        self.colors = [0, 0]
+        self.mailbox = [EMPTY] * 64
+        for r in range(8):
+            for c in range(8):
+                code = PIECE_CODES[board[r][c]]
+                if code != EMPTY:
+                    self.put(r * 8 + c, code)
+
+    @property
+    def occupied(self):
+        return self.colors[WHITE] | self.colors[BLACK]
+
+    def put(self, sq, code):
+        bit = SQUARE_BITS[sq]
+        self.pieces[code] |= bit
+        self.colors[code >> 3] |= bit
+        self.mailbox[sq] = code
+
+    def remove(self, sq):
+        code = self.mailbox[sq]
+        if code != EMPTY:
+            bit = SQUARE_BITS[sq]
+            self.pieces[code] ^= bit
+            self.colors[code >> 3] ^= bit
+            self.mailbox[sq] = EMPTY
+        return code
+
+    def move(self, start, end):
+        """Moves the piece on start to end, returning whatever was captured there"""
+        captured = self.remove(end)
+        self.put(end, self.remove(start))
+        return captured
+
+
+def attackersTo(bitboards, sq, color, occupied):
+    """Bitboard of `color` pieces attacking sq, found by looking outwards from sq"""
+    pieces = bitboards.pieces
+    base = color << 3
+    queens = pieces[base | QUEEN]
+    return ((PAWN_ATTACKS[color ^ 1][sq] & pieces[base | PAWN])
+            | (KNIGHT_ATTACKS[sq] & pieces[base | KNIGHT])
+            | (KING_ATTACKS[sq] & pieces[base | KING])
+            | (bishopAttacks(sq, occupied) & (pieces[base | BISHOP] | queens))
+            | (rookAttacks(sq, occupied) & (pieces[base | ROOK] | queens)))
+
+
+def isAttacked(bitboards, sq, color, occupied):
+    """True if any `color` piece attacks sq; cheapest attackers are tried first"""
+    pieces = bitboards.pieces
+    base = color << 3
+    if PAWN_ATTACKS[color ^ 1][sq] & pieces[base | PAWN] or KNIGHT_ATTACKS[sq] & pieces[base | KNIGHT] \
+            or KING_ATTACKS[sq] & pieces[base | KING]:
+        return True
+    queens = pieces[base | QUEEN]
+    diagonal = pieces[base | BISHOP] | queens
+    if diagonal and bishopAttacks(sq, occupied) & diagonal:
+        return True
+    straight = pieces[base | ROOK] | queens
+    return bool(straight and rookAttacks(sq, occupied) & straight)
+
+
+def attackMap(bitboards, color, occupied):
+    """Every square attacked by `color` given the occupancy used for sliding pieces"""
+    pieces = bitboards.pieces
+    base = color << 3
+    pawns = pieces[base | PAWN]
+    if color == WHITE:
+        attacks = ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+    else:
+        attacks = (((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)) & FULL
+    for sq in squares(pieces[base | KNIGHT]):
+        attacks |= KNIGHT_ATTACKS[sq]
+    for sq in squares(pieces[base | KING]):
+        attacks |= KING_ATTACKS[sq]
+    queens = pieces[base | QUEEN]
+    for sq in squares(pieces[base | BISHOP] | queens):
+        attacks |= bishopAttacks(sq, occupied)
+    for sq in squares(pieces[base | ROOK] | queens):
+        attacks |= rookAttacks(sq, occupied)
+    return attacks
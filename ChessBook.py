@@ -0,0 +1,222 @@
+"""
+Opening book: weighted book moves per position, in a file of fixed-width records
+sorted by position key.
+
+The layout is Polyglot's: 16-byte big-endian records of key (64 bits), move (16 bits),
+weight (16 bits) and learn (32 bits, unused here), sorted by key. Keys are this
+engine's Zobrist keys (ChessZobrist), not Polyglot's random numbers, so books are built
+with build() rather than taken from other programs. Moves are Polyglot's: to file,
+to rank, from file and from rank in 3 bits each from bit 0, the promotion piece
+(1 knight to 4 queen) in bits 12-14, and castling written as the king taking its rook.
+
+OpeningBook maps the file read-only and binary-searches it, so opening a book costs
+nothing up front whatever its size, and a lookup reads about log2(entries) records.
+
+    python ChessBook.py book.bin --from-pgn games.pgn --plies 24  # build a book
+    python ChessBook.py book.bin                                  # book moves of the start position
+    python ChessBook.py book.bin --fen "<fen>"                    # book moves of a position
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+import ChessEngine
+import ChessPGN
+
+ENTRY = struct.Struct(">QHHI") # key, move, weight, learn
+ENTRY_BYTES = ENTRY.size
+_KEY = struct.Struct(">Q")
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+DEFAULT_PLIES = 24
+MAX_WEIGHT = 0xFFFF
+
+# Weight a game adds to each of the winner's moves, by result from the mover's point of view
+WIN_WEIGHT, DRAW_WEIGHT, LOSS_WEIGHT = 2, 1, 0
+
+
+class BookError(ValueError):
+    pass
+
+
+def encode_move(move):
+    """Polyglot encoding of a packed move"""
+    start = move & 63
+    end = move >> 6 & 63
+    flag = move >> 12 & 15
+    promotion = 0
+    if flag == ChessEngine.MOVE_CASTLE:
+        end = (end & ~7) | (7 if end & 7 == 6 else 0) # the king takes its own rook
+    elif flag >= ChessEngine.MOVE_PROMOTION:
+        promotion = flag - ChessEngine.MOVE_PROMOTION + 1
+    # Polyglot counts ranks from white's side; squares here count rows from black's
+    return promotion << 12 | (start ^ 56) << 6 | (end ^ 56)
+
+
+def decode_move(gs, bookMove, moves=None):
+    """The legal packed move of gs that bookMove encodes, or None"""
+    moves = gs.getValidMoveCodes() if moves is None else moves
+    for move in moves:
+        if encode_move(move) == bookMove:
+            return move
+    return None
+
+
+class OpeningBook():
+    """Read-only, memory-mapped view of a book file"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size % ENTRY_BYTES:
+            self._file.close()
+            raise BookError(f"{path}: size is not a multiple of {ENTRY_BYTES}-byte entries")
+        self._count = size // ENTRY_BYTES
+        # mmap refuses empty files, and an empty book has nothing to map anyway
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._count else None
+
+    def __len__(self):
+        return self._count
+
+    def _first(self, key):
+        """Index of the first entry whose key is not below key"""
+        lo, hi = 0, self._count
+        data = self._map
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if _KEY.unpack_from(data, mid * ENTRY_BYTES)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def entries(self, key):
+        """(book move, weight) of every entry for a position key, in file order"""
+        found = []
+        i = self._first(key)
+        while i < self._count:
+            entryKey, bookMove, weight, _ = ENTRY.unpack_from(self._map, i * ENTRY_BYTES)
+            if entryKey != key:
+                break
+            found.append((bookMove, weight))
+            i += 1
+        return found
+
+    def moves(self, gs):
+        """(packed move, weight) of the book moves of gs that are legal there, heaviest first"""
+        entries = self.entries(gs.zobristKey)
+        if not entries:
+            return []
+        legal = gs.getValidMoveCodes()
+        found = []
+        for bookMove, weight in entries:
+            move = decode_move(gs, bookMove, legal)
+            if move is not None and weight > 0:
+                found.append((move, weight))
+        found.sort(key=lambda entry: entry[1], reverse=True)
+        return found
+
+    def choose(self, gs, rng=random):
+        """A book move of gs picked at random in proportion to its weight, or None"""
+        found = self.moves(gs)
+        if not found:
+            return None
+        moves, weights = zip(*found)
+        return rng.choices(moves, weights)[0]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path=DEFAULT_PATH):
+    """OpeningBook for path, or None if there is no book there"""
+    return OpeningBook(path) if os.path.exists(path) else None
+
+
+def build(path, source, plies=DEFAULT_PLIES, min_weight=1, errors=None):
+    """
+    Writes a book of the first plies moves of every game in a PGN file or stream and
+    returns how many entries were written. A move earns WIN_WEIGHT when its side went on
+    to win the game, DRAW_WEIGHT for a draw or unfinished game, and LOSS_WEIGHT for a
+    loss; entries below min_weight are left out. A game whose first plies moves cannot be
+    replayed is left out whole; pass a list as errors to collect (game number, message)
+    for each game skipped.
+    """
+    weights = {} # (key, book move) -> weight
+    for number, game in enumerate(ChessPGN.read_games(source), 1):
+        white = {"1-0": WIN_WEIGHT, "0-1": LOSS_WEIGHT}.get(game.result, DRAW_WEIGHT)
+        black = {"1-0": LOSS_WEIGHT, "0-1": WIN_WEIGHT}.get(game.result, DRAW_WEIGHT)
+        entries = []
+        try:
+            for ply, (gs, move) in enumerate(game.replay()):
+                if ply >= plies:
+                    break
+                entries.append(((gs.zobristKey, encode_move(move)), white if gs.whiteToMove else black))
+        except ValueError as e: # PGNError, or a bad FEN tag
+            if errors is not None:
+                errors.append((number, str(e)))
+            continue
+        for entry, weight in entries:
+            weights[entry] = weights.get(entry, 0) + weight
+
+    # Scale each position's weights down together if the heaviest does not fit in 16 bits
+    scale = {}
+    for (key, _), weight in weights.items():
+        if weight > MAX_WEIGHT and weight > scale.get(key, 0):
+            scale[key] = weight
+    count = 0
+    with open(path, "wb") as f:
+        for (key, bookMove), weight in sorted(weights.items(), key=lambda item: (item[0][0], -item[1])):
+            if key in scale:
+                weight = max(1, weight * MAX_WEIGHT // scale[key])
+            if weight < min_weight:
+                continue
+            f.write(ENTRY.pack(key, bookMove, weight, 0))
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    parser.add_argument("book")
+    parser.add_argument("--from-pgn", help="build the book from the games in this PGN file")
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="moves of each game to keep")
+    parser.add_argument("--min-weight", type=int, default=1, help="leave out lighter entries")
+    parser.add_argument("--fen", help="position to list the book moves of (default: the start)")
+    args = parser.parse_args(argv)
+    if args.from_pgn:
+        start = time.perf_counter()
+        errors = []
+        count = build(args.book, args.from_pgn, args.plies, args.min_weight, errors)
+        elapsed = time.perf_counter() - start
+        for number, message in errors:
+            print(f"game {number} skipped: {message}", file=sys.stderr)
+        print(f"{count} entries, {count * ENTRY_BYTES / 1024:,.0f} KB, built in {elapsed:.2f}s, "
+              f"{len(errors)} games skipped")
+        return 0
+    gs = ChessEngine.GameState(fen=args.fen)
+    with OpeningBook(args.book) as book:
+        start = time.perf_counter()
+        found = book.moves(gs)
+        elapsed = time.perf_counter() - start
+        total = sum(weight for _, weight in found) or 1
+        for move, weight in found:
+            print(f"{ChessPGN.move_to_san(gs, move):<8} {weight:>6} {100 * weight / total:5.1f}%")
+        print(f"{len(book)} entries, {len(found)} book moves, looked up in {elapsed * 1e6:,.0f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
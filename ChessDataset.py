@@ -0,0 +1,225 @@
+"""
+Position datasets: files of fixed-width packed positions (GameState.getPacked()).
+
+A dataset file is a 16-byte header (MAGIC, then the record size as a 32-bit int and
+four spare bytes) followed by PACKED_POSITION_BYTES per position, so position i lives
+at a fixed offset. Dataset maps the file read-only, so opening a file of millions of
+positions costs nothing up front and memory use stays flat however many are read.
+Dataset.array() views the records as a NumPy structured array without copying; NumPy
+is only needed for that.
+
+    python ChessDataset.py positions.dat --from-pgn games.pgn  # pack every position of a PGN
+    python ChessDataset.py positions.dat --from-fens list.fen  # pack FEN lines
+    python ChessDataset.py positions.dat                       # count and check positions
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+import ChessEngine
+import ChessPGN
+from ChessEngine import PACKED_POSITION_BYTES
+
+MAGIC = b"CHESSPOS"
+HEADER = struct.Struct("<8sI4x")
+HEADER_BYTES = HEADER.size
+
+# Field layout of ChessEngine.PACKED_POSITION, for NumPy
+RECORD_FIELDS = [("occupied", "<u8"), ("pieces", "u1", (16,)), ("flags", "u1"), ("enpassant", "u1"),
+                 ("halfmove", "<u2"), ("fullmove", "<u2"), ("spare", "<u2")]
+
+
+class DatasetError(ValueError):
+    pass
+
+
+def record_dtype():
+    """NumPy dtype of one packed position"""
+    import numpy
+    return numpy.dtype(RECORD_FIELDS)
+
+
+class DatasetWriter():
+    """
+    Appends packed positions to a dataset file. Use as a context manager, or call
+    close(); records are written through a buffered file, so add() is cheap.
+    """
+
+    def __init__(self, path, append=False):
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, "r+b" if exists else "wb")
+        if exists:
+            _read_header(self.file.read(HEADER_BYTES), path)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file.write(HEADER.pack(MAGIC, PACKED_POSITION_BYTES))
+        self.count = 0 # positions written by this writer
+
+    def add(self, gs):
+        self.file.write(gs.getPacked())
+        self.count += 1
+
+    def add_packed(self, data):
+        if len(data) != PACKED_POSITION_BYTES:
+            raise DatasetError(f"Packed position must be {PACKED_POSITION_BYTES} bytes, not {len(data)}")
+        self.file.write(data)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_header(data, path):
+    if len(data) < HEADER_BYTES:
+        raise DatasetError(f"{path}: not a position dataset")
+    magic, record_bytes = HEADER.unpack(data[:HEADER_BYTES])
+    if magic != MAGIC:
+        raise DatasetError(f"{path}: not a position dataset")
+    if record_bytes != PACKED_POSITION_BYTES:
+        raise DatasetError(f"{path}: {record_bytes}-byte records, expected {PACKED_POSITION_BYTES}")
+
+
+class Dataset():
+    """
+    Read-only, memory-mapped view of a dataset file. dataset[i] is the packed bytes of
+    position i and position(i) decodes it; both work in O(1) for any i.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        _read_header(self._file.read(HEADER_BYTES), path)
+        if (size - HEADER_BYTES) % PACKED_POSITION_BYTES:
+            self._file.close()
+            raise DatasetError(f"{path}: truncated record at the end")
+        self._count = (size - HEADER_BYTES) // PACKED_POSITION_BYTES
+        # mmap refuses empty files, and a header-only dataset has nothing to map anyway
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._count else None
+        self._view = memoryview(self._map)[HEADER_BYTES:] if self._map else memoryview(b"")
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("position index out of range")
+        offset = i * PACKED_POSITION_BYTES
+        return bytes(self._view[offset:offset + PACKED_POSITION_BYTES])
+
+    def __iter__(self):
+        view = self._view
+        for offset in range(0, self._count * PACKED_POSITION_BYTES, PACKED_POSITION_BYTES):
+            yield bytes(view[offset:offset + PACKED_POSITION_BYTES])
+
+    def position(self, i, gs=None):
+        """GameState for position i; pass gs to reuse one instead of allocating a new one"""
+        if gs is None:
+            return ChessEngine.GameState.fromPacked(self[i])
+        gs.loadPacked(self[i])
+        return gs
+
+    def positions(self):
+        """Yields every position, decoded into one reused GameState"""
+        gs = ChessEngine.GameState()
+        for data in self:
+            gs.loadPacked(data)
+            yield gs
+
+    def array(self):
+        """The records as a read-only NumPy structured array (see RECORD_FIELDS) backed by the file"""
+        import numpy
+        if not self._count:
+            return numpy.empty(0, dtype=record_dtype())
+        return numpy.frombuffer(self._map, dtype=record_dtype(), count=self._count, offset=HEADER_BYTES)
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass # arrays from array() still use the mapping; it is unmapped when they go
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_fens(path, fens):
+    """Packs FEN strings into a new dataset file; returns how many were written"""
+    gs = ChessEngine.GameState()
+    with DatasetWriter(path) as writer:
+        for fen in fens:
+            gs.loadFen(fen)
+            writer.add(gs)
+    return writer.count
+
+
+def write_games(path, source, errors=None):
+    """
+    Packs every position of every game in a PGN file or stream; returns how many were
+    written. A game that cannot be replayed is left out whole; pass a list as errors to
+    collect (game number, message) for each game skipped.
+    """
+    with DatasetWriter(path) as writer:
+        for number, game in enumerate(ChessPGN.read_games(source), 1):
+            packed = []
+            try:
+                gs = None
+                for gs, _ in game.replay():
+                    packed.append(gs.getPacked())
+                if gs is None:
+                    gs = ChessEngine.GameState(fen=game.headers.get("FEN"))
+                packed.append(gs.getPacked())
+            except ValueError as e: # PGNError, or a bad FEN tag
+                if errors is not None:
+                    errors.append((number, str(e)))
+                continue
+            for data in packed:
+                writer.add_packed(data)
+    return writer.count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or check a packed position dataset")
+    parser.add_argument("dataset")
+    parser.add_argument("--from-pgn", help="pack every position of the games in this PGN file")
+    parser.add_argument("--from-fens", help="pack the FEN lines of this file")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    errors = []
+    if args.from_pgn:
+        count = write_games(args.dataset, args.from_pgn, errors)
+    elif args.from_fens:
+        with open(args.from_fens) as f:
+            count = write_fens(args.dataset, (line for line in f if line.strip()))
+    else:
+        with Dataset(args.dataset) as dataset:
+            count = sum(1 for _ in dataset.positions())
+    elapsed = time.perf_counter() - start
+    print(f"{count} positions, {count * PACKED_POSITION_BYTES / 1024:,.0f} KB, {elapsed:.2f}s, "
+          f"{count / elapsed if elapsed else 0:,.0f} positions/s")
+    for number, message in errors:
+        print(f"game {number} skipped: {message}", file=sys.stderr)
+    if args.from_pgn:
+        print(f"{len(errors)} games skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,60 @@
+import os
+import struct
+
+from ChessBitboard import (Bitboards, EMPTY, PIECE_CODES, PIECE_NAMES, FULL, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, WHITE, BLACK,
+                           PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, ROOK_DIRECTIONS, BISHOP_DIRECTIONS,
+                           RAYS, RAY_POSITIVE, rookAttacks, bishopAttacks, isAttacked, attackMap,
+                           popcount, squares, MOVE_NORMAL, MOVE_DOUBLE_PUSH, MOVE_CASTLE, MOVE_EN_PASSANT,
+                           MOVE_PROMOTION)
+from ChessZobrist import PIECE_SQUARE, SIDE_TO_MOVE, CASTLING, EN_PASSANT_FILE, computeKey
+from ChessEval import MIDGAME_VALUES, ENDGAME_VALUES, PIECE_PHASE, computeEval
+
+
+# Moves are packed into ints: start square (row * 8 + col) in bits 0-5, end square in bits 6-11,
+# a flag in bits 12-15 (MOVE_NORMAL to MOVE_PROMOTION + 3, from ChessBitboard), the moving
+# piece code in bits 16-19 and the captured piece code in bits 20-23. The low 16 bits identify
+# the move; the piece codes let undoMove work from the int.
+PROMOTION_FLAGS = (MOVE_PROMOTION + 3, MOVE_PROMOTION, MOVE_PROMOTION + 2, MOVE_PROMOTION + 1) # queen first
+PROMOTION_PIECES = "NBRQ"
+MOVE_ID_MASK = 0xFFFF
+WHITE_KING = WHITE << 3 | KING
+BLACK_KING = BLACK << 3 | KING
+
+# Castling rights are a 4-bit mask. Moving from or to a square clears the rights in its
+# CASTLING_MASK entry, which covers king moves, rook moves and rook captures alike.
+CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ = 1, 2, 4, 8
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[0] = 15 ^ CASTLE_BQ
+CASTLING_MASK[4] = 15 ^ (CASTLE_BK | CASTLE_BQ)
+CASTLING_MASK[7] = 15 ^ CASTLE_BK
+CASTLING_MASK[56] = 15 ^ CASTLE_WQ
+CASTLING_MASK[60] = 15 ^ (CASTLE_WK | CASTLE_WQ)
+CASTLING_MASK[63] = 15 ^ CASTLE_WK
+
+
+MOVE_INDEX_CACHE = 16 # positions whose MoveIndex a GameState keeps, see legalMoveIndex
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_CASTLING = {"K": CASTLE_WK, "Q": CASTLE_WQ, "k": CASTLE_BK, "q": CASTLE_BQ}
+
+# Packed positions are 32 bytes, little-endian: the occupied squares as a 64-bit set, the
+# piece codes of those squares in square order two to a byte (low nibble first, at most 32
+# pieces), side to move in bit 0 and castling rights in bits 1-4 of one byte, the en passant
+# square (PACKED_NO_SQUARE if none), the halfmove clock, the fullmove number and two spare bytes.
+PACKED_POSITION = struct.Struct("<Q16sBBHHxx")
+PACKED_POSITION_BYTES = PACKED_POSITION.size
+PACKED_NO_SQUARE = 0xFF
+
+
+def encodeMove(start, end, flag, moved, captured):
+    return start | end << 6 | flag << 12 | moved << 16 | captured << 20
+
+
 class GameState():
-    def __init__(self):
+    # Recompute the evaluation sums after every makeMove/undoMove and raise if they differ
+    checkEval = bool(os.environ.get("CHESS_CHECK_EVAL"))
+
+    def __init__(self, fen=None):
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
@@ -9,11 +64,27 @@ class GameState():
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
-        self.moveFunctions = {'p': self.getPawnMoves,
-                            'R': self.getRookMoves, 'N': self.getKnightMoves, 'B': self.getBishopMoves,
-                            'Q': self.getQueenMoves, 'K': self.getKingMoves}
+        # Move generation runs on bitboards; self.board is kept in sync as a view for drawing
+        self.bitboards = Bitboards(self.board)
+        # attackMaps[color] is the set of squares that colour attacks, computed on first use.
+        self.attackMaps = [None, None]
         self.whiteToMove = True
-        self.moveLog = []
+        self.castlingRights = CASTLE_WK | CASTLE_WQ | CASTLE_BK | CASTLE_BQ
+        # Square a pawn just skipped over, set only when an enemy pawn could capture onto it
+        self.enpassantSquare = None
+        self.halfmoveClock = 0 # plies since the last capture or pawn move, for the 50-move rule
+        self.fullmoveNumber = 1
+        self.moveLog = [] # packed move ints, see encodeMove; Move.fromCode rebuilds a Move
+        # makeMove saves (castlingRights, enpassantSquare, attackMaps, halfmoveClock) here for undoMove
+        self.stateLog = []
+        # Zobrist key of the current position; keyLog[i] is the key before moveLog[i] was made
+        self.zobristKey = computeKey(self.bitboards.mailbox, self.whiteToMove, self.castlingRights,
+                                     self.enpassantSquare)
+        self.keyLog = []
+        # Running material plus piece-square sums (white positive) and game phase, see ChessEval
+        self.midgameScore, self.endgameScore, self.phase = computeEval(self.bitboards.mailbox)
+        # makeMove saves (midgameScore, endgameScore, phase) here for undoMove
+        self.evalLog = []
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
         self.inCheck = False
@@ -21,32 +92,289 @@ class GameState():
         self.checks = []
         self.checkmate = False
         self.stalemate = False
-    
+        # zobristKey -> MoveIndex of recently indexed positions, oldest first. Keys change with
+        # every makeMove and undoMove, so a lookup only ever finds the current position's moves.
+        self.moveIndexes = {}
+        if fen is not None:
+            self.loadFen(fen)
+
+    def loadFen(self, fen):
+        """Replaces the position with the one described by a FEN string; the move history is cleared"""
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        placement, side, castling, enpassant = fields[:4]
+        if side not in ("w", "b"):
+            raise ValueError(f"Invalid FEN side to move: {side!r}")
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"Invalid FEN move counters: {' '.join(fields[4:6])!r}") from None
+        rows = placement.split("/")
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN placement: {placement!r}")
+        board = []
+        for row in rows:
+            boardRow = []
+            for ch in row:
+                if ch.isdigit():
+                    boardRow.extend(["--"] * int(ch))
+                elif ch.lower() in "pnbrqk":
+                    boardRow.append(("w" if ch.isupper() else "b") + (ch.upper() if ch.lower() != "p" else "p"))
+                else:
+                    raise ValueError(f"Invalid FEN piece: {ch!r}")
+            if len(boardRow) != 8:
+                raise ValueError(f"Invalid FEN row: {row!r}")
+            board.append(boardRow)
+        castlingRights = 0
+        if castling != "-":
+            for ch in castling:
+                if ch not in FEN_CASTLING:
+                    raise ValueError(f"Invalid FEN castling rights: {castling!r}")
+                castlingRights |= FEN_CASTLING[ch]
+        enpassantSquare = None
+        if enpassant != "-":
+            if len(enpassant) != 2 or enpassant[0] not in Move.filesToCols or enpassant[1] not in "36":
+                raise ValueError(f"Invalid FEN en passant square: {enpassant!r}")
+            enpassantSquare = Move.ranksToRows[enpassant[1]] * 8 + Move.filesToCols[enpassant[0]]
+        self.setPosition(board, side == "w", castlingRights, enpassantSquare, halfmoveClock, fullmoveNumber)
+
+    def setPosition(self, board, whiteToMove, castlingRights, enpassantSquare, halfmoveClock=0, fullmoveNumber=1):
+        """
+        Replaces the position with the given 8x8 board and state; the move history is cleared.
+        Raises ValueError, leaving the position alone, unless each side has exactly one king.
+        """
+        bitboards = Bitboards(board)
+        for king, name in ((WHITE_KING, "white"), (BLACK_KING, "black")):
+            count = popcount(bitboards.pieces[king])
+            if count != 1:
+                raise ValueError(f"Invalid position: {count} {name} kings")
+        self.board = board
+        self.bitboards = bitboards
+        self.attackMaps = [None, None]
+        self.whiteToMove = whiteToMove
+        self.castlingRights = castlingRights
+        mover = WHITE if whiteToMove else BLACK
+        self.enpassantSquare = None
+        if enpassantSquare is not None and PAWN_ATTACKS[mover ^ 1][enpassantSquare] & self.bitboards.pieces[mover << 3 | PAWN]:
+            self.enpassantSquare = enpassantSquare
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        sq = bitboards.pieces[WHITE_KING].bit_length() - 1
+        self.whiteKingLocation = (sq >> 3, sq & 7)
+        sq = bitboards.pieces[BLACK_KING].bit_length() - 1
+        self.blackKingLocation = (sq >> 3, sq & 7)
+        self.moveLog = []
+        self.stateLog = []
+        self.keyLog = []
+        self.zobristKey = computeKey(self.bitboards.mailbox, self.whiteToMove, self.castlingRights,
+                                     self.enpassantSquare)
+        self.midgameScore, self.endgameScore, self.phase = computeEval(self.bitboards.mailbox)
+        self.evalLog = []
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.checkmate = False
+        self.stalemate = False
+
+    def getPacked(self):
+        """The current position as PACKED_POSITION_BYTES bytes, see PACKED_POSITION"""
+        mailbox = self.bitboards.mailbox
+        occupied = self.bitboards.occupied
+        codes = [mailbox[sq] for sq in squares(occupied)]
+        if len(codes) > 32:
+            raise ValueError("Too many pieces to pack")
+        codes += [EMPTY] * (32 - len(codes))
+        pieces = bytes(codes[i] | codes[i + 1] << 4 for i in range(0, 32, 2))
+        flags = (0 if self.whiteToMove else 1) | self.castlingRights << 1
+        enpassant = PACKED_NO_SQUARE if self.enpassantSquare is None else self.enpassantSquare
+        return PACKED_POSITION.pack(occupied, pieces, flags, enpassant,
+                                    min(self.halfmoveClock, 0xFFFF), min(self.fullmoveNumber, 0xFFFF))
+
+    def loadPacked(self, data):
+        """Replaces the position with one from getPacked(); the move history is cleared"""
+        if len(data) != PACKED_POSITION_BYTES:
+            raise ValueError(f"Packed position must be {PACKED_POSITION_BYTES} bytes, not {len(data)}")
+        occupied, pieces, flags, enpassant, halfmoveClock, fullmoveNumber = PACKED_POSITION.unpack(data)
+        board = [["--"] * 8 for _ in range(8)]
+        for i, sq in enumerate(squares(occupied)):
+            if i == 32:
+                raise ValueError("Too many pieces in packed position")
+            code = pieces[i >> 1] >> (i & 1) * 4 & 15
+            if PIECE_NAMES[code] == "--":
+                raise ValueError(f"Invalid piece code {code} in packed position")
+            board[sq >> 3][sq & 7] = PIECE_NAMES[code]
+        if enpassant != PACKED_NO_SQUARE and enpassant > 63:
+            raise ValueError(f"Invalid en passant square {enpassant} in packed position")
+        self.setPosition(board, not flags & 1, flags >> 1 & 15,
+                         None if enpassant == PACKED_NO_SQUARE else enpassant, halfmoveClock, fullmoveNumber)
+
+    @classmethod
+    def fromPacked(cls, data):
+        gs = cls()
+        gs.loadPacked(data)
+        return gs
+
+    def getFen(self):
+        """FEN string of the current position"""
+        rows = []
+        for boardRow in self.board:
+            row = ""
+            empty = 0
+            for piece in boardRow:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+            rows.append(row + (str(empty) if empty else ""))
+        castling = "".join(ch for ch, right in FEN_CASTLING.items() if self.castlingRights & right) or "-"
+        enpassant = "-"
+        if self.enpassantSquare is not None:
+            enpassant = Move.colsToFiles[self.enpassantSquare & 7] + Move.rowsToRanks[self.enpassantSquare >> 3]
+        return (f"{'/'.join(rows)} {'w' if self.whiteToMove else 'b'} {castling} {enpassant} "
+                f"{self.halfmoveClock} {self.fullmoveNumber}")
+
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move)
+        code = move if move.__class__ is int else move.code
+        start = code & 63
+        end = code >> 6 & 63
+        flag = code >> 12 & 15
+        moved = code >> 16 & 15
+        board = self.board
+        bitboards = self.bitboards
+        key = self.zobristKey
+        self.keyLog.append(key)
+        self.moveLog.append(code)
+        self.stateLog.append((self.castlingRights, self.enpassantSquare, self.attackMaps, self.halfmoveClock))
+        midgame, endgame, phase = self.midgameScore, self.endgameScore, self.phase
+        self.evalLog.append((midgame, endgame, phase))
+        self.attackMaps = [None, None]
+        self.halfmoveClock = 0 if moved & 7 == PAWN or code >> 20 & 15 else self.halfmoveClock + 1
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
+
+        board[start >> 3][start & 7] = "--"
+        captured = bitboards.move(start, end)
+        key ^= PIECE_SQUARE[moved][start] ^ PIECE_SQUARE[moved][end] ^ SIDE_TO_MOVE
+        if captured:
+            key ^= PIECE_SQUARE[captured][end]
+            midgame -= MIDGAME_VALUES[captured][end]
+            endgame -= ENDGAME_VALUES[captured][end]
+            phase -= PIECE_PHASE[captured]
+        placed = moved
+        if flag >= MOVE_PROMOTION:
+            placed = (moved & 8) | (KNIGHT + flag - MOVE_PROMOTION)
+            bitboards.remove(end)
+            bitboards.put(end, placed)
+            key ^= PIECE_SQUARE[moved][end] ^ PIECE_SQUARE[placed][end]
+            phase += PIECE_PHASE[placed]
+        elif flag == MOVE_EN_PASSANT:
+            capturedSq = (start & ~7) | (end & 7) # the captured pawn sits beside the capturing one
+            captured = bitboards.remove(capturedSq)
+            board[capturedSq >> 3][capturedSq & 7] = "--"
+            key ^= PIECE_SQUARE[captured][capturedSq]
+            midgame -= MIDGAME_VALUES[captured][capturedSq]
+            endgame -= ENDGAME_VALUES[captured][capturedSq]
+        elif flag == MOVE_CASTLE:
+            rookStart, rookEnd = (end + 1, end - 1) if end > start else (end - 2, end + 1)
+            rook = bitboards.mailbox[rookStart]
+            bitboards.move(rookStart, rookEnd)
+            board[rookStart >> 3][rookStart & 7] = "--"
+            board[rookEnd >> 3][rookEnd & 7] = PIECE_NAMES[rook]
+            key ^= PIECE_SQUARE[rook][rookStart] ^ PIECE_SQUARE[rook][rookEnd]
+            midgame += MIDGAME_VALUES[rook][rookEnd] - MIDGAME_VALUES[rook][rookStart]
+            endgame += ENDGAME_VALUES[rook][rookEnd] - ENDGAME_VALUES[rook][rookStart]
+        board[end >> 3][end & 7] = PIECE_NAMES[placed]
+        self.midgameScore = midgame + MIDGAME_VALUES[placed][end] - MIDGAME_VALUES[moved][start]
+        self.endgameScore = endgame + ENDGAME_VALUES[placed][end] - ENDGAME_VALUES[moved][start]
+        self.phase = phase
+
         self.whiteToMove = not self.whiteToMove
-        if move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
+        if moved == WHITE_KING:
+            self.whiteKingLocation = (end >> 3, end & 7)
+        elif moved == BLACK_KING:
+            self.blackKingLocation = (end >> 3, end & 7)
+
+        rights = self.castlingRights & CASTLING_MASK[start] & CASTLING_MASK[end]
+        if rights != self.castlingRights:
+            key ^= CASTLING[self.castlingRights] ^ CASTLING[rights]
+            self.castlingRights = rights
+        if self.enpassantSquare is not None:
+            key ^= EN_PASSANT_FILE[self.enpassantSquare & 7]
+            self.enpassantSquare = None
+        if flag == MOVE_DOUBLE_PUSH:
+            skipped = (start + end) >> 1
+            mover = moved >> 3
+            if PAWN_ATTACKS[mover][skipped] & bitboards.pieces[(mover ^ 1) << 3 | PAWN]:
+                self.enpassantSquare = skipped
+                key ^= EN_PASSANT_FILE[skipped & 7]
+        self.zobristKey = key
+        if self.checkEval:
+            self.verifyEval()
 
     def undoMove(self):
         if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            code = self.moveLog.pop()
+            start = code & 63
+            end = code >> 6 & 63
+            flag = code >> 12 & 15
+            moved = code >> 16 & 15
+            captured = code >> 20 & 15
+            board = self.board
+            bitboards = self.bitboards
+            bitboards.remove(end)
+            bitboards.put(start, moved)
+            board[start >> 3][start & 7] = PIECE_NAMES[moved]
+            if flag == MOVE_EN_PASSANT:
+                capturedSq = (start & ~7) | (end & 7)
+                bitboards.put(capturedSq, captured)
+                board[capturedSq >> 3][capturedSq & 7] = PIECE_NAMES[captured]
+                board[end >> 3][end & 7] = "--"
+            else:
+                if captured:
+                    bitboards.put(end, captured)
+                board[end >> 3][end & 7] = PIECE_NAMES[captured]
+                if flag == MOVE_CASTLE:
+                    rookStart, rookEnd = (end + 1, end - 1) if end > start else (end - 2, end + 1)
+                    bitboards.move(rookEnd, rookStart)
+                    board[rookStart >> 3][rookStart & 7] = board[rookEnd >> 3][rookEnd & 7]
+                    board[rookEnd >> 3][rookEnd & 7] = "--"
+            self.castlingRights, self.enpassantSquare, self.attackMaps, self.halfmoveClock = self.stateLog.pop()
+            self.zobristKey = self.keyLog.pop()
+            self.midgameScore, self.endgameScore, self.phase = self.evalLog.pop()
             self.whiteToMove = not self.whiteToMove  
-            if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+            if moved == WHITE_KING:
+                self.whiteKingLocation = (start >> 3, start & 7)
+            elif moved == BLACK_KING:
+                self.blackKingLocation = (start >> 3, start & 7)
             # Reset checkmate and stalemate flags
             self.checkmate = False
             self.stalemate = False
+            if self.checkEval:
+                self.verifyEval()
+
+    def verifyEval(self):
+        """Raises AssertionError if the running evaluation sums differ from a full recompute"""
+        expected = computeEval(self.bitboards.mailbox)
+        if (self.midgameScore, self.endgameScore, self.phase) != expected:
+            raise AssertionError(f"Evaluation sums {(self.midgameScore, self.endgameScore, self.phase)} "
+                                 f"!= {expected} after {len(self.moveLog)} moves in {self.getFen()}")
 
     def getValidMoves(self):
+        return [Move.fromCode(code) for code in self.getValidMoveCodes()]
+
+    def getValidMoveCodes(self, quiet=True):
+        """
+        Legal moves as packed ints; the search uses these, the UI uses getValidMoves.
+        quiet=False leaves out moves that neither capture nor promote, and leaves the
+        checkmate and stalemate flags alone, since no captures is not the end of the game.
+        """
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
         if self.whiteToMove:
@@ -55,34 +383,16 @@ class GameState():
         else:
             kingRow = self.blackKingLocation[0]
             kingCol = self.blackKingLocation[1]
-        
-        if self.inCheck:
-            if len(self.checks) == 1: # Single check
-                moves = self.getAllPossibleMoves() # Default for_attack_check=False
-                # filter out moves that don't resolve the check
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = [] # Squares that block the check or capture the checking piece
-                if pieceChecking[1] == "N": # Knight check
-                    validSquares = [(checkRow, checkCol)]
-                else: # Rook, Bishop, Queen check
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol: # Reached the checking piece
-                            break
-                
-                # Remove moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != "K": # Non-king moves
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares: # Move doesn't block or capture
-                            moves.remove(moves[i])
-            else: # Double check, king has to move
-                self.getKingMoves(kingRow, kingCol, moves) # Default for_attack_check=False
-        else: # Not in check
-            moves = self.getAllPossibleMoves() # Default for_attack_check=False
+        kingSq = kingRow * 8 + kingCol
+
+        if len(self.checks) < 2: # In double check only the king can move
+            targets, pinRays = self.pieceTargets(kingSq)
+            self.getPieceMoves(moves, targets, pinRays, quiet)
+        self.getKingMoves(kingRow, kingCol, moves, quiet)
+        if not quiet:
+            return moves
+        if not self.inCheck:
+            self.getCastleMoves(kingSq, moves)
         
         # After generating all moves, determine if it's checkmate or stalemate
         if len(moves) == 0: # No valid moves
@@ -96,222 +406,414 @@ class GameState():
             
         return moves
 
-    def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove
-        enemyMoves = self.getAllPossibleMoves(for_attack_check=True) # Pass True here
-        self.whiteToMove = not self.whiteToMove
-        for move in enemyMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        return False
+    def pieceTargets(self, kingSq):
+        """
+        (targets, pinRays) for the pieces other than the king, after checkForPinsAndChecks:
+        the squares they may move to (anywhere, or when in check the checking piece and the
+        squares between it and the king), and for each pinned piece the line it may stay on.
+        """
+        targets = FULL
+        if self.inCheck:
+            checkRow, checkCol, dr, dc = self.checks[0]
+            checkSq = checkRow * 8 + checkCol
+            if self.bitboards.mailbox[checkSq] & 7 in (KNIGHT, PAWN):
+                targets = 1 << checkSq
+            else:
+                targets = RAYS[(dr, dc)][kingSq] ^ RAYS[(dr, dc)][checkSq]
+        # A pinned piece may only move along the line through its king and the pinning piece
+        pinRays = {r * 8 + c: RAYS[(dr, dc)][kingSq] for r, c, dr, dc in self.pins}
+        return targets, pinRays
 
-    def getAllPossibleMoves(self, for_attack_check=False): # Add for_attack_check parameter
+    def legalMoveIndex(self):
+        """
+        MoveIndex of the current position, kept for the last MOVE_INDEX_CACHE positions by
+        Zobrist key, so redrawing, checking clicks and undoing a move back to an indexed
+        position generate nothing. Sets inCheck, checkmate and stalemate as getValidMoveCodes does.
+        """
+        index = self.moveIndexes.get(self.zobristKey)
+        if index is None:
+            index = MoveIndex(self.getValidMoveCodes(), self.inCheck)
+            if len(self.moveIndexes) >= MOVE_INDEX_CACHE:
+                del self.moveIndexes[next(iter(self.moveIndexes))]
+            self.moveIndexes[self.zobristKey] = index
+        else:
+            self.inCheck = index.inCheck
+            self.checkmate = index.inCheck and not index.moves
+            self.stalemate = not index.inCheck and not index.moves
+        return index
+
+    def getValidMoveCodesFrom(self, sq):
+        """
+        Legal moves of the piece on sq, generating that piece's moves only, or the indexed
+        ones when the position has a MoveIndex. Empty unless the side to move has a piece
+        there. Leaves checkmate and stalemate alone.
+        """
+        index = self.moveIndexes.get(self.zobristKey)
+        if index is not None:
+            return list(index.fromSquare(sq))
+        bitboards = self.bitboards
+        piece = bitboards.mailbox[sq]
+        color = WHITE if self.whiteToMove else BLACK
+        if not piece or piece >> 3 != color:
+            return []
+        kingSq = bitboards.pieces[color << 3 | KING].bit_length() - 1
         moves = []
-        for r in range(8):
-            for c in range(8):
-                turn = self.board[r][c][0]
-                if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    # Pass for_attack_check to specific move functions
-                    self.moveFunctions[piece](r, c, moves, for_attack_check=for_attack_check)
+        if piece & 7 == KING:
+            self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+            self.getKingMoves(kingSq >> 3, kingSq & 7, moves)
+            if not self.inCheck:
+                self.getCastleMoves(kingSq, moves)
+        else: # one square probe instead of the whole attack map the king's moves would need
+            inCheck = isAttacked(bitboards, kingSq, color ^ 1, bitboards.occupied)
+            self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks(inCheck)
+            if len(self.checks) < 2:
+                targets, pinRays = self.pieceTargets(kingSq)
+                self.getPieceMoves(moves, targets, pinRays, origins=1 << sq)
         return moves
 
-    def getPawnMoves(self, r, c, moves, for_attack_check=False): # Add for_attack_check
-        if self.whiteToMove:
-            if self.board[r-1][c] == "--":
-                moves.append(Move((r, c), (r-1, c), self.board))
-                if r == 6 and self.board[r-2][c] == "--":
-                    moves.append(Move((r, c), (r-2, c), self.board))
-            if c-1 >= 0:
-                if self.board[r-1][c-1][0] == "b":
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
-            if c+1 <= 7:
-                if self.board[r-1][c+1][0] == "b":
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
-        else: # black pawn moves
-            if self.board[r+1][c] == "--":
-                moves.append(Move((r, c), (r+1, c), self.board))
-                if r == 1 and self.board[r+2][c] == "--":
-                    moves.append(Move((r, c), (r+2, c), self.board))
-            if c-1 >= 0:
-                if self.board[r+1][c-1][0] == "w":
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
-            if c+1 <= 7:
-                if self.board[r+1][c+1][0] == "w":
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
-
-    def getRookMoves(self, r, c, moves, for_attack_check=False): # Add for_attack_check
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1)]
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                newRow = r + d[0] * i
-                newCol = c + d[1] * i
-                if 0 <= newRow < 8 and 0 <= newCol < 8:
-                    if self.board[newRow][newCol] == "--":
-                        moves.append(Move((r, c), (newRow, newCol), self.board))
-                    elif self.board[newRow][newCol][0] == enemyColor:
-                        moves.append(Move((r, c), (newRow, newCol), self.board))
-                        break
-                    else:
-                        break
-                else:
+    def hasValidMoves(self):
+        """
+        Whether the side to move has a legal move, generating one piece's moves at a time
+        and stopping at the first. Sets inCheck, checkmate and stalemate as getValidMoveCodes does.
+        """
+        index = self.moveIndexes.get(self.zobristKey)
+        if index is not None:
+            self.legalMoveIndex() # sets the flags
+            return bool(index.moves)
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        color = WHITE if self.whiteToMove else BLACK
+        kingSq = self.bitboards.pieces[color << 3 | KING].bit_length() - 1
+        moves = []
+        self.getKingMoves(kingSq >> 3, kingSq & 7, moves) # castling needs a king move to exist
+        if not moves and len(self.checks) < 2:
+            targets, pinRays = self.pieceTargets(kingSq)
+            for sq in squares(self.bitboards.colors[color] ^ 1 << kingSq):
+                if self.getPieceMoves(moves, targets, pinRays, origins=1 << sq):
                     break
+        self.checkmate = self.inCheck and not moves
+        self.stalemate = not self.inCheck and not moves
+        return bool(moves)
+
+    def isInCheck(self):
+        """Whether the side to move is in check, from the attack map generation will reuse"""
+        r, c = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        return bool(self.attackedSquares(not self.whiteToMove) >> (r * 8 + c) & 1)
+
+    def squareUnderAttack(self, r, c):
+        enemy = BLACK if self.whiteToMove else WHITE
+        return isAttacked(self.bitboards, r * 8 + c, enemy, self.bitboards.occupied)
+
+    def attackedSquares(self, white):
+        """
+        Bitboard of squares attacked by white (or black). Sliding attacks pass through the
+        other side's king, so the result is also the set of squares that king may not enter.
+        """
+        color = WHITE if white else BLACK
+        attacks = self.attackMaps[color]
+        if attacks is None:
+            bitboards = self.bitboards
+            occupied = bitboards.occupied ^ bitboards.pieces[(color ^ 1) << 3 | KING]
+            attacks = self.attackMaps[color] = attackMap(bitboards, color, occupied)
+        return attacks
+
+    def getPieceMoves(self, moves, targets=FULL, pinRays=None, quiet=True, origins=FULL):
+        """
+        Appends the moves of every piece but the king that start on a square in origins and
+        end on a square in targets. pinRays maps a pinned piece's square to the squares it may
+        still move to. quiet=False keeps only captures and promotions.
+        """
+        bitboards = self.bitboards
+        mailbox = bitboards.mailbox
+        pieces = bitboards.pieces
+        color = WHITE if self.whiteToMove else BLACK
+        base = color << 3
+        own = bitboards.colors[color]
+        enemy = bitboards.colors[color ^ 1]
+        occupied = own | enemy
+        empty = ~occupied & FULL
+        pinRays = pinRays or {}
 
-    def getKnightMoves(self, r, c, moves, for_attack_check=False): # Add for_attack_check
-        knightMoves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
-        allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
-
-    def getBishopMoves(self, r, c, moves, for_attack_check=False): # Add for_attack_check
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                newRow = r + d[0] * i
-                newCol = c + d[1] * i
-                if 0 <= newRow < 8 and 0 <= newCol < 8:
-                    if self.board[newRow][newCol] == "--":
-                        moves.append(Move((r, c), (newRow, newCol), self.board))
-                    elif self.board[newRow][newCol][0] == enemyColor:
-                        moves.append(Move((r, c), (newRow, newCol), self.board))
-                        break
+        pawns = pieces[base | PAWN] & origins
+        pawnAttacks = PAWN_ATTACKS[color]
+        step, startRank, lastRank = (-8, 6, 0) if color == WHITE else (8, 1, 7)
+        pawnBits = (base | PAWN) << 16
+        while pawns:
+            low = pawns & -pawns
+            pawns ^= low
+            sq = low.bit_length() - 1
+            allowed = targets & pinRays[sq] if sq in pinRays else targets
+            to = sq + step
+            if empty >> to & 1 and (quiet or to >> 3 == lastRank):
+                if allowed >> to & 1:
+                    if to >> 3 == lastRank:
+                        for flag in PROMOTION_FLAGS:
+                            moves.append(sq | to << 6 | flag << 12 | pawnBits)
                     else:
-                        break
+                        moves.append(sq | to << 6 | pawnBits)
+                if sq >> 3 == startRank and empty >> (to + step) & 1 and allowed >> (to + step) & 1:
+                    moves.append(sq | (to + step) << 6 | MOVE_DOUBLE_PUSH << 12 | pawnBits)
+            captures = pawnAttacks[sq] & enemy & allowed
+            while captures:
+                low = captures & -captures
+                captures ^= low
+                to = low.bit_length() - 1
+                if to >> 3 == lastRank:
+                    for flag in PROMOTION_FLAGS:
+                        moves.append(sq | to << 6 | flag << 12 | pawnBits | mailbox[to] << 20)
                 else:
-                    break
+                    moves.append(sq | to << 6 | pawnBits | mailbox[to] << 20)
+            if self.enpassantSquare is not None and pawnAttacks[sq] >> self.enpassantSquare & 1:
+                self.getEnpassantMove(sq, moves)
 
-    def getQueenMoves(self, r, c, moves, for_attack_check=False): # Add for_attack_check
-        self.getRookMoves(r, c, moves, for_attack_check=for_attack_check)
-        self.getBishopMoves(r, c, moves, for_attack_check=for_attack_check)
+        for pieceType in (KNIGHT, BISHOP, ROOK, QUEEN):
+            sources = pieces[base | pieceType] & origins
+            while sources:
+                low = sources & -sources
+                sources ^= low
+                sq = low.bit_length() - 1
+                if pieceType == KNIGHT:
+                    if sq in pinRays: # A pinned knight can never stay on its pin line
+                        continue
+                    destinations = KNIGHT_ATTACKS[sq]
+                elif pieceType == BISHOP:
+                    destinations = bishopAttacks(sq, occupied)
+                elif pieceType == ROOK:
+                    destinations = rookAttacks(sq, occupied)
+                else:
+                    destinations = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+                destinations &= (~own if quiet else enemy) & targets
+                if sq in pinRays:
+                    destinations &= pinRays[sq]
+                fromBits = sq | (base | pieceType) << 16
+                while destinations:
+                    low = destinations & -destinations
+                    destinations ^= low
+                    to = low.bit_length() - 1
+                    moves.append(fromBits | to << 6 | mailbox[to] << 20)
+        return moves
 
-    def getKingMoves(self, r, c, moves, for_attack_check=False): # Add for_attack_check
-        kingMoves = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-        allyColor = "w" if self.whiteToMove else "b"
-        
-        for i in range(8):
-            endRow = r + kingMoves[i][0]
-            endCol = c + kingMoves[i][1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:  # Not an allied piece
-                    if for_attack_check: # If called for attack check, don't validate safety recursively
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    else: # Normal call, validate safety
-                        # Temporarily make the move to check if king would be in check
-                        originalPieceAtStart = self.board[r][c]
-                        originalPieceAtEnd = self.board[endRow][endCol]
-                        
-                        self.board[r][c] = "--"
-                        self.board[endRow][endCol] = originalPieceAtStart # Move king to new square
-                        
-                        originalKingLoc = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
-                        if self.whiteToMove:
-                            self.whiteKingLocation = (endRow, endCol)
-                        else:
-                            self.blackKingLocation = (endRow, endCol)
-
-                        is_safe_square = not self.squareUnderAttack(endRow, endCol)
-                        
-                        self.board[r][c] = originalPieceAtStart
-                        self.board[endRow][endCol] = originalPieceAtEnd
-                        if self.whiteToMove:
-                            self.whiteKingLocation = originalKingLoc
-                        else:
-                            self.blackKingLocation = originalKingLoc
-                        
-                        if is_safe_square:
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-
-    def checkForPinsAndChecks(self):
-        pins = []
-        checks = []
-        inCheck = False
+    def getEnpassantMove(self, sq, moves):
+        """
+        Appends the en passant capture by the pawn on sq if it leaves the king safe. Two pawns
+        leave the capture rank at once, which pin rays do not cover, so the capture is tried
+        on the bitboards and the king checked directly.
+        """
+        bitboards = self.bitboards
+        color = WHITE if self.whiteToMove else BLACK
+        to = self.enpassantSquare
+        capturedSq = (sq & ~7) | (to & 7)
+        captured = bitboards.remove(capturedSq)
+        bitboards.move(sq, to)
+        kingSq = bitboards.pieces[color << 3 | KING].bit_length() - 1
+        safe = not isAttacked(bitboards, kingSq, color ^ 1, bitboards.occupied)
+        bitboards.move(to, sq)
+        bitboards.put(capturedSq, captured)
+        if safe:
+            moves.append(sq | to << 6 | MOVE_EN_PASSANT << 12 | (color << 3 | PAWN) << 16 | captured << 20)
+
+    def getKingMoves(self, r, c, moves, quiet=True):
+        allyColor = WHITE if self.whiteToMove else BLACK
+        sq = r * 8 + c
+        # Drop squares the enemy attacks, looking through our own king
+        targets = KING_ATTACKS[sq] & ~self.attackedSquares(not self.whiteToMove)
+        targets &= ~self.bitboards.colors[allyColor] if quiet else self.bitboards.colors[allyColor ^ 1]
+        mailbox = self.bitboards.mailbox
+        fromBits = sq | (allyColor << 3 | KING) << 16
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            to = low.bit_length() - 1
+            moves.append(fromBits | to << 6 | mailbox[to] << 20)
+
+    def getCastleMoves(self, kingSq, moves):
+        """Appends castling moves; the caller has already checked the king is not in check"""
         if self.whiteToMove:
-            enemyColor = "b"
-            allyColor = "w"
-            startRow = self.whiteKingLocation[0]
-            startCol = self.whiteKingLocation[1]
+            color, kingSide, queenSide, home = WHITE, CASTLE_WK, CASTLE_WQ, 60
         else:
-            enemyColor = "w"
-            allyColor = "b"
-            startRow = self.blackKingLocation[0]
-            startCol = self.blackKingLocation[1]
-        
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = ()
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != "K":
-                        if possiblePin == ():
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:
-                            break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        if (0 <= j <= 3 and type == "R") or \
-                                (4 <= j <= 7 and type == "B") or \
-                                (i == 1 and type == "p" and ((enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) or \
-                                (type == "Q") or (i == 1 and type == "K"):
-                            if possiblePin == ():
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possiblePin)
-                                break
-                        else:
-                            break
-                else:
-                    break
-              
-         
-        knightMoves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == "N":
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
-        
+            color, kingSide, queenSide, home = BLACK, CASTLE_BK, CASTLE_BQ, 4
+        if kingSq != home or not self.castlingRights & (kingSide | queenSide):
+            return
+        mailbox = self.bitboards.mailbox
+        occupied = self.bitboards.occupied
+        attacked = self.attackedSquares(color == BLACK)
+        rook = color << 3 | ROOK
+        fromBits = kingSq | MOVE_CASTLE << 12 | (color << 3 | KING) << 16
+        # The king's path must be empty and unattacked; on the queen side the rook also passes b1/b8
+        if self.castlingRights & kingSide and mailbox[kingSq + 3] == rook:
+            path = 0b11 << (kingSq + 1)
+            if not (occupied | attacked) & path:
+                moves.append(fromBits | (kingSq + 2) << 6)
+        if self.castlingRights & queenSide and mailbox[kingSq - 4] == rook:
+            path = 0b11 << (kingSq - 2)
+            if not (occupied | attacked) & path and not occupied >> (kingSq - 3) & 1:
+                moves.append(fromBits | (kingSq - 2) << 6)
+
+    def checkForPinsAndChecks(self, inCheck=None):
+        """
+        (inCheck, pins, checks) of the side to move. A caller that already knows inCheck
+        passes it, which saves building the enemy attack map when nothing else needs it.
+        """
+        pins = []
+        checks = []
+        bitboards = self.bitboards
+        pieces = bitboards.pieces
+        ally = WHITE if self.whiteToMove else BLACK
+        enemy = ally ^ 1
+        startRow, startCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = startRow * 8 + startCol
+        if inCheck is None:
+            inCheck = bool(self.attackedSquares(enemy == WHITE) >> kingSq & 1)
+
+        # Walk out from the king along each ray: an enemy slider as the first piece gives check,
+        # an allied piece followed by an enemy slider is pinned along that ray.
+        occupied = bitboards.occupied
+        allies = bitboards.colors[ally]
+        queens = pieces[enemy << 3 | QUEEN]
+        for directions, sliders in ((ROOK_DIRECTIONS, pieces[enemy << 3 | ROOK] | queens),
+                                    (BISHOP_DIRECTIONS, pieces[enemy << 3 | BISHOP] | queens)):
+            if not sliders:
+                continue
+            for d in directions:
+                blockers = RAYS[d][kingSq] & occupied
+                if not blockers:
+                    continue
+                positive = RAY_POSITIVE[d]
+                first = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+                if sliders >> first & 1:
+                    checks.append((first // 8, first % 8, d[0], d[1]))
+                elif allies >> first & 1:
+                    blockers ^= 1 << first
+                    if blockers:
+                        second = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+                        if sliders >> second & 1:
+                            pins.append((first // 8, first % 8, d[0], d[1]))
+
+        if inCheck:
+            for sq in squares(PAWN_ATTACKS[ally][kingSq] & pieces[enemy << 3 | PAWN]):
+                checks.append((sq // 8, sq % 8, sq // 8 - startRow, sq % 8 - startCol))
+            for sq in squares(KNIGHT_ATTACKS[kingSq] & pieces[enemy << 3 | KNIGHT]):
+                checks.append((sq // 8, sq % 8, sq // 8 - startRow, sq % 8 - startCol))
+
         return inCheck, pins, checks
 
 
+class MoveIndex():
+    """
+    The legal moves of one position as packed ints, indexed by origin square and by
+    (origin, destination) pair, so looking up a clicked square or move costs a dict lookup.
+    A pair holds several moves only for promotions, queen first. See GameState.legalMoveIndex.
+    """
+    __slots__ = ("moves", "inCheck", "byOrigin", "byPair")
+
+    def __init__(self, moves, inCheck):
+        self.moves = moves
+        self.inCheck = inCheck
+        self.byOrigin = {} # start square -> [moves]
+        self.byPair = {} # start | end << 6 -> [moves]
+        for move in moves:
+            self.byOrigin.setdefault(move & 63, []).append(move)
+            self.byPair.setdefault(move & 0xFFF, []).append(move)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __iter__(self):
+        return iter(self.moves)
+
+    def __contains__(self, move):
+        return move in self.byPair.get(move & 0xFFF, ())
+
+    def fromSquare(self, sq):
+        """The moves starting on sq"""
+        return self.byOrigin.get(sq, ())
+
+    def find(self, start, end, promotion="Q"):
+        """The move from start to end, promoting to promotion if it is a promotion, or None"""
+        found = self.byPair.get(start | end << 6)
+        if not found:
+            return None
+        for move in found:
+            flag = move >> 12 & 15
+            if flag < MOVE_PROMOTION or PROMOTION_PIECES[flag - MOVE_PROMOTION] == promotion:
+                return move
+        return found[0]
+
+
 class Move():
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "moveID", "code",
+                 "isPawnPromotion", "promotionPiece", "isEnpassantMove", "isCastleMove")
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board):
+    def __init__(self, startSq, endSq, board, promotionPiece="Q"):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
         self.endCol = endSq[1]
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-    
+        # Special moves are recognised from the board, so a move built from two clicks
+        # matches the generated one (promotions default to a queen)
+        flag = MOVE_NORMAL
+        if self.pieceMoved[1] == "p":
+            if abs(self.endRow - self.startRow) == 2:
+                flag = MOVE_DOUBLE_PUSH
+            elif self.endRow in (0, 7):
+                flag = MOVE_PROMOTION + PROMOTION_PIECES.index(promotionPiece)
+            elif self.startCol != self.endCol and self.pieceCaptured == "--":
+                flag = MOVE_EN_PASSANT
+                self.pieceCaptured = board[self.startRow][self.endCol]
+        elif self.pieceMoved[1] == "K" and abs(self.endCol - self.startCol) == 2:
+            flag = MOVE_CASTLE
+        self.code = encodeMove(self.startRow * 8 + self.startCol, self.endRow * 8 + self.endCol, flag,
+                               PIECE_CODES[self.pieceMoved], PIECE_CODES[self.pieceCaptured])
+        self._setFlags(flag)
+        self.moveID = self.code & MOVE_ID_MASK
+
+    @classmethod
+    def fromCode(cls, code):
+        """Builds a Move from a packed move int without looking at a board"""
+        move = cls.__new__(cls)
+        start = code & 63
+        end = code >> 6 & 63
+        move.startRow = start >> 3
+        move.startCol = start & 7
+        move.endRow = end >> 3
+        move.endCol = end & 7
+        move.pieceMoved = PIECE_NAMES[code >> 16 & 15]
+        move.pieceCaptured = PIECE_NAMES[code >> 20 & 15]
+        move.code = code
+        move.moveID = code & MOVE_ID_MASK
+        move._setFlags(code >> 12 & 15)
+        return move
+
+    def _setFlags(self, flag):
+        self.isPawnPromotion = flag >= MOVE_PROMOTION
+        self.promotionPiece = PROMOTION_PIECES[flag - MOVE_PROMOTION] if self.isPawnPromotion else None
+        self.isEnpassantMove = flag == MOVE_EN_PASSANT
+        self.isCastleMove = flag == MOVE_CASTLE
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
         return False
+
+    def __hash__(self):
+        return self.moveID
     
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
     
     def getRankFile(self, r, c):
-        return self.colsToFiles[c] + self.rowsToRanks[r]
\ No newline at end of file
+        return self.colsToFiles[c] + self.rowsToRanks[r]
+
+
+# CHESS_PROFILE=<file> profiles the whole process; see ChessProfile
+if os.environ.get("CHESS_PROFILE"):
+    import ChessProfile
+    ChessProfile.enable_from_environment()
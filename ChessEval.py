@@ -0,0 +1,130 @@
+"""
+Material and piece-square evaluation terms for ChessEngine.GameState.
+
+Every piece code has a midgame and an endgame value per square (material plus table
+bonus, positive for white). GameState keeps the sums of both and the game phase up to
+date in makeMove/undoMove, so ChessAI.evaluate is a blend of two numbers instead of a
+scan of the board. computeEval() is the from-scratch version of the same sums.
+"""
+from ChessBitboard import EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+PIECE_VALUES = {PAWN: 100, KNIGHT: 320, BISHOP: 330, ROOK: 500, QUEEN: 900, KING: 0}
+
+# Piece-square tables from white's point of view, indexed by row * 8 + col (a8 first)
+PAWN_TABLE = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+     5,   5,  10,  25,  25,  10,   5,   5,
+     0,   0,   0,  20,  20,   0,   0,   0,
+     5,  -5, -10,   0,   0, -10,  -5,   5,
+     5,  10,  10, -20, -20,  10,  10,   5,
+     0,   0,   0,   0,   0,   0,   0,   0]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK_TABLE = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+     5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+     0,   0,   0,   5,   5,   0,   0,   0]
+QUEEN_TABLE = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+KING_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+PIECE_TABLES = {PAWN: PAWN_TABLE, KNIGHT: KNIGHT_TABLE, BISHOP: BISHOP_TABLE,
+                ROOK: ROOK_TABLE, QUEEN: QUEEN_TABLE, KING: KING_TABLE}
+
+ENDGAME_PIECE_VALUES = {PAWN: 120, KNIGHT: 300, BISHOP: 320, ROOK: 520, QUEEN: 940, KING: 0}
+
+# Endgame tables for pieces that change role once the queens are off; the rest keep theirs
+PAWN_ENDGAME_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0]
+KING_ENDGAME_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+ENDGAME_TABLES = {**PIECE_TABLES, PAWN: PAWN_ENDGAME_TABLE, KING: KING_ENDGAME_TABLE}
+
+# Game phase: MAX_PHASE with all minor and major pieces on the board, 0 with none left
+PHASE_WEIGHTS = {PAWN: 0, KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4, KING: 0}
+MAX_PHASE = 24
+
+
+def _pieceSquareValues(values, tables):
+    """[pieceCode][sq] material plus table bonus; black reads the table mirrored (sq ^ 56)"""
+    result = [[0] * 64 for _ in range(16)]
+    for pieceType, table in tables.items():
+        for sq in range(64):
+            result[pieceType][sq] = values[pieceType] + table[sq]
+            result[8 | pieceType][sq] = -(values[pieceType] + table[sq ^ 56])
+    return result
+
+
+MIDGAME_VALUES = _pieceSquareValues(PIECE_VALUES, PIECE_TABLES)
+ENDGAME_VALUES = _pieceSquareValues(ENDGAME_PIECE_VALUES, ENDGAME_TABLES)
+PIECE_PHASE = [0] * 16 # by piece code
+for _type, _weight in PHASE_WEIGHTS.items():
+    PIECE_PHASE[_type] = PIECE_PHASE[8 | _type] = _weight
+
+
+def computeEval(mailbox):
+    """(midgame sum, endgame sum, phase) of a position from scratch"""
+    midgame = endgame = phase = 0
+    for sq, code in enumerate(mailbox):
+        if code != EMPTY:
+            midgame += MIDGAME_VALUES[code][sq]
+            endgame += ENDGAME_VALUES[code][sq]
+            phase += PIECE_PHASE[code]
+    return midgame, endgame, phase
+
+
+def tapered(midgame, endgame, phase):
+    """Blend of the two sums by game phase, from white's point of view"""
+    phase = min(phase, MAX_PHASE) # promotions can push it past the opening value
+    return (midgame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
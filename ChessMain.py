@@ -6,7 +6,7 @@ import ChessAI # Import the new AI module
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15
+AI_TIME_LIMIT = 1.0 # seconds the computer may think per move
 IMAGES = {}
 MENU_FONT_SIZE = 32
 BUTTON_WIDTH = 200
@@ -14,6 +14,20 @@ BUTTON_HEIGHT = 50
 BUTTON_COLOR = p.Color("darkgray")
 BUTTON_TEXT_COLOR = p.Color("white")
 MENU_TITLE_COLOR = p.Color("black")
+AI_DONE_EVENT = p.USEREVENT # posted by the search thread when the computer's move is ready
+HIGHLIGHT_COLORS = {"selected": "blue", "move": "green", "capture": "red"}
+_fonts = {} # (size, bold) -> SysFont, created once
+
+def get_font(size, bold=True):
+    """Shared SysFont; creating one per frame is slow"""
+    font = _fonts.get((size, bold))
+    if font is None:
+        font = _fonts[(size, bold)] = p.font.SysFont("Helvitca", size, bold, False)
+    return font
+
+def wait_events():
+    """Sleeps until at least one event arrives and returns every pending event"""
+    return [p.event.wait()] + p.event.get()
 
 def load_images():
     """Load images for chess pieces"""
@@ -30,12 +44,12 @@ def load_images():
 def draw_menu(screen):
     """Draws the game mode selection menu and returns button rects."""
     screen.fill(p.Color("lightgray"))
-    font_title = p.font.SysFont("Helvitca", MENU_FONT_SIZE + 10, True, False)
+    font_title = get_font(MENU_FONT_SIZE + 10)
     title_text = font_title.render("Chess Game - Select Mode", True, MENU_TITLE_COLOR)
     title_rect = title_text.get_rect(center=(WIDTH / 2, HEIGHT / 4))
     screen.blit(title_text, title_rect)
 
-    font_button = p.font.SysFont("Helvitca", MENU_FONT_SIZE, True, False)
+    font_button = get_font(MENU_FONT_SIZE)
     
     # Player vs Player button
     pvp_button_rect = p.Rect((WIDTH - BUTTON_WIDTH) / 2, HEIGHT / 2 - BUTTON_HEIGHT - 10, BUTTON_WIDTH, BUTTON_HEIGHT)
@@ -59,18 +73,14 @@ def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     p.display.set_caption("Chess Game")
-    clock = p.time.Clock()
     load_images()
 
     game_mode = None
     menu_active = True
-    pvp_rect, pvc_rect = None, None # Initialize to None
+    pvp_rect, pvc_rect = draw_menu(screen)
 
     while menu_active:
-        if pvp_rect is None or pvc_rect is None: # Draw menu only if rects are not set
-             pvp_rect, pvc_rect = draw_menu(screen)
-
-        for e in p.event.get():
+        for e in wait_events():
             if e.type == p.QUIT:
                 menu_active = False
                 # Ensure game_mode remains None to exit gracefully
@@ -83,27 +93,22 @@ def main():
                 elif pvc_rect.collidepoint(mouse_pos):
                     game_mode = "PvC"
                     menu_active = False
-        
-        # Redraw menu only if it hasn't been drawn in this iteration
-        # This check is slightly redundant due to the outer check, but ensures it's drawn if needed.
-        if menu_active and (pvp_rect is None or pvc_rect is None):
-            pvp_rect, pvc_rect = draw_menu(screen)
-        elif menu_active: # Ensure display updates if menu is still active but buttons drawn
-            p.display.flip()
-
-
-        clock.tick(MAX_FPS)
+            elif e.type == p.VIDEOEXPOSE:
+                pvp_rect, pvc_rect = draw_menu(screen)
 
     if game_mode:
-        run_game(screen, clock, game_mode)
+        run_game(screen, game_mode)
     
     p.quit()
 
 
-def run_game(screen, clock, game_mode):
-    """Main game loop for the selected mode."""
+def run_game(screen, game_mode):
+    """
+    Main game loop for the selected mode. The loop sleeps until an event arrives (input,
+    or the search thread's AI_DONE_EVENT) and redraws only the squares that changed.
+    """
     gs = ChessEngine.GameState()
-    valid_moves = gs.getValidMoves()
+    valid_moves = gs.legalMoveIndex() # ChessEngine.MoveIndex: clicks and highlights are dict lookups
     move_made = False
     
     running = True
@@ -112,6 +117,8 @@ def run_game(screen, clock, game_mode):
     game_over = False
     alert_text = ""
 
+    ai_search = None # ChessAI.BackgroundSearch while the computer is thinking
+
     player_one = True  # True if White is human, False if AI
     player_two = True  # True if Black is human, False if AI
 
@@ -121,13 +128,19 @@ def run_game(screen, clock, game_mode):
     elif game_mode == "PvC":
         player_one = True  # Assume human plays White against AI
         player_two = False # AI plays Black
-    
+
+    renderer = BoardRenderer(screen)
+    renderer.draw(gs, valid_moves, sq_selected, alert_text)
+
     while running:
         human_turn = (gs.whiteToMove and player_one) or (not gs.whiteToMove and player_two)
 
-        for e in p.event.get():
+        for e in wait_events():
             if e.type == p.QUIT:
                 running = False
+
+            elif e.type == p.VIDEOEXPOSE: # the window needs repainting
+                renderer.invalidate()
             
             # Mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
@@ -144,9 +157,10 @@ def run_game(screen, clock, game_mode):
                         player_clicks.append(sq_selected)
                     
                     if len(player_clicks) == 2:
-                        move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.board)
-                        print(f"{game_mode} (Human): {move.getChessNotation()}")
-                        if move in valid_moves:
+                        (start_row, start_col), (end_row, end_col) = player_clicks
+                        move = valid_moves.find(start_row * 8 + start_col, end_row * 8 + end_col)
+                        if move is not None:
+                            print(f"{game_mode} (Human): {ChessEngine.Move.fromCode(move).getChessNotation()}")
                             gs.makeMove(move)
                             move_made = True
                             sq_selected = ()
@@ -161,14 +175,17 @@ def run_game(screen, clock, game_mode):
             
             # Key handler
             elif e.type == p.KEYDOWN:
+                if ai_search is not None and e.key in (p.K_z, p.K_r): # Abandon the AI's search
+                    ai_search.cancel()
+                    ai_search = None
                 if e.key == p.K_z:  # Undo when 'z' is pressed
                     if game_mode == "PvP":
                         gs.undoMove()
                     elif game_mode == "PvC":
 
                         gs.undoMove() # Undo the last move
-                        if not human_turn and len(gs.moveLog) > 0: # If it was AI's turn (meaning AI made the last move)
-                                                                # and there's another move to undo (player's move)
+                        if human_turn and len(gs.moveLog) > 0: # If it was the player's turn (meaning AI made the last move)
+                                                              # and there's another move to undo (player's move)
                             gs.undoMove() # Undo player's move before AI's
 
                     move_made = True 
@@ -176,27 +193,27 @@ def run_game(screen, clock, game_mode):
                     alert_text = ""
                 elif e.key == p.K_r:  # Reset game when 'r' is pressed
                     gs = ChessEngine.GameState()
-                    valid_moves = gs.getValidMoves()
+                    valid_moves = gs.legalMoveIndex()
                     sq_selected = ()
                     player_clicks = []
                     move_made = False
                     game_over = False
                     alert_text = ""
         
-        # AI Move Logic
-        if not game_over and game_mode == "PvC" and not human_turn:
-            ai_move = ChessAI.find_random_move(valid_moves)
-            if ai_move:
-                print(f"{game_mode} (AI): {ai_move.getChessNotation()}")
-                gs.makeMove(ai_move)
+        # AI Move Logic: the search runs in the background and wakes the loop when it is done
+        if ai_search is not None and ai_search.done():
+            ai_code = ai_search.result()
+            ai_search = None
+            if ai_code is not None and ai_code in valid_moves:
+                print(f"{game_mode} (AI): {ChessEngine.Move.fromCode(ai_code).getChessNotation()}")
+                gs.makeMove(ai_code)
                 move_made = True
             else: # AI has no moves (checkmate or stalemate by player)
                 # This condition should ideally be caught by the checkmate/stalemate logic after player's move
                 pass
 
-
         if move_made:
-            valid_moves = gs.getValidMoves()
+            valid_moves = gs.legalMoveIndex() # an undo finds the earlier position's index cached
             move_made = False
             
             is_checkmate = getattr(gs, 'checkmate', False)
@@ -212,41 +229,124 @@ def run_game(screen, clock, game_mode):
                 game_over = True
                 alert_text = "Stalemate"
 
-        draw_game_state(screen, gs, valid_moves, sq_selected, alert_text)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+        # Start the computer's search as soon as it is its turn; nothing else will wake the loop
+        human_turn = (gs.whiteToMove and player_one) or (not gs.whiteToMove and player_two)
+        if not game_over and game_mode == "PvC" and not human_turn and ai_search is None:
+            ai_search = ChessAI.BackgroundSearch(gs, AI_TIME_LIMIT, on_done=post_ai_done)
+
+        renderer.draw(gs, valid_moves, sq_selected, alert_text, thinking=ai_search is not None)
+
+
+def post_ai_done():
+    """Wakes the game loop; called on the search thread"""
+    p.event.post(p.event.Event(AI_DONE_EVENT))
+
 
+class BoardRenderer():
+    """
+    Draws the game incrementally. The empty board and the text are rendered once; draw()
+    works out what every square should show (piece and highlight), repaints only the
+    squares that differ from what is on screen, and pushes just those to the display.
+    Overlaid text repaints the squares under it whenever it changes or one of them does.
+    """
 
-def highlight_squares(screen, gs, valid_moves, sq_selected):
-    """Highlight selected square and possible moves"""
-    if sq_selected:
-        r, c = sq_selected
-        piece = gs.board[r][c]
-        if piece != "--" and piece[0] == ('w' if gs.whiteToMove else 'b'):
-            # Highlight selected square
+    def __init__(self, screen):
+        self.screen = screen
+        self.board_surface = p.Surface(screen.get_size())
+        draw_board(self.board_surface)
+        self.highlights = {}
+        for kind, color in HIGHLIGHT_COLORS.items():
             s = p.Surface((SQ_SIZE, SQ_SIZE))
             s.set_alpha(100)  # Transparency
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            
-            # Highlight possible moves
-            s.fill(p.Color('green'))
-            for move in valid_moves:
-                if move.startRow == r and move.startCol == c:
+            s.fill(p.Color(color))
+            self.highlights[kind] = s
+        self._texts = {} # (text, size, color) -> rendered surface
+        self.invalidate()
+
+    def invalidate(self):
+        """Forgets what is on screen, so the next draw() repaints everything"""
+        self.shown = [None] * (DIMENSION * DIMENSION) # (piece, highlight) drawn on each square
+        self.overlays = None # [(surface, position)] drawn over the squares
+
+    def text(self, text, size, color):
+        key = (text, size, color)
+        surface = self._texts.get(key)
+        if surface is None:
+            surface = self._texts[key] = get_font(size).render(text, 0, p.Color(color))
+        return surface
+
+    def _overlays(self, alert_text, thinking):
+        overlays = []
+        if alert_text:
+            text_object = self.text(alert_text, 32, "Black")
+            x = WIDTH / 2 - text_object.get_width() / 2
+            y = HEIGHT / 2 - text_object.get_height() / 2
+            overlays.append((text_object, (x, y)))
+            overlays.append((self.text(alert_text, 32, "Gray"), (x + 2, y + 2))) # Shadow effect
+        if thinking:
+            text_object = self.text("Thinking...", 20, "Black")
+            overlays.append((text_object, (WIDTH - text_object.get_width() - 6, HEIGHT - text_object.get_height() - 4)))
+        return overlays
+
+    def draw(self, gs, valid_moves, sq_selected, alert_text="", thinking=False):
+        """Brings the screen up to date with the game and returns the rects pushed to the display"""
+        wanted = [None] * (DIMENSION * DIMENSION)
+        board = gs.board
+        for r in range(DIMENSION):
+            row = board[r]
+            for c in range(DIMENSION):
+                wanted[r * DIMENSION + c] = (row[c], None)
+        if sq_selected:
+            r, c = sq_selected
+            piece = board[r][c]
+            if piece != "--" and piece[0] == ('w' if gs.whiteToMove else 'b'):
+                wanted[r * DIMENSION + c] = (piece, "selected")
+                for move in valid_moves.fromSquare(r * 8 + c):
                     # Different color for capture moves
-                    if gs.board[move.endRow][move.endCol] != "--":
-                        s.fill(p.Color('red'))
-                    else:
-                        s.fill(p.Color('green'))
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+                    end = move >> 6 & 63
+                    target = board[end >> 3][end & 7]
+                    wanted[end] = (target, "move" if target == "--" else "capture")
+
+        dirty = {sq for sq in range(DIMENSION * DIMENSION) if wanted[sq] != self.shown[sq]}
+        overlays = self._overlays(alert_text, thinking)
+        covered = set()
+        for surface, position in overlays + (self.overlays or []):
+            covered.update(_squares_under(surface.get_rect(topleft=position)))
+        if self.overlays is None:
+            dirty = set(range(DIMENSION * DIMENSION))
+        elif overlays != self.overlays or dirty & covered:
+            dirty |= covered # repaint everything under the text so it is drawn over clean squares
+        if not dirty:
+            return []
+
+        screen = self.screen
+        rects = []
+        for sq in dirty:
+            piece, highlight = wanted[sq]
+            rect = p.Rect(sq % DIMENSION * SQ_SIZE, sq // DIMENSION * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            screen.blit(self.board_surface, rect, rect)
+            if highlight:
+                screen.blit(self.highlights[highlight], rect)
+            if piece != "--":
+                screen.blit(IMAGES[piece], rect)
+            rects.append(rect)
+        if dirty & covered:
+            for surface, position in overlays:
+                screen.blit(surface, position)
+        self.shown = wanted
+        self.overlays = overlays
+        p.display.update(rects)
+        return rects
+
+
+def _squares_under(rect):
+    """Indices of the squares a screen rect overlaps"""
+    rect = rect.clip(p.Rect(0, 0, WIDTH, HEIGHT))
+    if not rect.width or not rect.height:
+        return []
+    cols = range(rect.left // SQ_SIZE, (rect.right - 1) // SQ_SIZE + 1)
+    return [r * DIMENSION + c for r in range(rect.top // SQ_SIZE, (rect.bottom - 1) // SQ_SIZE + 1) for c in cols]
 
-def draw_game_state(screen, gs, valid_moves, sq_selected, alert_text=""):
-    """Draw the complete game state"""
-    draw_board(screen)
-    highlight_squares(screen, gs, valid_moves, sq_selected)
-    draw_pieces(screen, gs.board)
-    if alert_text:
-        draw_alert_text(screen, alert_text)
 
 def draw_board(screen):
     """Draw chess board squares"""
@@ -256,23 +356,6 @@ def draw_board(screen):
             color = colors[(r + c) % 2]
             p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-def draw_pieces(screen, board):
-    """Draw chess pieces on board"""
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def draw_alert_text(screen, text):
-    """Draws alert text like checkmate or stalemate"""
-    font = p.font.SysFont("Helvitca", 32, True, False)
-    text_object = font.render(text, 0, p.Color('Black'))
-    text_location = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - text_object.get_width() / 2, HEIGHT / 2 - text_object.get_height() / 2)
-    screen.blit(text_object, text_location)
-    text_object = font.render(text, 0, p.Color('Gray')) # Shadow effect
-    screen.blit(text_object, text_location.move(2,2))
-
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Headless engine-vs-engine matches for tuning ChessAI.
+
+Two engine configurations play each opening twice, once with each colour, and games
+run in parallel across a process pool. A game ends on checkmate or stalemate (the
+GameState flags), threefold repetition (GameState.keyLog), the fifty-move rule
+(halfmoveClock) or a ply limit. Games are written to a PGN file as they finish, and a
+line of running statistics follows every game: score, Elo difference with its 95%
+interval, the SPRT log-likelihood ratio and games per hour.
+
+An engine is a comma-separated list of settings:
+
+    name=<label>  depth=<plies>  nodes=<per move>  time=<seconds per move>  tt=<MB>
+    order=0|1  quiescence=0|1  eval=incremental|full  bitbases=0|1  book=0|1
+
+    python ChessMatch.py --engine name=new --engine name=old,quiescence=0 --nodes 5000 --games 200
+    python ChessMatch.py ... --openings book.pgn --sprt 0 10 --pgn match.pgn --workers 8
+"""
+import argparse
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import ChessAI
+import ChessBitbase
+import ChessBook
+import ChessEngine
+import ChessPGN
+from ChessParallel import default_workers
+from ChessTT import TranspositionTable
+
+MATCH_TT_MB = 4
+MAX_PLIES = 400 # games still going after this many plies are drawn
+FIFTY_MOVE_PLIES = 100
+OPENING_PLIES = 8 # plies taken from each game of a PGN opening file
+
+# Short, balanced openings used when no opening file is given
+OPENINGS = [
+    "e4 e5 Nf3 Nc6 Bb5 a6",
+    "e4 c5 Nf3 d6 d4 cxd4",
+    "e4 e6 d4 d5 Nc3 Nf6",
+    "e4 c6 d4 d5 Nc3 dxe4",
+    "d4 d5 c4 e6 Nc3 Nf6",
+    "d4 Nf6 c4 g6 Nc3 Bg7",
+    "d4 Nf6 c4 e6 Nf3 b6",
+    "c4 e5 Nc3 Nf6 g3 d5",
+    "Nf3 d5 g3 Nf6 Bg2 c6",
+    "e4 d5 exd5 Qxd5 Nc3 Qa5",
+]
+
+_SETTINGS = {"name": str, "depth": int, "nodes": int, "time": float, "tt": int, "order": int,
+             "quiescence": int, "eval": str, "bitbases": int, "book": int}
+
+
+def parse_engine(spec):
+    """Engine settings dict from a "key=value,key=value" string"""
+    engine = {}
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        key = key.strip()
+        if not sep or key not in _SETTINGS:
+            raise ValueError(f"bad engine setting {item!r}; expected one of {', '.join(_SETTINGS)}")
+        engine[key] = _SETTINGS[key](value.strip())
+    if engine.get("eval", "incremental") not in ("incremental", "full"):
+        raise ValueError(f"eval must be incremental or full, not {engine['eval']!r}")
+    return engine
+
+
+def make_searcher(engine):
+    """A Searcher configured by an engine settings dict"""
+    searcher = ChessAI.Searcher(time_limit=engine.get("time"), node_limit=engine.get("nodes"),
+                                max_depth=engine.get("depth", ChessAI.MAX_DEPTH),
+                                tt=TranspositionTable(engine.get("tt", MATCH_TT_MB)),
+                                bitbases=ChessBitbase.Bitbases() if engine.get("bitbases", 1) else None,
+                                book=ChessBook.load() if engine.get("book", 0) else None)
+    searcher.order_moves = bool(engine.get("order", 1))
+    searcher.quiescence = bool(engine.get("quiescence", 1))
+    if engine.get("eval") == "full":
+        searcher.evaluate = ChessAI.evaluate_full
+    return searcher
+
+
+def load_openings(path=None, plies=OPENING_PLIES):
+    """
+    Starting FENs: FEN lines of a file, the first plies of each game of a PGN file, or
+    OPENINGS. An opening whose FEN cannot be read is skipped with a warning.
+    """
+    if path is None:
+        games = [ChessPGN.PGNGame({}, line.split(), "*") for line in OPENINGS]
+    elif path.endswith(".pgn"):
+        games = ChessPGN.read_games(path)
+    else:
+        with open(path) as f:
+            lines = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        games = [ChessPGN.PGNGame({"FEN": line}, [], "*") for line in lines]
+    fens = []
+    for number, game in enumerate(games, 1):
+        try:
+            gs = ChessEngine.GameState(fen=game.headers.get("FEN"))
+            for san in game.moves[:plies]:
+                gs.makeMove(ChessPGN.san_to_move(gs, san))
+        except ChessPGN.PGNError:
+            pass # keep the position reached before the move that could not be read
+        except ValueError as e: # a bad FEN
+            print(f"opening {number} skipped: {e}", file=sys.stderr)
+            continue
+        fens.append(gs.getFen())
+    return fens
+
+
+def adjudicate(gs, moves):
+    """(result, termination) if the game in gs is over, else None; moves are its legal moves"""
+    if not moves:
+        if gs.checkmate:
+            return ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if gs.halfmoveClock >= FIFTY_MOVE_PLIES:
+        return "1/2-1/2", "fifty-move rule"
+    # keyLog[-halfmoveClock:] are the positions since the last capture or pawn move
+    if gs.halfmoveClock >= 4 and gs.keyLog[-gs.halfmoveClock:].count(gs.zobristKey) >= 2:
+        return "1/2-1/2", "threefold repetition"
+    return None
+
+
+def play_game(fen, white, black, max_plies=MAX_PLIES):
+    """
+    Plays one game between two engine settings dicts from fen. Returns (moves, result,
+    termination, nodes searched, seconds).
+    """
+    start = time.perf_counter()
+    gs = ChessEngine.GameState(fen=fen)
+    searchers = (make_searcher(black), make_searcher(white)) # indexed by whiteToMove
+    moves = []
+    nodes = 0
+    while True:
+        over = adjudicate(gs, gs.getValidMoveCodes())
+        if over:
+            break
+        if len(moves) >= max_plies:
+            over = "1/2-1/2", "ply limit"
+            break
+        searcher = searchers[gs.whiteToMove]
+        move = searcher.search(gs)
+        nodes += searcher.nodes
+        gs.makeMove(move)
+        moves.append(move)
+    return moves, over[0], over[1], nodes, time.perf_counter() - start
+
+
+def _game_task(index, fen, white, black, max_plies):
+    return (index,) + play_game(fen, white, black, max_plies)
+
+
+def elo(score):
+    """Elo difference for an expected score between 0 and 1"""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def _expected(elo_diff):
+    return 1 / (1 + 10 ** (-elo_diff / 400))
+
+
+class MatchStats():
+    """Wins, draws and losses of the first engine, with Elo and SPRT estimates"""
+
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        self.wins = self.draws = self.losses = 0
+        self.elo0, self.elo1 = elo0, elo1
+        self.lower = math.log(beta / (1 - alpha)) # accept H0 (no better than elo0) below this LLR
+        self.upper = math.log((1 - beta) / alpha) # accept H1 (at least elo1) above it
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def add(self, points):
+        """Records a game by the first engine's points: 1, 0.5 or 0"""
+        if points == 1:
+            self.wins += 1
+        elif points == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def score(self):
+        return (self.wins + self.draws / 2) / self.games if self.games else 0.5
+
+    def variance(self):
+        """Variance of one game's points"""
+        s = self.score()
+        n = self.games or 1
+        return (self.wins * (1 - s) ** 2 + self.draws * (0.5 - s) ** 2 + self.losses * s ** 2) / n
+
+    def elo_interval(self):
+        """(Elo, low, high) with a 95% confidence interval"""
+        s = self.score()
+        margin = 1.96 * math.sqrt(self.variance() / self.games) if self.games else 0.5
+        return elo(s), elo(s - margin), elo(s + margin)
+
+    def llr(self):
+        """Log-likelihood ratio of H1 (elo1) against H0 (elo0), normal approximation"""
+        variance = self.variance()
+        if not self.games or variance <= 0:
+            return 0.0
+        s0, s1 = _expected(self.elo0), _expected(self.elo1)
+        return self.games * (s1 - s0) * (2 * self.score() - s0 - s1) / (2 * variance)
+
+    def sprt(self):
+        """"H1" or "H0" once the SPRT has decided, else None"""
+        llr = self.llr()
+        if llr >= self.upper:
+            return "H1"
+        if llr <= self.lower:
+            return "H0"
+        return None
+
+    def line(self, elapsed):
+        rate = self.games * 3600 / elapsed if elapsed > 0 else 0
+        value, low, high = self.elo_interval()
+        return (f"games {self.games}: +{self.wins} -{self.losses} ={self.draws}  score {self.score() * 100:.1f}%  "
+                f"elo {value:+.0f} [{low:+.0f}, {high:+.0f}]  llr {self.llr():.2f} "
+                f"[{self.lower:.2f}, {self.upper:.2f}]  {rate:,.0f} games/h")
+
+
+def run_match(first, second, openings, games, workers=None, pgn=None, stats=None, stop_on_sprt=False,
+              max_plies=MAX_PLIES, out=sys.stdout):
+    """
+    Plays games between two engine settings dicts, alternating colours over openings,
+    and returns the MatchStats (first engine's point of view) and the elapsed seconds.
+    pgn is an open text file for the games; out gets a statistics line per game (None: quiet).
+    """
+    stats = stats or MatchStats()
+    first_name = first.get("name", "first")
+    second_name = second.get("name", "second")
+    workers = workers or default_workers()
+    start = time.perf_counter()
+
+    def task(index):
+        fen = openings[index // 2 % len(openings)]
+        white, black = (first, second) if index % 2 == 0 else (second, first)
+        return fen, white, black
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        index = 0
+        while index < games or pending:
+            # Keep a couple of games queued per worker rather than submitting the whole match
+            while index < games and len(pending) < workers * 2:
+                fen, white, black = task(index)
+                pending.add(pool.submit(_game_task, index, fen, white, black, max_plies))
+                index += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                game, moves, result, termination, _, _ = future.result()
+                fen, white, black = task(game)
+                points = {"1-0": 1.0, "0-1": 0.0}.get(result, 0.5)
+                stats.add(points if white is first else 1 - points)
+                if pgn is not None:
+                    headers = {"Event": f"{first_name} vs {second_name}", "Round": str(game + 1),
+                               "White": white.get("name", first_name if white is first else second_name),
+                               "Black": black.get("name", first_name if black is first else second_name),
+                               "Result": result, "Termination": termination, "PlyCount": str(len(moves))}
+                    ChessPGN.write_game(pgn, moves, headers, result,
+                                        None if fen == ChessEngine.START_FEN else fen)
+                    pgn.flush()
+                if out is not None:
+                    out.write(stats.line(time.perf_counter() - start) + "\n")
+                    out.flush()
+            if stop_on_sprt and stats.sprt():
+                pending = {future for future in pending if not future.cancel()} # running games finish
+                games = index
+    return stats, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play engine configurations against each other")
+    parser.add_argument("--engine", action="append", required=True, type=parse_engine,
+                        help="engine settings, given twice: the engine under test first")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--nodes", type=int, help="default node limit per move")
+    parser.add_argument("--time", type=float, help="default seconds per move")
+    parser.add_argument("--depth", type=int, help="default depth limit")
+    parser.add_argument("--openings", help="FEN file, or PGN file whose first --opening-plies are used")
+    parser.add_argument("--opening-plies", type=int, default=OPENING_PLIES)
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help="adjudicate a draw after this many plies")
+    parser.add_argument("--pgn", help="write the games to this PGN file")
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"),
+                        help="stop once the SPRT accepts either hypothesis")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    args = parser.parse_args(argv)
+    if len(args.engine) != 2:
+        parser.error("give exactly two --engine settings")
+    first, second = args.engine
+    first.setdefault("name", "first")
+    second.setdefault("name", "second")
+    for engine in args.engine:
+        for key in ("nodes", "time", "depth"):
+            if getattr(args, key) is not None:
+                engine.setdefault(key, getattr(args, key))
+        if not any(key in engine for key in ("nodes", "time", "depth")):
+            parser.error(f"{engine['name']}: give a per-move limit (nodes, time or depth)")
+    openings = load_openings(args.openings, args.opening_plies)
+    if not openings:
+        parser.error(f"no usable openings in {args.openings}")
+    elo0, elo1 = args.sprt or (0.0, 5.0)
+    stats = MatchStats(elo0, elo1, args.alpha, args.beta)
+    pgn = open(args.pgn, "w") if args.pgn else None
+    try:
+        stats, elapsed = run_match(first, second, openings, args.games, args.workers, pgn, stats,
+                                   stop_on_sprt=args.sprt is not None, max_plies=args.max_plies)
+    finally:
+        if pgn:
+            pgn.close()
+    print(f"{first['name']} vs {second['name']}: {stats.line(elapsed)}")
+    if args.sprt:
+        decision = stats.sprt()
+        print({"H1": f"SPRT: H1 accepted, {first['name']} is at least {elo1:+g} Elo",
+               "H0": f"SPRT: H0 accepted, {first['name']} is no better than {elo0:+g} Elo",
+               None: "SPRT: no decision yet"}[decision])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Move ordering for ChessAI's alpha-beta search.
+
+MoveOrderer.ordered() hands out a node's packed moves in stages: the hash move, then
+captures and promotions by MVV-LVA (most valuable victim, least valuable attacker),
+then the killer moves of the ply, then the remaining quiet moves by history score.
+Each stage is scored only when the search gets to it, and the best moves of a stage
+are picked one at a time, so a node that cuts off early never sorts the rest.
+
+Killers and history live in preallocated arrays that persist across searches.
+"""
+from array import array
+
+from ChessBitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, MOVE_PROMOTION
+
+MAX_PLY = 128
+KILLER_SLOTS = 2
+HISTORY_LIMIT = 1 << 20 # history scores are halved once one reaches this
+SELECT_FIRST = 3 # moves picked one at a time before the rest of a stage is sorted
+
+_PROMOTION_TYPES = (KNIGHT, BISHOP, ROOK, QUEEN)
+
+# MVV_LVA[code >> 16 & 0xFF]: captured piece code in the high nibble, moving piece in the low.
+# Victims count for more than attackers, so PxQ > QxQ > PxR; quiet moves score 0.
+MVV_LVA = [0] * 256
+for _victim in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN):
+    for _attacker in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        for _color in (0, 8):
+            MVV_LVA[((_color ^ 8) | _victim) << 4 | _color | _attacker] = _victim * 8 + (KING - _attacker) + 1
+
+
+def capture_score(move):
+    """MVV-LVA score of a capture or promotion; 0 for quiet moves"""
+    score = MVV_LVA[move >> 16 & 0xFF]
+    flag = move >> 12 & 15
+    if flag >= MOVE_PROMOTION:
+        score += _PROMOTION_TYPES[flag - MOVE_PROMOTION] * 8 # as if capturing the new piece
+    return score
+
+
+class MoveOrderer():
+    def __init__(self):
+        # killers[ply * KILLER_SLOTS + slot]: quiet moves that caused a cutoff at that ply
+        self.killers = array("L", [0]) * (MAX_PLY * KILLER_SLOTS)
+        # history[color << 12 | from << 6 | to]: how often the quiet move caused a cutoff, by depth
+        self.history = array("l", [0]) * (2 * 64 * 64)
+
+    def new_search(self):
+        """Forgets the killers, which belong to one search tree, and ages the history"""
+        self.killers = array("L", [0]) * len(self.killers)
+        history = self.history
+        for i in range(len(history)):
+            history[i] >>= 1
+
+    def ordered(self, moves, hash_move=None, ply=0):
+        """Yields a node's packed moves best first; the hash move is swapped to the front of moves"""
+        n = len(moves)
+        first = 0
+        if hash_move:
+            for i in range(n):
+                if moves[i] == hash_move:
+                    moves[i] = moves[0]
+                    moves[0] = hash_move
+                    first = 1
+                    yield hash_move
+                    break
+
+        # Captures and promotions, best MVV-LVA first
+        captures = []
+        quiets = []
+        for i in range(first, n):
+            move = moves[i]
+            if move >> 20 & 15 or move >> 12 & 15 >= MOVE_PROMOTION:
+                captures.append(move)
+            else:
+                quiets.append(move)
+        if captures:
+            yield from _pick(captures, [capture_score(m) for m in captures])
+
+        # Killers, if they are legal quiet moves here
+        if ply < MAX_PLY:
+            base = ply * KILLER_SLOTS
+            for slot in range(KILLER_SLOTS):
+                killer = self.killers[base + slot]
+                if killer and killer in quiets:
+                    quiets.remove(killer)
+                    yield killer
+
+        if quiets:
+            history = self.history
+            yield from _pick(quiets, [history[(m >> 19 & 1) << 12 | (m & 0xFFF)] for m in quiets])
+
+    def record_cutoff(self, move, depth, ply):
+        """Credits a quiet move that failed high: killer slot at ply and history by depth"""
+        if move >> 20 & 15 or move >> 12 & 15 >= MOVE_PROMOTION or ply >= MAX_PLY:
+            return
+        base = ply * KILLER_SLOTS
+        killers = self.killers
+        if killers[base] != move:
+            for slot in range(KILLER_SLOTS - 1, 0, -1):
+                killers[base + slot] = killers[base + slot - 1]
+            killers[base] = move
+        i = (move >> 19 & 1) << 12 | (move & 0xFFF)
+        history = self.history
+        history[i] += depth * depth
+        if history[i] >= HISTORY_LIMIT:
+            for j in range(len(history)):
+                history[j] >>= 1
+
+
+def _pick(moves, scores):
+    """
+    Yields moves in descending score order. The first few are selected one at a time;
+    a node that has not cut off by then usually searches everything, so the rest are
+    sorted in one go.
+    """
+    n = len(moves)
+    for i in range(min(n, SELECT_FIRST)):
+        best = max(range(i, n), key=scores.__getitem__)
+        if best != i:
+            moves[i], moves[best] = moves[best], moves[i]
+            scores[i], scores[best] = scores[best], scores[i]
+        yield moves[i]
+    if n > SELECT_FIRST:
+        rest = sorted(zip(scores[SELECT_FIRST:], moves[SELECT_FIRST:]), reverse=True)
+        for _, move in rest:
+            yield move
@@ -0,0 +1,285 @@
+"""
+Streaming PGN reading and writing.
+
+read_games() walks a PGN file one game at a time, so memory stays flat however large
+the file is. SAN moves are resolved against GameState.getValidMoveCodes() when a game
+is replayed. write_game() and write_positions() stream games and FEN lines back out.
+A game with an unreadable or illegal move, or a bad FEN tag, is skipped whole by
+read_positions() and the command line, which report how many were skipped.
+
+    python ChessPGN.py games.pgn                 # count games, positions and skipped games, report games/s
+    python ChessPGN.py games.pgn --fens out.fen  # also write every position as a FEN line
+"""
+import argparse
+import re
+import sys
+import time
+
+import ChessEngine
+from ChessBitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+PIECE_LETTERS = {"N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING}
+LETTERS_BY_TYPE = {v: k for k, v in PIECE_LETTERS.items()}
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+_MOVE_NUMBER = re.compile(r"^\d+\.+")
+_EN_PASSANT = "e.p." # optional suffix of en passant captures, e.g. exd6 e.p.
+_SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class PGNError(ValueError):
+    pass
+
+
+class PGNGame():
+    """Tag pairs and SAN moves of one game; positions are produced on demand by replay()"""
+    __slots__ = ("headers", "moves", "result")
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    def replay(self):
+        """
+        Yields (gs, move) for every move of the game: gs is the position before the move
+        and move its packed int. The same GameState is reused, so copy what you keep.
+        """
+        gs = ChessEngine.GameState(fen=self.headers.get("FEN"))
+        for san in self.moves:
+            move = san_to_move(gs, san)
+            yield gs, move
+            gs.makeMove(move)
+
+    def fens(self):
+        """FEN of every position in the game, starting position included"""
+        gs = None
+        for gs, _ in self.replay():
+            yield gs.getFen()
+        if gs is None:
+            gs = ChessEngine.GameState(fen=self.headers.get("FEN"))
+        yield gs.getFen() # replay() has made the final move by the time it stops
+
+
+def _strip_variations(text):
+    depth = 0
+    out = []
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(0, depth - 1)
+        elif depth == 0:
+            out.append(ch)
+    return "".join(out)
+
+
+def _parse_movetext(text):
+    text = _strip_variations(_COMMENT.sub(" ", text))
+    moves = []
+    result = "*"
+    for token in text.split():
+        if token in RESULTS:
+            result = token
+            continue
+        token = _MOVE_NUMBER.sub("", token)
+        if not token or token.startswith("$") or token == _EN_PASSANT:
+            continue
+        moves.append(token)
+    return moves, result
+
+
+def read_games(source):
+    """
+    Yields a PGNGame per game in source, a path or an open text file. Only the lines
+    of the current game are held in memory.
+    """
+    if isinstance(source, str):
+        with open(source, encoding="utf-8", errors="replace") as f:
+            yield from read_games(f)
+        return
+    headers = {}
+    movetext = []
+    comment_depth = 0
+    for line in source:
+        stripped = line.strip()
+        if comment_depth == 0 and stripped.startswith("["):
+            if movetext: # a tag after movetext starts the next game even without a result token
+                yield PGNGame(headers, *_parse_movetext("\n".join(movetext)))
+                headers, movetext = {}, []
+            match = _TAG.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2)
+            continue
+        if not stripped:
+            continue
+        movetext.append(stripped)
+        comment_depth = max(0, comment_depth + stripped.count("{") - stripped.count("}"))
+        if comment_depth == 0 and stripped.split()[-1] in RESULTS:
+            yield PGNGame(headers, *_parse_movetext("\n".join(movetext)))
+            headers, movetext = {}, []
+    if movetext or headers:
+        yield PGNGame(headers, *_parse_movetext("\n".join(movetext)))
+
+
+def read_positions(source, errors=None):
+    """
+    Yields the FEN of every position of every game in source. A game that cannot be
+    replayed is skipped whole; pass a list as errors to collect (game number, message)
+    for each game skipped.
+    """
+    for number, game in enumerate(read_games(source), 1):
+        try:
+            fens = list(game.fens()) # the whole game first, so a bad one yields nothing
+        except ValueError as e: # PGNError, or a bad FEN tag
+            if errors is not None:
+                errors.append((number, str(e)))
+            continue
+        yield from fens
+
+
+def san_to_move(gs, san, moves=None):
+    """Packed move int for a SAN string in gs, checked against the legal moves"""
+    moves = gs.getValidMoveCodes() if moves is None else moves
+    token = san.removesuffix(_EN_PASSANT).rstrip("+#!?")
+    if token in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        queen_side = len(token) == 5
+        for move in moves:
+            if move >> 12 & 15 == ChessEngine.MOVE_CASTLE and ((move >> 6 & 63) < (move & 63)) == queen_side:
+                return move
+        raise PGNError(f"Illegal castling {san!r} in {gs.getFen()}")
+    match = _SAN.match(token)
+    if not match:
+        raise PGNError(f"Unreadable move {san!r}")
+    letter, from_file, from_rank, to, promotion = match.groups()
+    piece_type = PIECE_LETTERS[letter] if letter else PAWN
+    end = ChessEngine.Move.ranksToRows[to[1]] * 8 + ChessEngine.Move.filesToCols[to[0]]
+    promotion_flag = ChessEngine.MOVE_PROMOTION + ChessEngine.PROMOTION_PIECES.index(promotion) if promotion else None
+    found = None
+    for move in moves:
+        if move >> 6 & 63 != end or move >> 16 & 7 != piece_type:
+            continue
+        start = move & 63
+        if from_file and start & 7 != ChessEngine.Move.filesToCols[from_file]:
+            continue
+        if from_rank and start >> 3 != ChessEngine.Move.ranksToRows[from_rank]:
+            continue
+        flag = move >> 12 & 15
+        if promotion_flag is not None and flag != promotion_flag:
+            continue
+        if promotion_flag is None and flag >= ChessEngine.MOVE_PROMOTION and flag != ChessEngine.MOVE_PROMOTION + 3:
+            continue # a promotion without a piece letter is read as a queen
+        if found is not None:
+            raise PGNError(f"Ambiguous move {san!r} in {gs.getFen()}")
+        found = move
+    if found is None:
+        raise PGNError(f"Illegal move {san!r} in {gs.getFen()}")
+    return found
+
+
+def move_to_san(gs, move, moves=None):
+    """SAN string for a legal packed move in gs, including check and mate marks"""
+    moves = gs.getValidMoveCodes() if moves is None else moves
+    start = move & 63
+    end = move >> 6 & 63
+    flag = move >> 12 & 15
+    piece_type = move >> 16 & 7
+    notation = ChessEngine.Move.fromCode(move)
+    if flag == ChessEngine.MOVE_CASTLE:
+        san = "O-O" if end > start else "O-O-O"
+    else:
+        capture = move >> 20 & 15 != 0
+        destination = notation.getRankFile(end >> 3, end & 7)
+        if piece_type == PAWN:
+            san = (notation.colsToFiles[start & 7] + "x" if capture else "") + destination
+            if flag >= ChessEngine.MOVE_PROMOTION:
+                san += "=" + notation.promotionPiece
+        else:
+            rivals = [m & 63 for m in moves
+                      if m >> 6 & 63 == end and m >> 16 & 7 == piece_type and m & 63 != start]
+            disambiguation = ""
+            if rivals:
+                if all(r & 7 != start & 7 for r in rivals):
+                    disambiguation = notation.colsToFiles[start & 7]
+                elif all(r >> 3 != start >> 3 for r in rivals):
+                    disambiguation = notation.rowsToRanks[start >> 3]
+                else:
+                    disambiguation = notation.getRankFile(start >> 3, start & 7)
+            san = LETTERS_BY_TYPE[piece_type] + disambiguation + ("x" if capture else "") + destination
+    gs.makeMove(move)
+    replies = gs.getValidMoveCodes()
+    if gs.inCheck:
+        san += "#" if not replies else "+"
+    gs.undoMove()
+    return san
+
+
+def write_game(out, moves, headers=None, result="*", start_fen=None):
+    """Writes one game given as packed moves from start_fen (default: the starting position)"""
+    headers = dict(headers or {})
+    headers.setdefault("Result", result)
+    if start_fen is not None:
+        headers.setdefault("SetUp", "1")
+        headers.setdefault("FEN", start_fen)
+    for tag, value in headers.items():
+        out.write(f'[{tag} "{value}"]\n')
+    out.write("\n")
+    gs = ChessEngine.GameState(fen=start_fen)
+    tokens = []
+    for i, move in enumerate(moves):
+        if gs.whiteToMove or i == 0:
+            tokens.append(f"{gs.fullmoveNumber}." if gs.whiteToMove else f"{gs.fullmoveNumber}...")
+        tokens.append(move_to_san(gs, move))
+        gs.makeMove(move)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if len(line) + len(token) + 1 > 79:
+            out.write(line + "\n")
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    out.write(line + "\n\n")
+
+
+def write_positions(out, fens):
+    """Writes FEN strings one per line as they arrive; returns how many were written"""
+    count = 0
+    for fen in fens:
+        out.write(fen)
+        out.write("\n")
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a PGN file and report throughput")
+    parser.add_argument("pgn")
+    parser.add_argument("--fens", help="write every position to this file as FEN lines")
+    args = parser.parse_args(argv)
+    out = open(args.fens, "w") if args.fens else None
+    games = positions = skipped = 0
+    start = time.perf_counter()
+    try:
+        for number, game in enumerate(read_games(args.pgn), 1):
+            try:
+                fens = list(game.fens())
+            except ValueError as e: # one bad game must not end a long ingest
+                print(f"game {number} skipped: {e}", file=sys.stderr)
+                skipped += 1
+                continue
+            positions += write_positions(out, fens) if out else len(fens)
+            games += 1
+    finally:
+        if out:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {positions} positions in {elapsed:.2f}s, "
+          f"{games / elapsed if elapsed else 0:,.1f} games/s, {skipped} games skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
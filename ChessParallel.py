@@ -0,0 +1,83 @@
+"""
+Root-split perft and search across a process pool.
+
+The root moves of getValidMoveCodes() are handed out to worker processes. Each task
+carries only the position's FEN and one packed root move, and the worker builds its
+own GameState from them. Results come back in root move order, so the totals and
+the chosen move do not depend on which worker finished first.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessAI
+import ChessEngine
+import ChessPerft
+from ChessTT import TranspositionTable
+
+WORKER_TT_MB = 4
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _perft_task(fen, move, depth):
+    gs = ChessEngine.GameState(fen=fen)
+    gs.makeMove(move)
+    return ChessPerft.perft(gs, depth - 1)
+
+
+def _search_task(fen, move, depth, time_limit, node_limit):
+    """Searches one root move; returns the scores (ours) of every completed iteration and the node count"""
+    gs = ChessEngine.GameState(fen=fen)
+    gs.makeMove(move)
+    if not gs.getValidMoveCodes():
+        score = ChessAI.CHECKMATE - 1 if gs.inCheck else ChessAI.STALEMATE
+        return [score] * depth, 1
+    scores = []
+    searcher = ChessAI.Searcher(time_limit=time_limit, node_limit=node_limit, max_depth=depth - 1,
+                                info=lambda s: scores.append(-s.score))
+    # The root move itself is the first ply, so a depth-d iteration here is depth d + 1 overall
+    first = -searcher.quiesce(gs)
+    nodes = searcher.nodes + 1
+    if depth == 1:
+        return [first], nodes
+    searcher.tt = TranspositionTable(WORKER_TT_MB)
+    searcher.search(gs)
+    if not searcher.stopped: # a forced mate ends the search early; its score holds at every depth
+        scores += scores[-1:] * (depth - 1 - len(scores))
+    return [first] + scores, nodes + searcher.nodes
+
+
+def parallel_perft(gs, depth, workers=None):
+    """Returns (total leaf nodes, [(move notation, nodes), ...] in root move order)"""
+    moves = gs.getValidMoveCodes()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1, [(ChessEngine.Move.fromCode(m).getChessNotation(), 1) for m in moves]
+    fen = gs.getFen()
+    with ProcessPoolExecutor(max_workers=workers or default_workers()) as pool:
+        counts = list(pool.map(_perft_task, [fen] * len(moves), moves, [depth] * len(moves)))
+    divided = [(ChessEngine.Move.fromCode(m).getChessNotation(), n) for m, n in zip(moves, counts)]
+    return sum(counts), divided
+
+
+def parallel_search(gs, depth, time_limit=None, node_limit=None, workers=None):
+    """
+    Searches every root move of gs in its own task and returns (best move code, score,
+    depth, nodes). With a budget, each root move gets the same budget and the move is
+    chosen at the deepest depth every root move completed; ties go to the earlier move.
+    """
+    moves = gs.getValidMoveCodes()
+    if not moves:
+        return None, 0, 0, 0
+    fen = gs.getFen()
+    n = len(moves)
+    with ProcessPoolExecutor(max_workers=workers or default_workers()) as pool:
+        results = list(pool.map(_search_task, [fen] * n, moves, [depth] * n,
+                                [time_limit] * n, [node_limit] * n))
+    reached = min(len(scores) for scores, _ in results)
+    best_move, best_score = None, None
+    for move, (scores, _) in zip(moves, results):
+        if best_score is None or scores[reached - 1] > best_score:
+            best_move, best_score = move, scores[reached - 1]
+    return best_move, best_score, reached, sum(nodes for _, nodes in results)
@@ -0,0 +1,122 @@
+"""
+Perft: counts the leaf nodes of the legal move tree to a fixed depth with
+GameState.makeMove/undoMove. Counts for the reference positions are known exactly,
+so any difference points at a move generation bug.
+
+    python ChessPerft.py                      # run the reference suite
+    python ChessPerft.py --depth 4 --divide   # per-root-move counts from the start position
+    python ChessPerft.py --fen "<FEN>" --depth 3
+    python ChessPerft.py --depth 5 --workers 8  # split the root moves across processes
+"""
+import argparse
+import sys
+import time
+
+import ChessEngine
+
+# (name, FEN, expected leaf counts for depth 1, 2, 3, ...)
+REFERENCE_POSITIONS = [
+    ("start", ChessEngine.START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(gs, depth):
+    """Number of leaf nodes depth plies below gs"""
+    moves = gs.getValidMoveCodes()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """Leaf counts below each root move, as a list of (move notation, nodes)"""
+    results = []
+    for move in gs.getValidMoveCodes():
+        gs.makeMove(move)
+        results.append((ChessEngine.Move.fromCode(move).getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+
+def timed_perft(fen, depth):
+    """Returns (nodes, seconds) for perft(depth) from fen"""
+    gs = ChessEngine.GameState(fen=fen)
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    return nodes, time.perf_counter() - start
+
+
+def run_suite(max_depth=3, max_nodes=None, out=sys.stdout):
+    """
+    Runs every reference position up to max_depth (skipping depths with more than
+    max_nodes expected leaves) and returns True if all counts match.
+    """
+    ok = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in REFERENCE_POSITIONS:
+        for depth, want in enumerate(expected[:max_depth], start=1):
+            if max_nodes is not None and want > max_nodes:
+                break
+            nodes, elapsed = timed_perft(fen, depth)
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok" if nodes == want else "FAIL"
+            ok = ok and nodes == want
+            print(f"{name:<10} depth {depth}  {nodes:>10,} / {want:>10,}  {status:<4}  "
+                  f"{nodes / elapsed if elapsed else 0:>10,.0f} nodes/s", file=out)
+    if total_time:
+        print(f"total {total_nodes:,} nodes in {total_time:.2f}s, {total_nodes / total_time:,.0f} nodes/s", file=out)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft move generation test and benchmark")
+    parser.add_argument("--fen", help="position to count from (default: reference suite)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print counts per root move")
+    parser.add_argument("--max-nodes", type=int, help="suite: skip depths expecting more leaves than this")
+    parser.add_argument("--workers", type=int, help="count in parallel with this many processes")
+    args = parser.parse_args(argv)
+
+    if args.fen is None and not args.divide and not args.workers:
+        return 0 if run_suite(args.depth, args.max_nodes) else 1
+
+    gs = ChessEngine.GameState(fen=args.fen or ChessEngine.START_FEN)
+    start = time.perf_counter()
+    if args.workers:
+        import ChessParallel
+        total, results = ChessParallel.parallel_perft(gs, args.depth, args.workers)
+        if args.divide:
+            for notation, nodes in results:
+                print(f"{notation}: {nodes}")
+    elif args.divide:
+        results = divide(gs, args.depth)
+        for notation, nodes in results:
+            print(f"{notation}: {nodes}")
+        total = sum(nodes for _, nodes in results)
+    else:
+        total = perft(gs, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f"nodes {total}  time {elapsed:.3f}s  {total / elapsed if elapsed else 0:,.0f} nodes/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
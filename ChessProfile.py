@@ -0,0 +1,408 @@
+"""
+Opt-in instrumentation of move generation and search: call counts and cumulative time
+of the GameState generators, Move objects allocated, attack checks per king move, and
+per search depth the nodes, transposition table hits, beta cutoffs and branching factor.
+
+Nothing is instrumented until enable() is called: it swaps timed wrappers in for the
+methods and functions it watches, and disable() puts the originals back, so a process
+that never enables profiling runs exactly the code it would without this module. Times
+are inclusive (a generator's time contains the generators it calls). Recursive search
+functions are not timed; search time is measured per iteration instead. An attack check
+is a call to isAttacked or attackMap; an attack lookup is a call to attackedSquares or
+squareUnderAttack, which answer from the position's cached attack maps when they can.
+
+Profiling can also be switched on for a whole process from the environment. The report
+is written when the process exits, as JSON or as a Chrome trace (chrome://tracing,
+Perfetto) with one event per instrumented call, up to trace_limit events:
+
+    CHESS_PROFILE=profile.json python ChessMain.py
+    CHESS_PROFILE=trace.json CHESS_PROFILE_FORMAT=chrome python ChessUCI.py
+
+Worker processes (ChessServer, ChessMatch, ChessParallel) are not profiled.
+
+    python ChessProfile.py                                  # profile a short self-play game
+    python ChessProfile.py --plies 20 --depth 4 --json profile.json --chrome trace.json
+"""
+import argparse
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import ChessEngine
+from ChessTT import TranspositionTable
+
+ENV_PATH = "CHESS_PROFILE"
+ENV_FORMAT = "CHESS_PROFILE_FORMAT"
+FORMATS = ("json", "chrome")
+TRACE_LIMIT = 500_000 # events kept for a Chrome trace; calls after that are only counted
+
+# GameState methods timed, reported as GameState.<name>
+GAME_STATE_METHODS = ("makeMove", "undoMove", "getValidMoves", "getValidMoveCodes", "getValidMoveCodesFrom",
+                      "hasValidMoves", "legalMoveIndex", "checkForPinsAndChecks", "getPieceMoves",
+                      "getEnpassantMove", "getKingMoves", "getCastleMoves", "squareUnderAttack", "attackedSquares")
+ATTACK_FUNCTIONS = ("isAttacked", "attackMap") # ChessEngine's attack checks, looked up as module globals
+ATTACK_LOOKUPS = ("attackedSquares", "squareUnderAttack")
+
+_profile = None # the enabled Profile
+_originals = [] # (owner, attribute name, original value) to restore on disable
+_search_instrumented = False
+_lock = threading.Lock()
+
+
+class ProfileError(ValueError):
+    pass
+
+
+class Profile():
+    """
+    Counters of one enable()/disable() span. calls maps a name to [calls, nanoseconds];
+    depths maps a search depth to [iterations, nodes, tt hits, cutoffs, nanoseconds,
+    branching factor sum, branching factor count].
+    """
+
+    def __init__(self, trace=False, trace_limit=TRACE_LIMIT):
+        self.calls = {}
+        self.moves_allocated = 0
+        self.attack_checks = 0
+        self.attack_lookups = 0
+        self.king_calls = 0
+        self.king_moves = 0
+        self.king_attack_checks = 0
+        self.king_attack_lookups = 0
+        self.depths = {}
+        self.trace = trace
+        self.trace_limit = trace_limit
+        self.events = [] # (name, start ns, duration ns, thread id, args or None)
+        self.dropped = 0
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self._last_nodes = {} # id(searcher) -> nodes of its previous iteration
+
+    def _stats(self, name):
+        return self.calls.setdefault(name, [0, 0])
+
+    def _event(self, name, start, duration, args=None):
+        if len(self.events) < self.trace_limit:
+            self.events.append((name, start, duration, threading.get_ident(), args))
+        else:
+            self.dropped += 1
+
+    def elapsed(self):
+        return ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e9
+
+    def to_dict(self):
+        """The counters as plain data, the JSON export"""
+        functions = {}
+        for name, (calls, ns) in sorted(self.calls.items(), key=lambda item: -item[1][1]):
+            functions[name] = {"calls": calls, "total_ms": round(ns / 1e6, 3),
+                               "mean_us": round(ns / calls / 1e3, 3) if calls else 0.0}
+        depths = []
+        for depth, (iterations, nodes, hits, cutoffs, ns, bf_sum, bf_count) in sorted(self.depths.items()):
+            depths.append({"depth": depth, "iterations": iterations, "nodes": nodes, "tt_hits": hits,
+                           "cutoffs": cutoffs, "total_ms": round(ns / 1e6, 3),
+                           "branching_factor": round(bf_sum / bf_count, 2) if bf_count else None})
+        return {
+            "elapsed_s": round(self.elapsed(), 6),
+            "functions": functions,
+            "moves_allocated": self.moves_allocated,
+            "attack_checks": self.attack_checks,
+            "attack_lookups": self.attack_lookups,
+            "king_moves": {
+                "calls": self.king_calls,
+                "moves": self.king_moves,
+                "attack_checks": self.king_attack_checks,
+                "attack_lookups": self.king_attack_lookups,
+                "attack_checks_per_move": round(self.king_attack_checks / self.king_moves, 3)
+                if self.king_moves else None,
+                "attack_lookups_per_move": round(self.king_attack_lookups / self.king_moves, 3)
+                if self.king_moves else None,
+            },
+            "search": depths,
+            "trace_events_dropped": self.dropped,
+        }
+
+    def to_chrome_trace(self):
+        """The Chrome trace event format: complete events per call, counters per search iteration"""
+        pid = os.getpid()
+        events = []
+        for name, start, duration, tid, args in self.events:
+            event = {"name": name, "cat": "search" if args else "engine", "ph": "X", "pid": pid, "tid": tid,
+                     "ts": (start - self.start_ns) / 1e3, "dur": duration / 1e3}
+            if args:
+                event["args"] = args
+                events.append({"name": "search", "ph": "C", "pid": pid, "tid": tid, "ts": event["ts"],
+                               "args": {"nodes": args["nodes"], "tt_hits": args["tt_hits"],
+                                        "cutoffs": args["cutoffs"]}})
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.to_dict()}
+
+    def write(self, path, fmt="json"):
+        if fmt not in FORMATS:
+            raise ProfileError(f"unknown profile format {fmt!r}, expected one of {', '.join(FORMATS)}")
+        data = self.to_chrome_trace() if fmt == "chrome" else self.to_dict()
+        with open(path, "w") as f:
+            json.dump(data, f, indent=None if fmt == "chrome" else 1)
+
+    def report(self, out=sys.stdout):
+        """Human-readable summary"""
+        data = self.to_dict()
+        out.write(f"{data['elapsed_s']:.2f}s profiled\n")
+        out.write(f"{'function':<32} {'calls':>10} {'total ms':>10} {'mean us':>9}\n")
+        for name, stats in data["functions"].items():
+            out.write(f"{name:<32} {stats['calls']:>10,} {stats['total_ms']:>10,.1f} {stats['mean_us']:>9.2f}\n")
+        king = data["king_moves"]
+        out.write(f"Move objects allocated: {data['moves_allocated']:,}\n")
+        out.write(f"attack checks: {data['attack_checks']:,}, lookups: {data['attack_lookups']:,}\n")
+        out.write(f"king moves: {king['moves']:,} over {king['calls']:,} calls, with {king['attack_checks']:,} "
+                  f"attack checks and {king['attack_lookups']:,} lookups\n")
+        if data["search"]:
+            out.write(f"{'depth':>5} {'iters':>6} {'nodes':>11} {'tt hits':>10} {'cutoffs':>10} "
+                      f"{'ms':>9} {'EBF':>6}\n")
+            for row in data["search"]:
+                bf = f"{row['branching_factor']:.2f}" if row["branching_factor"] is not None else "-"
+                out.write(f"{row['depth']:>5} {row['iterations']:>6} {row['nodes']:>11,} {row['tt_hits']:>10,} "
+                          f"{row['cutoffs']:>10,} {row['total_ms']:>9,.1f} {bf:>6}\n")
+
+
+def _timed(profile, name, fn):
+    stats = profile._stats(name)
+    clock = time.perf_counter_ns
+    trace = profile.trace
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            duration = clock() - start
+            stats[0] += 1
+            stats[1] += duration
+            if trace:
+                profile._event(name, start, duration)
+    return wrapper
+
+
+def _attack_check(profile, name, fn):
+    timed = _timed(profile, name, fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        profile.attack_checks += 1
+        return timed(*args)
+    return wrapper
+
+
+def _attack_lookup(profile, name, fn):
+    timed = _timed(profile, f"GameState.{name}", fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        profile.attack_lookups += 1
+        return timed(*args)
+    return wrapper
+
+
+def _king_moves(profile, fn):
+    timed = _timed(profile, "GameState.getKingMoves", fn)
+
+    @functools.wraps(fn)
+    def wrapper(self, r, c, moves, quiet=True):
+        before, checks, lookups = len(moves), profile.attack_checks, profile.attack_lookups
+        timed(self, r, c, moves, quiet)
+        profile.king_calls += 1
+        profile.king_moves += len(moves) - before
+        profile.king_attack_checks += profile.attack_checks - checks
+        profile.king_attack_lookups += profile.attack_lookups - lookups
+    return wrapper
+
+
+def _move_init(profile, fn):
+    timed = _timed(profile, "Move.__init__", fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile.moves_allocated += 1
+        timed(*args, **kwargs)
+    return wrapper
+
+
+def _move_from_code(profile, fn):
+    timed = _timed(profile, "Move.fromCode", fn)
+
+    @functools.wraps(fn)
+    def wrapper(cls, code):
+        profile.moves_allocated += 1
+        return timed(cls, code)
+    return classmethod(wrapper)
+
+
+def _search_root(profile, fn):
+    """Per-iteration counters: the node, hit and cutoff counts the iteration added"""
+    clock = time.perf_counter_ns
+
+    @functools.wraps(fn)
+    def wrapper(self, gs, moves, depth):
+        tt = self.tt
+        nodes, hits, cutoffs = self.nodes, tt.hits if tt is not None else 0, self.cutoffs
+        start = clock()
+        result = fn(self, gs, moves, depth)
+        duration = clock() - start
+        nodes = self.nodes - nodes
+        hits = (tt.hits if tt is not None else 0) - hits
+        cutoffs = self.cutoffs - cutoffs
+        with _lock:
+            row = profile.depths.setdefault(depth, [0, 0, 0, 0, 0, 0.0, 0])
+            row[0] += 1
+            row[1] += nodes
+            row[2] += hits
+            row[3] += cutoffs
+            row[4] += duration
+            # Effective branching factor: nodes of this iteration over the previous one's
+            previous = profile._last_nodes.get(id(self)) if depth > 1 else None
+            if previous and not self.stopped:
+                row[5] += nodes / previous
+                row[6] += 1
+            profile._last_nodes[id(self)] = nodes
+            if profile.trace:
+                profile._event(f"depth {depth}", start, duration,
+                               {"depth": depth, "nodes": nodes, "tt_hits": hits, "cutoffs": cutoffs})
+        return result
+    return wrapper
+
+
+def _patch(owner, attribute, value):
+    _originals.append((owner, attribute, owner.__dict__[attribute]))
+    setattr(owner, attribute, value)
+
+
+def enabled():
+    """The Profile being collected, or None"""
+    return _profile
+
+
+def enable(trace=False, trace_limit=TRACE_LIMIT):
+    """
+    Starts collecting into a new Profile and returns it. trace=True also keeps one event per
+    call for a Chrome trace. Enabling while already enabled returns the running Profile.
+    """
+    global _profile
+    if _profile is not None:
+        return _profile
+    profile = Profile(trace, trace_limit)
+    GameState = ChessEngine.GameState
+    for name in GAME_STATE_METHODS:
+        fn = GameState.__dict__[name]
+        if name == "getKingMoves":
+            _patch(GameState, name, _king_moves(profile, fn))
+        elif name in ATTACK_LOOKUPS:
+            _patch(GameState, name, _attack_lookup(profile, name, fn))
+        else:
+            _patch(GameState, name, _timed(profile, f"GameState.{name}", fn))
+    for name in ATTACK_FUNCTIONS:
+        _patch(ChessEngine, name, _attack_check(profile, name, ChessEngine.__dict__[name]))
+    Move = ChessEngine.Move
+    _patch(Move, "__init__", _move_init(profile, Move.__dict__["__init__"]))
+    _patch(Move, "fromCode", _move_from_code(profile, Move.__dict__["fromCode"].__func__))
+    _profile = profile
+    _instrument_search()
+    return profile
+
+
+def _instrument_search():
+    """
+    Instruments ChessAI once it has been imported. ChessEngine and ChessAI both call
+    enable_from_environment() as they finish loading, so whichever is imported first,
+    the search is covered as soon as it exists.
+    """
+    global _search_instrumented
+    ChessAI = sys.modules.get("ChessAI")
+    if _search_instrumented or getattr(ChessAI, "Searcher", None) is None:
+        return
+    profile = _profile
+    Searcher = ChessAI.Searcher
+    _patch(Searcher, "search", _timed(profile, "Searcher.search", Searcher.__dict__["search"]))
+    _patch(Searcher, "_search_root", _search_root(profile, Searcher.__dict__["_search_root"]))
+    _patch(Searcher, "evaluate", staticmethod(_timed(profile, "evaluate", Searcher.__dict__["evaluate"].__func__)))
+    _patch(ChessAI, "see", _timed(profile, "see", ChessAI.__dict__["see"]))
+    _search_instrumented = True
+
+
+def disable():
+    """Restores the original functions and returns the finished Profile, or None if not enabled"""
+    global _profile, _search_instrumented
+    profile = _profile
+    if profile is None:
+        return None
+    while _originals:
+        owner, attribute, value = _originals.pop()
+        setattr(owner, attribute, value)
+    profile.end_ns = time.perf_counter_ns()
+    _profile = None
+    _search_instrumented = False
+    return profile
+
+
+def enable_from_environment():
+    """Enables profiling when CHESS_PROFILE names an output file, and writes it at exit"""
+    path = os.environ.get(ENV_PATH)
+    if not path:
+        return None
+    if _profile is not None:
+        _instrument_search()
+        return _profile
+    fmt = os.environ.get(ENV_FORMAT, "json").lower()
+    if fmt not in FORMATS:
+        raise ProfileError(f"{ENV_FORMAT}={fmt!r}, expected one of {', '.join(FORMATS)}")
+    profile = enable(trace=fmt == "chrome")
+    pid = os.getpid()
+
+    def write():
+        if os.getpid() == pid and _profile is profile: # not in forked children
+            disable().write(path, fmt)
+    atexit.register(write)
+    return profile
+
+
+def profile_game(fen=None, plies=10, depth=3, node_limit=None, trace=False):
+    """Plays plies moves of self-play from fen under profiling and returns the Profile"""
+    import ChessAI # not at the top: ChessAI may be what is importing this module
+    gs = ChessEngine.GameState(fen=fen)
+    searcher = ChessAI.Searcher(max_depth=depth, node_limit=node_limit, tt=TranspositionTable())
+    profile = enable(trace)
+    try:
+        for _ in range(plies):
+            valid_moves = gs.getValidMoves() # the UI's view, so Move allocation shows up as it does there
+            if not valid_moves:
+                break
+            move = searcher.search(gs)
+            gs.makeMove(move)
+    finally:
+        disable()
+    return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile move generation and search over a self-play game")
+    parser.add_argument("--fen", help="starting position (default: the standard one)")
+    parser.add_argument("--plies", type=int, default=10, help="moves to play")
+    parser.add_argument("--depth", type=int, default=3, help="search depth per move")
+    parser.add_argument("--nodes", type=int, help="node limit per move")
+    parser.add_argument("--json", help="write the counters to this file as JSON")
+    parser.add_argument("--chrome", help="write a Chrome trace to this file")
+    args = parser.parse_args(argv)
+    profile = profile_game(args.fen, args.plies, args.depth, args.nodes, trace=bool(args.chrome))
+    profile.report()
+    if args.json:
+        profile.write(args.json, "json")
+    if args.chrome:
+        profile.write(args.chrome, "chrome")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
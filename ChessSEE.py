@@ -0,0 +1,63 @@
+"""
+Static exchange evaluation: the material a capture wins or loses once every piece
+that attacks the target square has had its turn to recapture, cheapest first.
+
+see() works on a position's Bitboards and a packed move without making any moves.
+Removing each recapturing piece from the occupancy uncovers the sliders behind it
+(x-rays). Pins and checks are ignored, as usual for SEE.
+"""
+from ChessBitboard import (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, SQUARE_BITS, MOVE_EN_PASSANT, MOVE_PROMOTION,
+                           attackersTo, bishopAttacks, rookAttacks)
+
+# Exchange values by piece type; the king is worth more than anything it could win
+SEE_VALUES = (0, 100, 320, 330, 500, 900, 20000, 0)
+_ORDER = (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING) # recaptures use the cheapest attacker first
+_PROMOTION_TYPES = (KNIGHT, BISHOP, ROOK, QUEEN)
+
+
+def see(bitboards, move):
+    """Material gained by the side making the packed capture move, in centipawns (negative = losing)"""
+    start = move & 63
+    end = move >> 6 & 63
+    flag = move >> 12 & 15
+    moved = move >> 16 & 15
+    pieces = bitboards.pieces
+    occupied = bitboards.occupied ^ SQUARE_BITS[start]
+    gain = [SEE_VALUES[move >> 20 & 7]]
+    onSquare = SEE_VALUES[moved & 7] # value of the piece now standing on end
+    if flag >= MOVE_PROMOTION:
+        onSquare = SEE_VALUES[_PROMOTION_TYPES[flag - MOVE_PROMOTION]]
+        gain[0] += onSquare - SEE_VALUES[PAWN]
+    elif flag == MOVE_EN_PASSANT:
+        occupied ^= SQUARE_BITS[(start & ~7) | (end & 7)]
+
+    diagonal = pieces[BISHOP] | pieces[QUEEN] | pieces[8 | BISHOP] | pieces[8 | QUEEN]
+    straight = pieces[ROOK] | pieces[QUEEN] | pieces[8 | ROOK] | pieces[8 | QUEEN]
+    attackers = (attackersTo(bitboards, end, 0, occupied) | attackersTo(bitboards, end, 1, occupied)) & occupied
+    side = (moved >> 3) ^ 1
+    while True:
+        # The side to recapture looks for its cheapest attacker
+        ours = attackers & bitboards.colors[side]
+        if not ours:
+            break
+        for pieceType in _ORDER:
+            candidates = ours & pieces[side << 3 | pieceType]
+            if candidates:
+                break
+        if pieceType == KING and attackers & bitboards.colors[side ^ 1]:
+            break # the king cannot recapture onto a defended square
+        gain.append(onSquare - gain[-1])
+        bit = candidates & -candidates
+        occupied ^= bit
+        attackers ^= bit
+        if pieceType in (PAWN, BISHOP, QUEEN):
+            attackers |= bishopAttacks(end, occupied) & diagonal & occupied
+        if pieceType in (ROOK, QUEEN):
+            attackers |= rookAttacks(end, occupied) & straight & occupied
+        onSquare = SEE_VALUES[pieceType]
+        side ^= 1
+
+    # Either side may stop capturing when carrying on would lose material
+    for d in range(len(gain) - 1, 0, -1):
+        gain[d - 1] = -max(-gain[d - 1], gain[d])
+    return gain[0]
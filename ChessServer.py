@@ -0,0 +1,474 @@
+"""
+Multi-game server: many games in one asyncio process, reached over TCP or a Unix socket
+with a JSON-lines protocol (one JSON object per line in each direction).
+
+Requests have an "op" and may have an "id", which the reply repeats. Every reply has
+"ok", and "error" when ok is false. Replies about a game carry its "fen" and "status"
+(playing, checkmate, stalemate or draw), plus the legal "moves" in UCI notation when the
+request asks for "moves": true.
+
+    {"op": "new", "fen": ..., "ai": "black"}       -> "session"; "ai" is the computer's side
+    {"op": "move", "session": 7, "move": "e2e4"}   -> the computer's "reply" too, if it has one
+    {"op": "ai", "session": 7}                     -> the computer plays the side to move
+    {"op": "state", "session": 7}
+    {"op": "close", "session": 7}
+    {"op": "stats"}                                -> sessions, AI jobs, resident memory
+
+Sessions never hold a GameState. Each keeps its position packed (32 bytes) and its result.
+A move loads the position into one scratch GameState, checks the move against the legal
+moves of the piece on its start square only, plays it and packs the result again; the
+event loop runs one request at a time, so one scratch state serves every session. Whether
+the game goes on is settled by generating one piece's moves at a time until one is legal;
+only a request for "moves" lists the whole board's. The computer's
+moves are searched in a process pool, and at most ai_queue of them wait at a time.
+
+    python ChessServer.py --port 8765                 # serve on localhost
+    python ChessServer.py --unix /tmp/chess.sock
+    python ChessServer.py --load 10000 --active 1000  # load test against a fresh server
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessAI
+import ChessBitbase
+import ChessBook
+import ChessEngine
+from ChessParallel import WORKER_TT_MB, default_workers
+from ChessTT import TranspositionTable
+
+DEFAULT_PORT = 8765
+AI_TIME_LIMIT = 0.5 # seconds per computer move
+AI_QUEUE_PER_WORKER = 4 # computer moves that may wait per pool worker before requests are refused
+FIFTY_MOVE_PLIES = 100
+_PACKED_FLAGS = 24 # offset of the flags byte in ChessEngine.PACKED_POSITION; bit 0 is set when black is to move
+
+SQUARE_NAMES = ["abcdefgh"[sq & 7] + "87654321"[sq >> 3] for sq in range(64)]
+_SQUARES = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
+_PROMOTION_LETTERS = "nbrq" # flags MOVE_PROMOTION to MOVE_PROMOTION + 3
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def move_to_uci(move):
+    """UCI notation of a packed move, without building a Move object"""
+    text = SQUARE_NAMES[move & 63] + SQUARE_NAMES[move >> 6 & 63]
+    flag = move >> 12 & 15
+    if flag >= ChessEngine.MOVE_PROMOTION:
+        text += _PROMOTION_LETTERS[flag - ChessEngine.MOVE_PROMOTION]
+    return text
+
+
+def _move_key(move):
+    """start | end << 6 | promotion << 12 of a packed move (promotion 1-4, 0 for none)"""
+    flag = move >> 12 & 15
+    promotion = flag - ChessEngine.MOVE_PROMOTION + 1 if flag >= ChessEngine.MOVE_PROMOTION else 0
+    return move & 0xFFF | promotion << 12
+
+
+def _uci_key(text):
+    """_move_key() of a UCI move string"""
+    if not isinstance(text, str) or len(text) not in (4, 5):
+        raise ProtocolError(f"not a UCI move: {text!r}")
+    start = _SQUARES.get(text[:2])
+    end = _SQUARES.get(text[2:4])
+    promotion = _PROMOTION_LETTERS.find(text[4:].lower()) + 1 if len(text) == 5 else 0
+    if start is None or end is None or promotion < 0 or (len(text) == 5 and not promotion):
+        raise ProtocolError(f"not a UCI move: {text!r}")
+    return start | end << 6 | promotion << 12
+
+
+class Session():
+    """One game between requests: packed position and result"""
+    __slots__ = ("packed", "status", "ai_white", "ai_black", "busy")
+
+    def __init__(self, ai_white=False, ai_black=False):
+        self.packed = b""
+        self.status = "playing"
+        self.ai_white = ai_white
+        self.ai_black = ai_black
+        self.busy = False # a computer move is being searched
+
+    def store(self, gs, listing=False):
+        """
+        Packs gs and its result into the session. listing says the reply will list the legal
+        moves, so they are all generated (and indexed for the reply) rather than just the first.
+        """
+        self.packed = gs.getPacked()
+        if listing:
+            gs.legalMoveIndex() # sets checkmate and stalemate
+        else:
+            gs.hasValidMoves()
+        if gs.checkmate:
+            self.status = "checkmate"
+        elif gs.stalemate:
+            self.status = "stalemate"
+        elif gs.halfmoveClock >= FIFTY_MOVE_PLIES:
+            self.status = "draw"
+        else:
+            self.status = "playing"
+
+    def ai_to_move(self):
+        return self.status == "playing" and (self.ai_white if self.packed[_PACKED_FLAGS] & 1 == 0 else self.ai_black)
+
+
+_worker_searcher = None
+
+
+def _ai_task(packed, time_limit, node_limit):
+    """Pool worker: best packed move for a packed position; the searcher persists per process"""
+    global _worker_searcher
+    if _worker_searcher is None:
+        _worker_searcher = ChessAI.Searcher(tt=TranspositionTable(WORKER_TT_MB), bitbases=ChessBitbase.Bitbases(),
+                                            book=ChessBook.load())
+    _worker_searcher.time_limit = time_limit
+    _worker_searcher.node_limit = node_limit
+    return _worker_searcher.search(ChessEngine.GameState.fromPacked(packed))
+
+
+def resident_kb():
+    """Current resident set size of this process in KB (peak size where /proc is missing)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class GameServer():
+    def __init__(self, ai_workers=None, ai_queue=None, ai_time_limit=AI_TIME_LIMIT, ai_node_limit=None):
+        self.sessions = {}
+        self._next_session = 1
+        self._scratch = ChessEngine.GameState()
+        self._loaded = None # the session whose current position the scratch state holds
+        self.ai_workers = ai_workers or default_workers()
+        self.ai_queue = ai_queue or self.ai_workers * AI_QUEUE_PER_WORKER
+        self.ai_time_limit = ai_time_limit
+        self.ai_node_limit = ai_node_limit
+        self.ai_pending = 0
+        self._pool = None # created with the first computer move
+        self.ops = {"new": self.op_new, "move": self.op_move, "ai": self.op_ai, "state": self.op_state,
+                    "close": self.op_close, "stats": self.op_stats}
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, path=None):
+        """Serves until cancelled or sent SIGTERM; the AI pool is shut down either way"""
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        if path:
+            server = await asyncio.start_unix_server(self.handle_client, path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+
+    async def handle_client(self, reader, writer):
+        """Answers one connection's requests; each runs as its own task, so a search blocks nothing else"""
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await writer.drain() # read no more requests while the client leaves its replies unread
+        except (ConnectionError, asyncio.CancelledError): # the client left, or the server is shutting down
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _answer(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ProtocolError("request must be a JSON object")
+            request_id = request.get("id")
+            op = self.ops.get(request.get("op"))
+            if op is None:
+                raise ProtocolError(f"unknown op {request.get('op')!r}")
+            reply = await op(request)
+            reply["ok"] = True
+        except ValueError as e: # json.JSONDecodeError and ProtocolError are ValueErrors
+            reply = {"ok": False, "error": str(e)}
+        except Exception as e: # still answer, and trust the scratch state no more
+            self._loaded = None
+            reply = {"ok": False, "error": f"internal error: {type(e).__name__}: {e}"}
+        if request_id is not None:
+            reply["id"] = request_id
+        writer.write(json.dumps(reply).encode() + b"\n")
+        try:
+            await writer.drain()
+        except ConnectionError: # the client left; handle_client closes the connection
+            pass
+
+    def _session(self, request):
+        session_id = request.get("session")
+        if type(session_id) is not int:
+            raise ProtocolError(f"session must be an integer, not {session_id!r}")
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ProtocolError(f"no session {session_id}")
+        return session
+
+    def _load(self, session):
+        """The scratch GameState holding session's position"""
+        if self._loaded is not session:
+            self._scratch.loadPacked(session.packed)
+            self._loaded = session
+        return self._scratch
+
+    def _store(self, session, listing=False):
+        """Packs the scratch state's position into session"""
+        session.store(self._scratch, listing)
+        self._loaded = session
+
+    def _describe(self, session, request, reply=None):
+        reply = reply if reply is not None else {}
+        gs = self._load(session)
+        reply["fen"] = gs.getFen()
+        reply["status"] = session.status
+        if request.get("moves"):
+            reply["moves"] = [move_to_uci(m) for m in gs.legalMoveIndex()]
+        return reply
+
+    async def op_new(self, request):
+        ai = request.get("ai")
+        if ai not in (None, "white", "black", "both"):
+            raise ProtocolError(f"ai must be white, black or both, not {ai!r}")
+        fen = request.get("fen")
+        if fen is not None and not isinstance(fen, str):
+            raise ProtocolError(f"fen must be a string, not {fen!r}")
+        session = Session(ai in ("white", "both"), ai in ("black", "both"))
+        self._loaded = None # the new position may still be rejected once it is in the scratch state
+        self._scratch.loadFen(fen or ChessEngine.START_FEN)
+        self._store(session, request.get("moves"))
+        session_id = self._next_session
+        self._next_session += 1
+        self.sessions[session_id] = session
+        reply = {"session": session_id}
+        if session.ai_to_move():
+            try:
+                reply["reply"] = await self._play_ai(session, request.get("moves"))
+            except Exception: # the error reply carries no session id, so nobody could reach it
+                del self.sessions[session_id]
+                raise
+        return self._describe(session, request, reply)
+
+    async def op_move(self, request):
+        session = self._session(request)
+        if session.busy:
+            raise ProtocolError("the computer is moving")
+        if session.status != "playing":
+            raise ProtocolError(f"game over: {session.status}")
+        key = _uci_key(request.get("move"))
+        gs = self._load(session)
+        move = next((m for m in gs.getValidMoveCodesFrom(key & 63) if _move_key(m) == key), None)
+        if move is None:
+            raise ProtocolError(f"illegal move {request.get('move')}")
+        gs.makeMove(move)
+        self._store(session, request.get("moves"))
+        reply = {"move": move_to_uci(move)}
+        if session.ai_to_move():
+            reply["reply"] = await self._play_ai(session, request.get("moves"))
+        return self._describe(session, request, reply)
+
+    async def op_ai(self, request):
+        session = self._session(request)
+        if session.busy:
+            raise ProtocolError("the computer is moving")
+        if session.status != "playing":
+            raise ProtocolError(f"game over: {session.status}")
+        return self._describe(session, request, {"reply": await self._play_ai(session, request.get("moves"))})
+
+    async def op_state(self, request):
+        return self._describe(self._session(request), request)
+
+    async def op_close(self, request):
+        if self._session(request) is self._loaded:
+            self._loaded = None
+        del self.sessions[request["session"]]
+        return {}
+
+    async def op_stats(self, request):
+        return {"sessions": len(self.sessions), "ai_pending": self.ai_pending, "rss_kb": resident_kb()}
+
+    async def _play_ai(self, session, listing=False):
+        """Searches the session's position in the pool and plays the result; returns it in UCI"""
+        if self.ai_pending >= self.ai_queue:
+            raise ProtocolError("too many computer moves waiting, try again")
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.ai_workers)
+        self.ai_pending += 1
+        session.busy = True
+        try:
+            move = await asyncio.get_running_loop().run_in_executor(
+                self._pool, _ai_task, session.packed, self.ai_time_limit, self.ai_node_limit)
+        finally:
+            self.ai_pending -= 1
+            session.busy = False
+        if move is None:
+            return None
+        self._load(session).makeMove(move) # other sessions may have used the scratch state meanwhile
+        self._store(session, listing)
+        return move_to_uci(move)
+
+
+async def _request(reader, writer, request):
+    writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    if not reply["ok"]:
+        raise ProtocolError(reply["error"])
+    return reply
+
+
+class _LoadClient():
+    """One load generator connection: creates its sessions, then plays random moves on the active ones"""
+
+    def __init__(self, path, sessions, active, ai_share, rng):
+        self.path = path
+        self.sessions = sessions
+        self.active = active
+        self.ai_share = ai_share
+        self.rng = rng
+        self.games = [] # [session id, legal moves] of the active sessions
+        self.latencies = []
+        self.ai_latencies = []
+        self.refused = 0 # computer moves refused because the pool's queue was full
+
+    async def create(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=1 << 20)
+        for i in range(self.sessions):
+            reply = await _request(self.reader, self.writer, {"op": "new", "moves": i < self.active})
+            if i < self.active:
+                self.games.append([reply["session"], reply["moves"]])
+
+    async def play(self, deadline):
+        reader, writer, rng = self.reader, self.writer, self.rng
+        while self.games and time.perf_counter() < deadline:
+            game = self.games[rng.randrange(len(self.games))]
+            start = time.perf_counter()
+            if rng.random() < self.ai_share:
+                try:
+                    reply = await _request(reader, writer, {"op": "ai", "session": game[0], "moves": True})
+                except ProtocolError:
+                    self.refused += 1
+                    continue
+                self.ai_latencies.append(time.perf_counter() - start)
+            else:
+                reply = await _request(reader, writer, {"op": "move", "session": game[0], "moves": True,
+                                                        "move": rng.choice(game[1])})
+                self.latencies.append(time.perf_counter() - start)
+            game[1] = reply["moves"]
+            if reply["status"] != "playing": # start a fresh game in its place
+                await _request(reader, writer, {"op": "close", "session": game[0]})
+                reply = await _request(reader, writer, {"op": "new", "moves": True})
+                game[0], game[1] = reply["session"], reply["moves"]
+        writer.close()
+
+
+async def _stats(path):
+    reader, writer = await asyncio.open_unix_connection(path)
+    reply = await _request(reader, writer, {"op": "stats"})
+    writer.close()
+    return reply
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_load(sessions=10000, active=1000, clients=50, seconds=10.0, ai_share=0.0, ai_nodes=2000, seed=1):
+    """
+    Starts a server process on a Unix socket, creates sessions spread over clients
+    connections and plays random legal moves on the active ones for seconds. Returns
+    a dict of the measurements.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "chess.sock")
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--unix", path,
+                                   "--ai-nodes", str(ai_nodes)])
+        try:
+            while not os.path.exists(path):
+                if server.poll() is not None:
+                    raise RuntimeError("server exited")
+                await asyncio.sleep(0.05)
+            baseline = (await _stats(path))["rss_kb"]
+            rng = random.Random(seed)
+            players = [_LoadClient(path, sessions // clients + (c < sessions % clients),
+                                   active // clients + (c < active % clients), ai_share, random.Random(rng.random()))
+                       for c in range(clients)]
+            start = time.perf_counter()
+            await asyncio.gather(*(player.create() for player in players))
+            created = time.perf_counter() - start
+            loaded = (await _stats(path))["rss_kb"]
+            start = time.perf_counter()
+            await asyncio.gather(*(player.play(start + seconds) for player in players))
+            elapsed = time.perf_counter() - start
+            played = (await _stats(path))["rss_kb"]
+        finally:
+            server.terminate()
+            server.wait()
+    latencies = [t for player in players for t in player.latencies]
+    ai_latencies = [t for player in players for t in player.ai_latencies]
+    return {"sessions": sessions, "active": active, "clients": clients, "create_s": created,
+            "moves": len(latencies), "moves_per_s": len(latencies) / elapsed,
+            "p50_ms": _percentile(latencies, 0.5) * 1000, "p99_ms": _percentile(latencies, 0.99) * 1000,
+            "ai_moves": len(ai_latencies), "ai_refused": sum(player.refused for player in players), "ai_p50_ms": _percentile(ai_latencies, 0.5) * 1000,
+            "ai_p99_ms": _percentile(ai_latencies, 0.99) * 1000, "rss_kb": played,
+            "kb_per_1k_sessions": (loaded - baseline) * 1000 / sessions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve many games over JSON lines, or load test a server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--ai-workers", type=int, help="processes searching computer moves")
+    parser.add_argument("--ai-time", type=float, default=AI_TIME_LIMIT, help="seconds per computer move")
+    parser.add_argument("--ai-nodes", type=int, help="node budget per computer move")
+    parser.add_argument("--load", type=int, metavar="SESSIONS", help="load test a fresh server with this many sessions")
+    parser.add_argument("--active", type=int, default=1000, help="load test: sessions that play moves")
+    parser.add_argument("--clients", type=int, default=50, help="load test: connections")
+    parser.add_argument("--seconds", type=float, default=10.0, help="load test: time spent playing")
+    parser.add_argument("--ai-share", type=float, default=0.0, help="load test: fraction of requests for computer moves")
+    args = parser.parse_args(argv)
+    if args.load:
+        result = asyncio.run(run_load(args.load, min(args.active, args.load), args.clients, args.seconds,
+                                      args.ai_share, args.ai_nodes or 2000))
+        print(f"{result['sessions']:,} sessions ({result['active']:,} active) over {result['clients']} "
+              f"connections, created in {result['create_s']:.2f}s")
+        print(f"moves: {result['moves']:,}, {result['moves_per_s']:,.0f}/s, "
+              f"p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms")
+        if result["ai_moves"]:
+            print(f"computer moves: {result['ai_moves']:,}, p50 {result['ai_p50_ms']:.0f} ms, "
+                  f"p99 {result['ai_p99_ms']:.0f} ms, {result['ai_refused']:,} refused (queue full)")
+        print(f"server memory: {result['rss_kb'] / 1024:,.1f} MB resident, "
+              f"{result['kb_per_1k_sessions']:,.0f} KB per 1k sessions")
+        return 0
+    server = GameServer(args.ai_workers, ai_time_limit=args.ai_time, ai_node_limit=args.ai_nodes)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Fixed-size transposition table for ChessAI, keyed by GameState.zobristKey.
+
+Entries live in two flat arrays of unsigned 64-bit ints (keys and packed data), 16 bytes
+per entry. Buckets hold two entries: the first keeps the deepest result seen for its
+positions, the second is always overwritten, so shallow recent results still get a home.
+"""
+from array import array
+
+EXACT, LOWER, UPPER = 1, 2, 3 # bound types: exact score, fail-high (>= score), fail-low (<= score)
+
+ENTRY_BYTES = 16
+DEFAULT_SIZE_MB = 16
+
+# data = move (24 bits) | depth (8 bits) << 24 | bound (2 bits) << 32 | score + SCORE_OFFSET << 34
+_MOVE_MASK = (1 << 24) - 1
+SCORE_OFFSET = 1 << 20
+
+
+class TranspositionTable():
+    def __init__(self, size_mb=DEFAULT_SIZE_MB):
+        buckets = 1
+        while buckets * 4 * ENTRY_BYTES <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.size_mb = size_mb
+        self.mask = buckets - 1
+        self.keys = array("Q", bytes(buckets * 2 * 8))
+        self.data = array("Q", bytes(buckets * 2 * 8))
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0 # misses where the bucket was full of other positions
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.keys = array("Q", bytes(len(self.keys) * 8))
+        self.data = array("Q", bytes(len(self.data) * 8))
+        self.hits = self.misses = self.collisions = 0
+
+    def probe(self, key):
+        """Returns (move, depth, score, bound) stored for key, or None"""
+        i = (key & self.mask) << 1
+        keys = self.keys
+        if keys[i] == key:
+            data = self.data[i]
+        elif keys[i + 1] == key:
+            data = self.data[i + 1]
+        else:
+            self.misses += 1
+            if self.data[i] and self.data[i + 1]:
+                self.collisions += 1
+            return None
+        if not data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data & _MOVE_MASK, data >> 24 & 0xFF, (data >> 34) - SCORE_OFFSET, data >> 32 & 3
+
+    def store(self, key, depth, score, bound, move):
+        i = (key & self.mask) << 1
+        data = (move or 0) | depth << 24 | bound << 32 | (score + SCORE_OFFSET) << 34
+        keys = self.keys
+        if keys[i] == key or depth >= (self.data[i] >> 24 & 0xFF) or not self.data[i]:
+            keys[i] = key
+            self.data[i] = data
+        else:
+            keys[i + 1] = key
+            self.data[i + 1] = data
+
+    def usage(self):
+        """Fraction of entries in use"""
+        return sum(1 for d in self.data if d) / len(self.data)
@@ -0,0 +1,299 @@
+"""
+Headless UCI (Universal Chess Interface) front end for GameState and ChessAI, for
+tournament managers and analysis GUIs.
+
+The main thread only reads commands, and searches run on a thread of their own, so
+isready, stop and ponderhit are answered while a search is running. go supports
+wtime/btime/winc/binc/movestogo, movetime, depth, nodes, infinite and ponder, and
+reports an info line after every completed iteration.
+
+Nothing here imports pygame or loads images, so the engine is ready as soon as its
+modules are imported. The transposition table, bitbases and opening book are set up
+on the first isready or go.
+
+    python ChessUCI.py
+"""
+import sys
+import threading
+import time
+
+import ChessAI
+import ChessBitbase
+import ChessBook
+import ChessEngine
+from ChessTT import TranspositionTable, DEFAULT_SIZE_MB
+
+ENGINE_NAME = "ChessAI"
+ENGINE_AUTHOR = "ChessAI authors"
+MAX_HASH_MB = 1024
+MOVE_OVERHEAD = 0.05 # seconds kept back from the clock for the GUI and budget check latency
+DEFAULT_MOVES_TO_GO = 30 # moves the remaining time is spread over when the GUI does not say
+
+
+def move_to_uci(move):
+    """Long algebraic notation of a packed move: e2e4, e7e8q, e1g1 for castling"""
+    return ChessEngine.Move.fromCode(move).getChessNotation()
+
+
+def uci_to_move(gs, text, moves=None):
+    """Legal packed move of gs for a UCI move string, or None"""
+    moves = gs.getValidMoveCodes() if moves is None else moves
+    text = text.lower()
+    for move in moves:
+        if move_to_uci(move) == text:
+            return move
+    return None
+
+
+def time_budget(params, white_to_move):
+    """Seconds to spend on a move given the go parameters (milliseconds), or None for no limit"""
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.0)
+    remaining = params.get("wtime" if white_to_move else "btime")
+    if remaining is None:
+        return None
+    remaining /= 1000
+    increment = params.get("winc" if white_to_move else "binc", 0) / 1000
+    moves_to_go = params.get("movestogo") or DEFAULT_MOVES_TO_GO
+    budget = remaining / moves_to_go + increment * 0.75
+    return max(min(budget, remaining - MOVE_OVERHEAD), 0.0)
+
+
+def score_to_uci(score):
+    """UCI score field: cp in centipawns, or mate in moves (negative when being mated)"""
+    if score >= ChessAI.MATE_THRESHOLD:
+        return f"mate {(ChessAI.CHECKMATE - score + 1) // 2}"
+    if score <= -ChessAI.MATE_THRESHOLD:
+        return f"mate {-((ChessAI.CHECKMATE + score) // 2)}"
+    return f"cp {score}"
+
+
+def _int(text, name):
+    """Integer value of a command argument, with a ValueError that names the argument"""
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"{name} expects an integer, not {text!r}") from None
+
+
+class UCIEngine():
+    """
+    One UCI session. handle() takes a command line and returns False on quit; run()
+    reads commands from a stream until quit or end of input. Output goes to out, one
+    flushed line at a time, from whichever thread produces it.
+    """
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self._out_lock = threading.Lock()
+        self.gs = ChessEngine.GameState()
+        self.hash_mb = DEFAULT_SIZE_MB
+        self.own_book = True
+        self.tt = None
+        self._stale = False # options changed since the tables were made
+        self.bitbases = None
+        self.book = None
+        self.searcher = None
+        self._thread = None # running search
+        self._searching = None # the GameState it searches; position may replace self.gs meanwhile
+        self._release = None # set when the running search may report its bestmove
+        self._params = {} # go parameters of the running search
+        self._pondering = False
+        self.commands = {
+            "uci": self.uci, "isready": self.isready, "setoption": self.setoption,
+            "ucinewgame": self.ucinewgame, "position": self.position, "go": self.go,
+            "stop": self.stop, "ponderhit": self.ponderhit,
+        }
+
+    def send(self, line):
+        with self._out_lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def run(self, source=sys.stdin):
+        try:
+            for line in source:
+                if not self.handle(line):
+                    break
+        finally:
+            self.stop()
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        if tokens[0] == "quit":
+            return False
+        command = self.commands.get(tokens[0])
+        if command is None:
+            self.send(f"info string unknown command {tokens[0]}")
+        else:
+            try:
+                command(tokens[1:])
+            except ValueError as e:
+                self.send(f"info string {tokens[0]}: {e}")
+            except Exception as e: # a bad command line must not end the session
+                self.send(f"info string {tokens[0]}: {type(e).__name__} {e}")
+        return True
+
+    def _tables(self):
+        """
+        Creates the search tables on first use, so starting up costs nothing. Only called
+        while no search runs: setoption just marks the tables stale, as a running search
+        (and its info and bestmove lines) still reads them.
+        """
+        if self.tt is None or self._stale:
+            self._stale = False
+            self.tt = TranspositionTable(self.hash_mb)
+            self.bitbases = ChessBitbase.Bitbases()
+            self.book = ChessBook.load() if self.own_book else None
+            self.searcher = ChessAI.Searcher(tt=self.tt, bitbases=self.bitbases, book=self.book,
+                                             info=self._info)
+
+    def uci(self, args):
+        self.send(f"id name {ENGINE_NAME}")
+        self.send(f"id author {ENGINE_AUTHOR}")
+        self.send(f"option name Hash type spin default {DEFAULT_SIZE_MB} min 1 max {MAX_HASH_MB}")
+        self.send("option name OwnBook type check default true")
+        self.send("option name Ponder type check default false")
+        self.send("uciok")
+
+    def isready(self, args):
+        if self._thread is None:
+            self._tables()
+        self.send("readyok")
+
+    def setoption(self, args):
+        text = " ".join(args)
+        name, _, value = text.partition(" value ")
+        name = name.removeprefix("name ").strip().lower()
+        value = value.strip()
+        if name == "hash":
+            self.hash_mb = max(1, min(_int(value, "Hash"), MAX_HASH_MB))
+            self._stale = True # recreated at the new size before the next search
+        elif name == "ownbook":
+            self.own_book = value.lower() == "true"
+            self._stale = True
+        elif name != "ponder": # the GUI tells us whether pondering is allowed; go ponder is what counts
+            raise ValueError(f"no option {name!r}")
+
+    def ucinewgame(self, args):
+        self.stop()
+        if self.tt is not None:
+            self.tt.clear()
+
+    def position(self, args):
+        if not args:
+            raise ValueError("expected startpos or fen")
+        moves_at = args.index("moves") if "moves" in args else len(args)
+        if args[0] == "startpos":
+            gs = ChessEngine.GameState()
+        elif args[0] == "fen":
+            gs = ChessEngine.GameState(fen=" ".join(args[1:moves_at]))
+        else:
+            raise ValueError(f"expected startpos or fen, not {args[0]!r}")
+        for text in args[moves_at + 1:]:
+            move = uci_to_move(gs, text)
+            if move is None:
+                raise ValueError(f"illegal move {text}")
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, args):
+        params = {}
+        infinite = ponder = False
+        i = 0
+        while i < len(args):
+            name = args[i]
+            if name == "infinite":
+                infinite = True
+            elif name == "ponder":
+                ponder = True
+            elif name in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes"):
+                i += 1
+                if i == len(args):
+                    raise ValueError(f"{name} needs a value")
+                params[name] = _int(args[i], name)
+            i += 1
+        self.stop()
+        self._tables()
+        searcher = self.searcher
+        searcher.max_depth = params.get("depth", ChessAI.MAX_DEPTH)
+        searcher.node_limit = params.get("nodes")
+        searcher.time_limit = None if infinite or ponder else time_budget(params, self.gs.whiteToMove)
+        searcher.book = None if infinite or ponder else self.book # analysis wants a search, not the book
+        self._params = params
+        self._pondering = ponder
+        self._start = time.perf_counter()
+        self._searching = self.gs
+        self._release = threading.Event()
+        if not (infinite or ponder):
+            self._release.set()
+        self._thread = threading.Thread(target=self._search, args=(self.gs, searcher, self._release), daemon=True)
+        self._thread.start()
+
+    def _search(self, gs, searcher, release):
+        best = searcher.search(gs)
+        if searcher.from_book:
+            self.send(f"info string book move {move_to_uci(best)}")
+        release.wait() # infinite and ponder searches report only once told to
+        if best is None:
+            self.send("bestmove 0000")
+            return
+        pv = self._pv(gs, best, 2)
+        line = f"bestmove {move_to_uci(best)}"
+        if len(pv) > 1:
+            line += f" ponder {move_to_uci(pv[1])}"
+        self.send(line)
+
+    def _pv(self, gs, best, length):
+        """Principal variation: best, then the hash moves of the positions it leads to"""
+        pv = [best]
+        gs.makeMove(best)
+        seen = {gs.zobristKey}
+        while len(pv) < length:
+            entry = self.tt.probe(gs.zobristKey)
+            move = entry[0] if entry else None
+            if not move or move not in gs.getValidMoveCodes():
+                break
+            pv.append(move)
+            gs.makeMove(move)
+            if gs.zobristKey in seen:
+                break
+            seen.add(gs.zobristKey)
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+    def _info(self, searcher):
+        """Called on the search thread after every completed iteration"""
+        elapsed = time.perf_counter() - self._start
+        pv = self._pv(self._searching, searcher.best_move, searcher.depth) if searcher.best_move else []
+        self.send(f"info depth {searcher.depth} score {score_to_uci(searcher.score)} nodes {searcher.nodes} "
+                  f"nps {searcher.nps} time {int(elapsed * 1000)} pv {' '.join(move_to_uci(m) for m in pv)}")
+
+    def stop(self, args=None):
+        """Stops the running search, if any, and waits for its bestmove"""
+        if self._thread is None:
+            return
+        self.searcher.stop()
+        self._release.set()
+        self._thread.join()
+        self._thread = None
+
+    def ponderhit(self, args):
+        """The opponent played the expected move: the ponder search becomes a timed search"""
+        if self._thread is None or not self._pondering:
+            return
+        self._pondering = False
+        self.searcher.set_time_limit(time_budget(self._params, self._searching.whiteToMove))
+        self._release.set()
+
+
+def main(argv=None):
+    UCIEngine().run(sys.stdin)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Zobrist hashing for ChessEngine.GameState.
+
+The random tables are drawn from a fixed seed, so a position has the same key in
+every process and every run and keys can be stored on disk or sent to workers.
+"""
+import random
+
+from ChessBitboard import EMPTY, PIECE_NAMES
+
+ZOBRIST_SEED = 0x5EEDC0DE
+
+_rng = random.Random(ZOBRIST_SEED)
+# PIECE_SQUARE[pieceCode][sq]; rows for unused piece codes stay zero.
+PIECE_SQUARE = [[_rng.getrandbits(64) for _ in range(64)] if code != EMPTY and PIECE_NAMES[code] != "--"
+                else [0] * 64 for code in range(16)]
+SIDE_TO_MOVE = _rng.getrandbits(64)  # XORed in when black is to move
+CASTLING = [_rng.getrandbits(64) for _ in range(16)]  # indexed by the 4-bit castling rights
+EN_PASSANT_FILE = [_rng.getrandbits(64) for _ in range(8)]
+del _rng
+
+
+def computeKey(mailbox, whiteToMove, castlingRights, enpassantSquare):
+    """Key of a position from scratch; GameState keeps it up to date incrementally"""
+    key = 0
+    for sq, code in enumerate(mailbox):
+        if code != EMPTY:
+            key ^= PIECE_SQUARE[code][sq]
+    if not whiteToMove:
+        key ^= SIDE_TO_MOVE
+    key ^= CASTLING[castlingRights]
+    if enpassantSquare is not None:
+        key ^= EN_PASSANT_FILE[enpassantSquare & 7]
+    return key
@@ -0,0 +1,71 @@
+"""ChessBatchEval.evaluate_batch against the scalar evaluation, one GameState at a time"""
+import random
+
+import pytest
+
+numpy = pytest.importorskip("numpy", minversion="2") # evaluate_batch needs numpy.bitwise_count
+
+import ChessAI
+import ChessBatchEval
+import ChessEngine
+from ChessBitboard import WHITE, BLACK, PAWN
+
+# Extra promoted pieces, underpromotions, and positions without pawns
+FENS = [
+    "QQQ1k3/8/8/8/8/8/8/4K3 b - - 0 1",
+    "4k3/8/8/8/8/8/8/nnn1K3 w - - 0 1",
+    "1r2k3/8/8/8/8/8/8/RR2K1BB w - - 0 1",
+    "4k3/8/8/8/8/8/8/4K3 w - - 0 1",
+    "rnbqkbnr/8/8/8/8/8/8/RNBQKBNR w KQkq - 0 1",
+    "3qk3/P6P/8/8/8/8/p6p/3QK3 w - - 0 1",
+    "8/PPPPk3/8/8/8/8/4Kppp/8 b - - 0 1",
+]
+
+
+def random_positions(start_fen=None, games=20, plies=120, seed=7):
+    """Positions along seeded random games; promotions are played whenever one is legal"""
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(games):
+        gs = ChessEngine.GameState(fen=start_fen)
+        for _ in range(rng.randrange(plies)):
+            moves = gs.getValidMoveCodes()
+            if not moves:
+                break
+            promotions = [m for m in moves if m >> 12 & 15 >= ChessEngine.MOVE_PROMOTION]
+            gs.makeMove(rng.choice(promotions or moves))
+            positions.append(ChessEngine.GameState(fen=gs.getFen()))
+    return positions
+
+
+def assert_batch_matches(positions):
+    scores = ChessBatchEval.evaluate_batch(ChessBatchEval.pack_positions(positions))
+    assert len(scores) == len(positions)
+    for gs, score in zip(positions, scores):
+        assert int(score) == ChessBatchEval.evaluate_position(gs), gs.getFen()
+
+
+def test_random_games():
+    assert_batch_matches(random_positions())
+
+
+@pytest.mark.parametrize("fen", FENS)
+def test_promotions_and_pawnless_positions(fen):
+    positions = [ChessEngine.GameState(fen=fen)] + random_positions(fen, games=5, plies=30)
+    assert_batch_matches(positions)
+
+
+def test_pawnless_positions_have_no_pawn_terms():
+    positions = [gs for gs in random_positions(FENS[4], games=5, plies=60)
+                 if not gs.bitboards.pieces[WHITE << 3 | PAWN] | gs.bitboards.pieces[BLACK << 3 | PAWN]]
+    assert positions
+    assert_batch_matches(positions)
+
+
+def test_material_terms_match_chess_eval():
+    # Bare kings have no mobility or pawn terms, so only ChessEval's tapered sums remain
+    positions = [ChessEngine.GameState(fen=fen) for fen in ("4k3/8/8/8/8/8/8/4K3 w - - 0 1",
+                                                            "k7/8/8/8/8/8/8/7K b - - 0 1")]
+    scores = ChessBatchEval.evaluate_batch(ChessBatchEval.pack_positions(positions))
+    assert [int(s) for s in scores] == [ChessAI.evaluate(gs) for gs in positions]
+